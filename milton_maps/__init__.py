@@ -2,4 +2,28 @@
 
 __version__ = "0.2.0"
 
-from milton_maps.milton_maps import *  # noqa: F401, F403
+import importlib.util
+
+
+def __getattr__(name):
+    # The package API (``mm.plot_map``, ``mm.USE_CODES``, ...) is defined in
+    # milton_maps.milton_maps, which imports geopandas.  It is imported on first use so that
+    # importing a light submodule, e.g. for the command line, doesn't pay for it.
+    if name.startswith("__") or importlib.util.find_spec(f"{__name__}.{name}"):
+        # Submodules are imported by the import system, not looked up here
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from milton_maps import milton_maps as api
+
+    try:
+        value = getattr(api, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    # Later lookups find it in the module's namespace, without coming back here
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    from milton_maps import milton_maps as api
+
+    return sorted(set(globals()) | {n for n in dir(api) if not n.startswith("_")})
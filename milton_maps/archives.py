@@ -0,0 +1,86 @@
+"""Paths to datasets inside zip archives.
+
+Raw MassGIS downloads are zip archives of shapefiles or file geodatabases.  Rather than
+extracting them, datasets are read in place through GDAL's virtual file system, which
+decompresses only the members of the requested layer.  A dataset inside an archive is
+addressed as ``zip://<archive>!<member>``, e.g. ``zip://data/raw/openspace.zip!OPENSPACE_POLY.shp``.
+These paths can be passed to ``artifacts.read_artifact``, ``geopandas.read_file`` and
+``fiona.listlayers``.  GDAL's own ``/vsizip/<archive>/<member>`` form is also understood.
+"""
+import re
+import zipfile
+from pathlib import Path
+
+_ARCHIVE_PATH = re.compile(r"^zip://(?P<archive>.+?\.zip)(?:!(?P<member>.*))?$", re.I)
+_VSIZIP_PATH = re.compile(r"^/vsizip/(?P<archive>.+?\.zip)(?:/(?P<member>.*))?$", re.I)
+
+
+def archive_member(archive_path, member: str) -> str:
+    """Path of ``member`` inside the zip archive at ``archive_path``"""
+    return f"zip://{archive_path}!{member}"
+
+
+def split_archive_path(path):
+    """Split a path into its zip archive and the member within it.
+
+    Returns:
+        tuple: ``(archive, member)``, or ``(None, None)`` if ``path`` isn't inside an archive.
+            ``member`` is ``None`` for the archive's root.
+    """
+    match = _ARCHIVE_PATH.match(str(path)) or _VSIZIP_PATH.match(str(path))
+    if match is None:
+        return None, None
+    return match.group("archive"), match.group("member") or None
+
+
+def is_archive_path(path) -> bool:
+    return split_archive_path(path)[0] is not None
+
+
+def archive_of(path) -> str:
+    """The file holding ``path``: its zip archive if it is inside one, else ``path`` itself"""
+    archive, _ = split_archive_path(path)
+    return str(path) if archive is None else archive
+
+
+def member_size(path) -> int:
+    """Compressed size of the archive members making up the dataset at ``path``.
+
+    Shapefile sidecars (``.dbf``, ``.shx``, ...) and the contents of ``.gdb`` directories
+    count towards the dataset's size.
+    """
+    archive, member = split_archive_path(path)
+    with zipfile.ZipFile(archive) as zf:
+        if member is None:
+            return sum(info.compress_size for info in zf.infolist())
+        member = member.rstrip("/")
+        if member.lower().endswith(".gdb"):
+            prefix = member + "/"
+        else:
+            prefix = str(Path(member).with_suffix("")) + "."
+        return sum(
+            info.compress_size
+            for info in zf.infolist()
+            if info.filename.startswith(prefix)
+        )
+
+
+def find_members(archive_path, pattern) -> list:
+    """Paths of the members of a zip archive, or of the ``.gdb`` directories in it, whose
+    names match the compiled regular expression ``pattern``"""
+    with zipfile.ZipFile(archive_path) as zf:
+        names = set()
+        for name in zf.namelist():
+            # File geodatabases are directories, which zip files may not list explicitly
+            parts = name.rstrip("/").split("/")
+            for i, part in enumerate(parts):
+                if part.lower().endswith(".gdb"):
+                    names.add("/".join(parts[: i + 1]))
+                    break
+            else:
+                names.add(name.rstrip("/"))
+    return [
+        archive_member(archive_path, name)
+        for name in sorted(names)
+        if pattern.search(name.split("/")[-1])
+    ]
@@ -0,0 +1,155 @@
+"""Reading and writing processed pipeline artifacts.
+
+Processed outputs can be written in three formats, chosen by file extension:
+
+- ``.parquet``: columnar GeoParquet. Column names are preserved in full, and reads can be
+  restricted to a subset of columns and to the row groups matching a filter.  Geometries can
+  optionally be stored quantized to a coarser grid, e.g. centimeters (see ``quantized``).
+- ``.pkl``: a joblib pickle of the whole dataframe.
+- anything else (e.g. ``.shp.zip``): an ESRI shapefile, via ``geopandas.to_file``.
+
+Raw inputs can also be read straight from their zip archives, with paths such as
+``zip://data/raw/openspace.zip!OPENSPACE_POLY.shp`` (see ``archives``).
+"""
+import json
+from pathlib import Path
+
+import geopandas as gpd
+import joblib
+import pandas as pd
+import pyarrow.parquet as pq
+
+from milton_maps.logging_config import record_read, record_write
+from milton_maps.quantized import quantized_encoding, quantized_table, read_quantized
+
+PARQUET_SUFFIXES = (".parquet", ".geoparquet")
+
+# Rows per parquet row group.  Small enough that filtered reads skip most of a statewide
+# file, large enough to keep per-group metadata overhead negligible.
+DEFAULT_ROW_GROUP_SIZE = 50_000
+
+
+def is_parquet(path) -> bool:
+    return str(path).lower().endswith(PARQUET_SUFFIXES)
+
+
+def is_parquet_dataset(path) -> bool:
+    """Whether ``path`` is a directory of parquet files, e.g. one file per town"""
+    return Path(path).is_dir() and any(Path(path).glob("*.parquet"))
+
+
+def write_artifact(
+    df: pd.DataFrame,
+    path,
+    sort_by: str = None,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    quantize: float = None,
+):
+    """Write a processed (Geo)DataFrame in the format implied by the extension of ``path``.
+
+    Args:
+        df (pandas.DataFrame): the frame to write.  GeoDataFrames are written as GeoParquet.
+        path: output path.
+        sort_by (str): optional column to sort by before writing parquet, so that row group
+            statistics on that column are selective, e.g. ``TOWN_ID``.
+        row_group_size (int): maximum rows per parquet row group.
+        quantize (float): optional grid size, in CRS units, to round geometry coordinates
+            to, e.g. 0.01 for centimeters.  The geometries are stored as delta-encoded
+            integers, several times smaller than full precision.  Only supported for parquet.
+    """
+    if quantize is not None and not is_parquet(path):
+        raise ValueError(f"Quantized geometries must be written to parquet, got {path}")
+    if is_parquet(path):
+        if sort_by is not None:
+            df = df.sort_values(sort_by, kind="stable")
+        if quantize is not None:
+            # zstd packs the small integer steps of the coordinates much tighter than snappy
+            pq.write_table(
+                quantized_table(df, quantize),
+                path,
+                row_group_size=row_group_size,
+                compression="zstd",
+            )
+        else:
+            df.to_parquet(path, row_group_size=row_group_size)
+    elif str(path).lower().endswith(".pkl"):
+        joblib.dump(df, path)
+    else:
+        df.to_file(path, driver="ESRI Shapefile")
+    record_write(path, df)
+
+
+def _parquet_schema(path):
+    if Path(path).is_dir():
+        path = min(Path(path).glob("*.parquet"))
+    return pq.read_schema(path)
+
+
+def _parquet_geometry_columns(schema) -> list:
+    metadata = schema.metadata or {}
+    if b"geo" not in metadata:
+        return []
+    return list(json.loads(metadata[b"geo"])["columns"])
+
+
+def read_artifact(path, columns: list = None, filters: list = None) -> pd.DataFrame:
+    """Read a processed artifact written by ``write_artifact``, or a raw vector file.
+
+    Args:
+        path: path to a ``.parquet`` file or a directory of them, a ``.pkl``, or any file
+            readable by ``geopandas.read_file``, including datasets inside zip archives.
+        columns (list): optional columns to load.  Parquet and vector files read only these
+            columns from disk; pickles are subset after loading.  If no geometry column is
+            requested, a plain DataFrame is returned.
+        filters (list): optional pyarrow filters, e.g. ``[("TOWN_ID", "==", 189)]``.  Parquet
+            reads skip row groups whose statistics exclude the filter.  Only supported for
+            parquet artifacts.
+
+    Quantized geometries are decoded only if the geometry column is requested.  Use
+    ``quantized.read_quantized`` to decode them on access instead.
+
+    Returns:
+        pandas.DataFrame or geopandas.GeoDataFrame
+    """
+    if is_parquet(path) or is_parquet_dataset(path):
+        schema = _parquet_schema(path)
+        encoding = quantized_encoding(schema)
+        if encoding is not None:
+            name = encoding["column"]
+            if columns is not None and name not in columns:
+                df = pd.read_parquet(path, columns=columns, filters=filters)
+            else:
+                df = read_quantized(path, columns, filters).to_geodataframe()
+                if columns is not None:
+                    df = df[columns]
+            record_read(path, df)
+            return df
+
+        geometry_columns = _parquet_geometry_columns(schema)
+        if geometry_columns and (
+            columns is None or any(c in columns for c in geometry_columns)
+        ):
+            df = gpd.read_parquet(path, columns=columns, filters=filters)
+        else:
+            df = pd.read_parquet(path, columns=columns, filters=filters)
+        record_read(path, df)
+        return df
+
+    if filters is not None:
+        raise ValueError(
+            f"Row filters are only supported for parquet files, got {path}"
+        )
+    if str(path).lower().endswith(".pkl"):
+        df = joblib.load(path)
+    elif columns is not None:
+        df = gpd.read_file(
+            path,
+            include_fields=[c for c in columns if c != "geometry"],
+            ignore_geometry="geometry" not in columns,
+        )
+    else:
+        df = gpd.read_file(path)
+    record_read(path, df)
+    if columns is not None:
+        df = df[columns]
+    return df
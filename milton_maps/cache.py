@@ -0,0 +1,301 @@
+"""Two-tier cache for reference layers that are expensive to read and filter.
+
+Loaders such as ``process_crash_data.get_milton_boundaries`` read a large source file and keep
+a small slice of it.  ``LayerCache`` memoizes the filtered result:
+
+1. in process, in an LRU of at most ``max_memory_entries`` frames, and
+2. on disk, as a GeoParquet file keyed by the content hash of the source file, the loader
+   name and the filter parameters.  The disk tier is trimmed to ``max_disk_bytes`` by
+   deleting the least recently used entries.
+
+Because the key includes the source content hash, refreshing a raw file (e.g. ``dvc pull``)
+invalidates its cached slices without any explicit eviction.
+
+``ArrayCache`` applies the same scheme to loaders returning dicts of numpy arrays, such as
+the crash hot-spot grids of ``crash_hotspots``, which are stored as ``.npz`` files.
+``ArrowCache`` stores Arrow tables as uncompressed Feather files and memory maps them, so
+processes loading the same table share one copy in the page cache (see ``crash_store``).
+"""
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pyarrow import feather
+
+from milton_maps.archives import split_archive_path
+from milton_maps.artifacts import read_artifact, write_artifact
+
+logger = logging.getLogger("cache")
+
+ROOT_DIR = Path(__file__).parent.parent
+CACHE_DIR = Path(
+    os.environ.get("MILTON_MAPS_CACHE_DIR", ROOT_DIR / "data/interim/cache")
+)
+
+# Bump to invalidate every cached entry when the cache format changes.
+CACHE_VERSION = 1
+
+_digests = {}
+
+
+def file_digest(path) -> str:
+    """Content hash of the file at ``path``.
+
+    Hashing a statewide source takes a noticeable fraction of a second, so digests are
+    memoized for the life of the process on (path, size, modification time).  A dataset inside
+    a zip archive (see ``archives``) is identified by the archive's hash and the member name.
+    """
+    archive, member = split_archive_path(path)
+    if archive is not None:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{file_digest(archive)}!{member or ''}".encode())
+        return digest.hexdigest()
+    stat = os.stat(path)
+    stamp = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if stamp not in _digests:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _digests[stamp] = digest.hexdigest()
+    return _digests[stamp]
+
+
+def _code_objects(code):
+    """``code`` and the code objects nested in it, e.g. of lambdas and comprehensions"""
+    yield code
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            yield from _code_objects(const)
+
+
+def _update_value_digest(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(pd.util.hash_pandas_object(value).values.tobytes())
+    elif isinstance(value, (set, frozenset)):
+        digest.update(repr(sorted(value, key=repr)).encode())
+    elif value is None or isinstance(
+        value, (str, bytes, int, float, list, tuple, dict, np.generic, Path)
+    ):
+        digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+    else:
+        # Loggers, locks, caches and the like: their type, as their repr may hold a memory
+        # address or run-time state
+        digest.update(type(value).__qualname__.encode())
+
+
+def _update_code_digest(digest, func, seen: set):
+    if func in seen:
+        return
+    seen.add(func)
+    names = set()
+    for code in _code_objects(func.__code__):
+        digest.update(code.co_code)
+        # Nested code objects are hashed above; their repr holds a memory address
+        digest.update(
+            repr([c for c in code.co_consts if not inspect.iscode(c)]).encode()
+        )
+        names.update(code.co_names)
+
+    closure = zip(func.__code__.co_freevars, func.__closure__ or ())
+    values = {name: cell.cell_contents for name, cell in closure}
+    values.update(
+        (name, func.__globals__[name])
+        for name in sorted(names)
+        if name in func.__globals__
+    )
+    values["__defaults__"] = func.__defaults__
+    values["__kwdefaults__"] = func.__kwdefaults__
+    for name, value in values.items():
+        digest.update(name.encode())
+        if inspect.isfunction(value):
+            _update_code_digest(digest, value, seen)
+        elif inspect.ismodule(value) or inspect.isclass(value) or callable(value):
+            # Imported modules, classes and builtins: their names, not their contents
+            digest.update(getattr(value, "__name__", type(value).__name__).encode())
+        else:
+            _update_value_digest(digest, value)
+
+
+def code_digest(func) -> str:
+    """Hash of the bytecode of ``func`` and of the values it reads: its defaults, the
+    variables of its closure and the globals it names.  The functions among them are hashed
+    the same way, so editing a helper or a constant that ``func`` relies on changes the hash.
+
+    Pass it to a cached loader to invalidate its entries when the code that produced them
+    changes.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    _update_code_digest(digest, func, set())
+    return digest.hexdigest()
+
+
+class LayerCache:
+    """In-process LRU backed by an on-disk GeoParquet cache of filtered layers.
+
+    Args:
+        cache_dir: directory for the on-disk tier.
+        max_memory_entries (int): number of frames kept in the in-process LRU.
+        max_disk_bytes (int): size limit of the on-disk tier.
+    """
+
+    # Extension of the files of the on-disk tier
+    suffix = ".parquet"
+
+    def __init__(
+        self,
+        cache_dir=CACHE_DIR,
+        max_memory_entries: int = 16,
+        max_disk_bytes: int = 2 * 1024**3,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+
+    def key(self, source_path, loader, params: dict) -> str:
+        description = json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "source": file_digest(source_path),
+                "loader": f"{loader.__module__}.{loader.__qualname__}",
+                "params": params,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+    def load(self, source_path, loader, **params):
+        """Return ``loader(source_path, **params)``, from cache when possible.
+
+        The returned frame is a copy, so callers may modify it without corrupting the cache.
+        """
+        key = self.key(source_path, loader, params)
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._copy(self._memory[key])
+
+        disk_path = self.cache_dir / f"{key}{self.suffix}"
+        if disk_path.exists():
+            logger.debug(f"Loading {loader.__name__}{params} from {disk_path}")
+            layer = self._read(disk_path)
+            # Reading counts as a use for least-recently-used disk eviction
+            os.utime(disk_path)
+        else:
+            layer = loader(source_path, **params)
+            # Write to a temporary file and rename it into place, so that concurrent readers
+            # never see a partially written entry.  Temporary files keep the suffix, which
+            # selects the format, and live in a subdirectory out of reach of _trim_disk.
+            partial = (
+                self.cache_dir
+                / "partial"
+                / f"{key}-{os.getpid()}-{threading.get_ident()}{self.suffix}"
+            )
+            partial.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                self._write(layer, partial)
+                os.replace(partial, disk_path)
+            finally:
+                partial.unlink(missing_ok=True)
+            self._trim_disk()
+
+        self._memory[key] = layer
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+        return self._copy(layer)
+
+    def _read(self, path):
+        return read_artifact(path)
+
+    def _write(self, layer, path):
+        write_artifact(layer, path)
+
+    def _copy(self, layer):
+        return layer.copy()
+
+    def evict(self, source_path, loader, **params):
+        """Drop one cached layer from both tiers"""
+        key = self.key(source_path, loader, params)
+        self._memory.pop(key, None)
+        (self.cache_dir / f"{key}{self.suffix}").unlink(missing_ok=True)
+
+    def clear(self, memory: bool = True, disk: bool = True):
+        """Drop every cached layer from the selected tiers"""
+        if memory:
+            self._memory.clear()
+        if disk:
+            for path in self.cache_dir.glob(f"*{self.suffix}"):
+                path.unlink(missing_ok=True)
+
+    def disk_usage(self) -> int:
+        return sum(
+            path.stat().st_size for path in self.cache_dir.glob(f"*{self.suffix}")
+        )
+
+    def _trim_disk(self):
+        entries = sorted(
+            (path.stat().st_mtime, path.stat().st_size, path)
+            for path in self.cache_dir.glob(f"*{self.suffix}")
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            logger.debug(f"Evicting {path} from the layer cache")
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+class ArrayCache(LayerCache):
+    """``LayerCache`` of loaders that return a dict of numpy arrays, stored as ``.npz`` files"""
+
+    suffix = ".npz"
+
+    def _read(self, path):
+        with np.load(path) as arrays:
+            return dict(arrays)
+
+    def _write(self, arrays, path):
+        np.savez_compressed(path, **arrays)
+
+    def _copy(self, arrays):
+        return {name: array.copy() for name, array in arrays.items()}
+
+
+def write_mappable(table, path):
+    """Write an Arrow table as an uncompressed Feather file of a single record batch, so
+    that each column of the memory mapped file is one contiguous array"""
+    feather.write_feather(
+        table, path, compression="uncompressed", chunksize=max(table.num_rows, 1)
+    )
+
+
+class ArrowCache(LayerCache):
+    """``LayerCache`` of loaders that return a ``pyarrow.Table``, stored as uncompressed
+    Feather files.  Cached tables are memory mapped rather than read, and aren't copied,
+    since Arrow tables are immutable."""
+
+    suffix = ".arrow"
+
+    def _read(self, path):
+        return feather.read_table(path, memory_map=True)
+
+    def _write(self, table, path):
+        write_mappable(table, path)
+
+    def _copy(self, table):
+        return table
+
+
+layer_cache = LayerCache()
+array_cache = ArrayCache()
+arrow_cache = ArrowCache()
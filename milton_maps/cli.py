@@ -6,30 +6,79 @@ Options:
   -h --help
 """
 
+import importlib
 import sys
 
-from milton_maps import (
-    process_assessor_db,
-    process_openspace,
-    process_tax_parcels,
-    process_town_boundaries,
-)
+import click
 
+# Command name => (module defining its ``main`` click command, short help).  Modules are only
+# imported when their command runs, so ``milton_maps --help`` or a mistyped command doesn't
+# import geopandas.
+COMMANDS = {
+    "process_assessor_db": (
+        "milton_maps.process_assessor_db",
+        "Clean one town's assessor DB",
+    ),
+    "process_assessor_dbs": (
+        "milton_maps.process_assessor_dbs",
+        "Clean every town's assessor DB in a directory",
+    ),
+    "process_crash_cube": (
+        "milton_maps.process_crash_cube",
+        "Count crashes by time, severity, place and road",
+    ),
+    "process_openspace": (
+        "milton_maps.process_openspace",
+        "Clean the open space layer",
+    ),
+    "process_openspace_access": (
+        "milton_maps.process_openspace_access",
+        "Measure each parcel's access to open space",
+    ),
+    "process_road_intersections": (
+        "milton_maps.process_road_intersections",
+        "Derive road intersections from the road network",
+    ),
+    "process_tax_parcels": (
+        "milton_maps.process_tax_parcels",
+        "Join assessor DBs to tax parcels",
+    ),
+    "process_town_boundaries": (
+        "milton_maps.process_town_boundaries",
+        "Merge town survey polygons into town boundaries",
+    ),
+    "run": ("milton_maps.pipeline", "Run the processing pipeline in one process"),
+    "serve": ("milton_maps.serve", "Serve processed layers over local HTTP"),
+}
 
+
+class LazyGroup(click.Group):
+    """Click group whose subcommands are imported from ``COMMANDS`` when invoked"""
+
+    def list_commands(self, ctx):
+        return sorted(COMMANDS)
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in COMMANDS:
+            return None
+        module_name, _ = COMMANDS[cmd_name]
+        command = importlib.import_module(module_name).main
+        command.name = cmd_name
+        return command
+
+    def format_commands(self, ctx, formatter):
+        # List commands from COMMANDS, rather than importing every command for its help
+        with formatter.section("Commands"):
+            formatter.write_dl([(name, COMMANDS[name][1]) for name in sorted(COMMANDS)])
+
+
+@click.group(cls=LazyGroup, context_settings={"help_option_names": ["-h", "--help"]})
 def main():
     """Console script command routing for milton_maps."""
-    cmd = sys.argv[1]
-    argv = sys.argv[2:]
-    if cmd == "process_assessor_db":
-        process_assessor_db.main(argv)
-    elif cmd == "process_town_boundaries":
-        process_town_boundaries.main(argv)
-    elif cmd == "process_openspace":
-        process_openspace.main(argv)
-    elif cmd == "process_tax_parcels":
-        process_tax_parcels.main(argv)
-    else:
-        raise ValueError(f"Command {cmd} unrecognized.")
+    from milton_maps.logging_config import configure_logging
+
+    # Stage timings are written to pipeline.metrics.jsonl alongside pipeline.log
+    configure_logging()
 
 
 if __name__ == "__main__":
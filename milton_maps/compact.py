@@ -0,0 +1,88 @@
+"""Compact in-memory representation of processed frames.
+
+Processed frames keep strings as Python objects and numbers at 64 bits.  Statewide, columns
+such as USE_DESCRIPTION or TOWN repeat a handful of values millions of times.
+``compact_frame`` stores such columns as categoricals and narrows numeric columns to the
+smallest type that holds their values exactly; ``memory_report`` shows what each column costs.
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+# Object columns with at most this many distinct values per row are stored as categoricals
+MAX_CATEGORY_FRACTION = 0.5
+
+
+def _is_geometry(series: pd.Series) -> bool:
+    return isinstance(series.dtype, gpd.array.GeometryDtype)
+
+
+def _downcast_numeric(series: pd.Series) -> pd.Series:
+    """``series`` at the narrowest numeric type that represents every value exactly"""
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_unsigned_integer_dtype(
+        series
+    ):
+        # Unsigned columns hold hashes and identifiers, which need their full width
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+    if pd.api.types.is_float_dtype(series):
+        narrow = series.astype(np.float32)
+        lossless = (narrow.astype(series.dtype) == series) | series.isna()
+        return narrow if lossless.all() else series
+    return series
+
+
+def compact_frame(
+    df: pd.DataFrame,
+    categorical_columns: list = None,
+    max_category_fraction: float = MAX_CATEGORY_FRACTION,
+) -> pd.DataFrame:
+    """Copy of ``df`` with repetitive strings as categoricals and numerics downcast.
+
+    Values are unchanged: every compacted column compares equal to the original.
+
+    Args:
+        df (pandas.DataFrame): frame to compact.  Geometry columns are left as they are.
+        categorical_columns (list): columns to store as categoricals.  Defaults to every
+            object column whose number of distinct values is at most ``max_category_fraction``
+            of its length.
+        max_category_fraction (float): see ``categorical_columns``.
+
+    Returns:
+        pandas.DataFrame: the compacted frame, of the same type as ``df``.
+    """
+    compacted = {}
+    for column in df.columns:
+        series = df[column]
+        if _is_geometry(series):
+            continue
+        if categorical_columns is not None and column in categorical_columns:
+            compacted[column] = series.astype("category")
+        elif series.dtype == object:
+            if categorical_columns is None and (
+                series.nunique() <= max_category_fraction * len(series)
+            ):
+                compacted[column] = series.astype("category")
+        else:
+            compacted[column] = _downcast_numeric(series)
+    return df.assign(**compacted)
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Memory used by each column of ``df``, including the strings that object columns point to.
+
+    Returns:
+        pandas.DataFrame: indexed by column with ``dtype``, ``bytes`` and ``share`` (of the
+        frame's total) columns, largest first, and a final ``TOTAL`` row.
+    """
+    usage = df.memory_usage(deep=True, index=True)
+    report = pd.DataFrame(
+        {
+            "dtype": df.dtypes.astype(str).reindex(usage.index, fill_value=""),
+            "bytes": usage,
+            "share": (usage / usage.sum()).round(4),
+        }
+    ).sort_values("bytes", ascending=False)
+    report.loc["TOTAL"] = ["", usage.sum(), 1.0]
+    return report
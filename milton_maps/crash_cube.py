@@ -0,0 +1,198 @@
+"""Precomputed crash counts for fast slicing by time, severity, place and road.
+
+``build_crash_cube`` counts crashes over every combination of the values of a few dimensions,
+e.g. year x month x hour x severity x town x location.  Each dimension is dictionary encoded,
+and each group of dimensions (a *cuboid*) is stored as a dense array of counts with one axis
+per dimension.  ``CrashCube.count`` and ``CrashCube.table`` answer a query from the smallest
+cuboid holding every dimension it filters or groups by, by indexing and summing that array,
+without touching the crash records.  Cubes are saved as ``.npz`` files.
+"""
+import json
+import logging
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("crash_cube")
+
+# Dimension name => function of the crash records returning its value for each crash.
+# Dimensions whose source columns are missing are left out of the cube.
+DIMENSIONS = {
+    "year": lambda crashes: crashes["year"],
+    "month": lambda crashes: crashes["Crash_DateTime"].dt.month,
+    "hour": lambda crashes: crashes["Crash_DateTime"].dt.hour,
+    "severity": lambda crashes: crashes["severity"],
+    "town": lambda crashes: crashes["TOWN_ID"],
+    # Intersection or mid-block, see process_road_intersections.classify_crash_locations
+    "location": lambda crashes: crashes["LOCATION"],
+    # See road_corridors.assign_crashes_to_segments
+    "route": lambda crashes: crashes["ROUTE"],
+    "segment": lambda crashes: crashes["SEGMENT_ID"].astype("Int64"),
+    # Direction of travel of the first vehicle, e.g. "N" in "V1: N / V2: S"
+    "direction": lambda crashes: crashes["Vehicle_Travel_Directions"].str.extract(
+        r"V1:\s*([NSEW])\b", expand=False
+    ),
+}
+
+# Groups of dimensions counted together.  A query can combine the dimensions of one cuboid.
+DEFAULT_CUBOIDS = [
+    ("year", "month", "hour", "severity", "town", "location"),
+    ("year", "severity", "location", "route", "direction"),
+    ("year", "severity", "segment"),
+]
+
+
+def _label(value):
+    """JSON-serializable dimension label, ``None`` for missing values"""
+    if pd.isna(value):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+@dataclass
+class CrashCube:
+    """Crash counts of several cuboids sharing dictionary encoded dimensions.
+
+    Attributes:
+        dimensions (dict): dimension name => list of its values.  A value's position is its
+            code along the dimension's axes.  Missing values are encoded as ``None``.
+        cuboids (dict): tuple of dimension names => array of counts with one axis per
+            dimension.
+    """
+
+    dimensions: dict
+    cuboids: dict
+    _codes: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._codes = {
+            name: {label: code for code, label in enumerate(labels)}
+            for name, labels in self.dimensions.items()
+        }
+
+    def _cuboid(self, names) -> tuple:
+        """The smallest cuboid holding every dimension in ``names``"""
+        candidates = [dims for dims in self.cuboids if set(names).issubset(dims)]
+        if not candidates:
+            raise ValueError(
+                f"No cuboid holds all of the dimensions {sorted(names)}; "
+                f"cuboids are {list(self.cuboids)}"
+            )
+        return min(candidates, key=lambda dims: self.cuboids[dims].size)
+
+    def _slice(self, by: list, filters: dict):
+        """Counts of the cuboid answering a query, restricted to ``filters``, with the axes
+        not in ``by`` summed out and the remaining axes in the order of ``by``"""
+        unknown = (set(by) | set(filters)) - set(self.dimensions)
+        if unknown:
+            raise ValueError(
+                f"Unknown dimensions {sorted(unknown)}, expected {list(self.dimensions)}"
+            )
+        dims = self._cuboid(set(by) | set(filters))
+        counts = self.cuboids[dims]
+        for axis, name in enumerate(dims):
+            if name in filters:
+                values = filters[name]
+                if not isinstance(values, (list, tuple, set)):
+                    values = [values]
+                codes = [self._codes[name][v] for v in values if v in self._codes[name]]
+                counts = counts.take(codes, axis=axis)
+        kept = [name for name in dims if name in by]
+        counts = counts.sum(
+            axis=tuple(axis for axis, name in enumerate(dims) if name not in by),
+            dtype=np.int64,
+        )
+        return np.moveaxis(counts, [kept.index(name) for name in by], range(len(by)))
+
+    def count(self, **filters) -> int:
+        """Number of crashes matching ``filters``.
+
+        Args:
+            **filters: dimension name => value, or list of values, e.g.
+                ``cube.count(year=[2021, 2022], location="intersection")``.
+        """
+        return int(self._slice([], filters))
+
+    def table(self, by, **filters) -> pd.Series:
+        """Number of crashes matching ``filters`` for each combination of the values of
+        the dimensions ``by``.
+
+        Args:
+            by (str or list): dimensions to group by.
+            **filters: see ``count``.
+
+        Returns:
+            pandas.Series: counts indexed by the values of ``by``.  Only combinations with
+            crashes are included.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        counts = self._slice(by, filters)
+        index = pd.MultiIndex.from_product(
+            [self.dimensions[name] for name in by], names=by
+        )
+        table = pd.Series(counts.ravel(), index=index, name="crashes")
+        if len(by) == 1:
+            table.index = table.index.get_level_values(0)
+        return table[table > 0]
+
+    def save(self, path):
+        arrays = {",".join(dims): counts for dims, counts in self.cuboids.items()}
+        np.savez_compressed(
+            path, dimensions=np.array(json.dumps(self.dimensions)), **arrays
+        )
+
+    @classmethod
+    def load(cls, path) -> "CrashCube":
+        with np.load(path) as arrays:
+            dimensions = json.loads(str(arrays["dimensions"]))
+            cuboids = {
+                tuple(name.split(",")): arrays[name]
+                for name in arrays.files
+                if name != "dimensions"
+            }
+        return cls(dimensions, cuboids)
+
+
+def build_crash_cube(crashes: pd.DataFrame, cuboids=DEFAULT_CUBOIDS) -> CrashCube:
+    """Count crashes over each cuboid of dimensions.
+
+    Args:
+        crashes (pandas.DataFrame): crash records, e.g. from
+            ``process_crash_data.get_crash_data``, optionally with the columns added by
+            ``road_corridors.assign_crashes_to_segments`` and
+            ``process_road_intersections.classify_crash_locations``.
+        cuboids (list): tuples of names of ``DIMENSIONS`` to count together.  Dimensions
+            that can't be derived from ``crashes`` are dropped from every cuboid.
+
+    Returns:
+        CrashCube
+    """
+    dimensions, codes = {}, {}
+    for name in dict.fromkeys(name for dims in cuboids for name in dims):
+        try:
+            values = DIMENSIONS[name](crashes)
+        except KeyError:
+            logger.info(
+                f"Leaving {name} out of the crash cube, its columns are missing"
+            )
+            continue
+        codes[name], labels = pd.factorize(
+            pd.Series(values).astype(object), sort=True, use_na_sentinel=False
+        )
+        dimensions[name] = [_label(label) for label in labels]
+
+    counted = {}
+    for dims in cuboids:
+        dims = tuple(name for name in dims if name in dimensions)
+        if not dims or dims in counted:
+            continue
+        shape = tuple(len(dimensions[name]) for name in dims)
+        flat = np.ravel_multi_index([codes[name] for name in dims], shape)
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+        counted[dims] = counts.astype(np.min_scalar_type(counts.max(initial=0)))
+        logger.info(
+            f"Counted {len(crashes)} crashes over {' x '.join(dims)}: "
+            f"{counts.size} cells, {counted[dims].nbytes / 1024:.0f} KiB"
+        )
+    return CrashCube(dimensions, counted)
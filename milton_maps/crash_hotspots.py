@@ -0,0 +1,376 @@
+"""Crash hot spots: counts on square or hex grids, and kernel density surfaces.
+
+Crashes are binned from their coordinates with numpy, without any per-point geometry
+operation, and each crash is weighted by its ``severity`` (see ``SEVERITY_WEIGHTS``).  Grids
+are anchored at the CRS origin, so the cells of grids of the same size line up whatever
+crashes they were built from.
+
+``get_crash_hotspots`` and ``get_crash_density`` cache their results as compressed arrays
+keyed by the crash export's content and the grid parameters (see ``cache.ArrayCache``), so
+the hot-spot map of a whole county is only computed once.
+"""
+import logging
+from dataclasses import asdict, dataclass
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from milton_maps.cache import array_cache, file_digest
+from milton_maps.process_crash_data import (
+    CRASH_DATA_PATH,
+    TOWN_BOUNDARIES_PATH,
+    crash_cleaning_digest,
+    get_town_boundaries,
+    read_crash_data,
+)
+from milton_maps.spatial import from_geos, geos
+
+logger = logging.getLogger("crash_hotspots")
+
+# Weight of a crash of each ``severity`` of ``process_crash_data.INJURY_MAP``, in the spirit
+# of equivalent property damage only (EPDO) scores.  Unmapped severities weigh 1.
+SEVERITY_WEIGHTS = {
+    "No Injury": 1.0,
+    "Unknown": 1.0,
+    "Minor Injury": 3.0,
+    "Major Injury": 10.0,
+    "Fatal Injury": 20.0,
+}
+
+GRID_SHAPES = ("square", "hex")
+
+SQRT3 = np.sqrt(3.0)
+
+
+def severity_weights(
+    crashes: gpd.GeoDataFrame, weights: dict = SEVERITY_WEIGHTS
+) -> np.ndarray:
+    """Weight of each crash according to its ``severity``"""
+    return (
+        crashes["severity"]
+        .astype(object)
+        .map(weights)
+        .fillna(1.0)
+        .to_numpy(dtype=np.float64)
+    )
+
+
+def _coordinates(crashes: gpd.GeoDataFrame, weights: np.ndarray):
+    """x, y and weight of the crashes with a location"""
+    points = crashes.geometry
+    has_location = ~(points.isna() | points.is_empty).values
+    points = points[has_location]
+    return points.x.values, points.y.values, weights[has_location]
+
+
+@dataclass
+class HotspotGrid:
+    """Crash count and total severity weight of each occupied cell of a grid.
+
+    Cells are identified by integer coordinates ``(i, j)``: column and row for square grids,
+    axial coordinates of pointy-top hexagons for hex grids.
+    """
+
+    shape: str
+    cell_size: float
+    i: np.ndarray
+    j: np.ndarray
+    count: np.ndarray
+    weight: np.ndarray
+    crs: str = "EPSG:26986"
+
+    def centers(self) -> tuple:
+        """x and y coordinates of the center of each cell"""
+        if self.shape == "square":
+            return (self.i + 0.5) * self.cell_size, (self.j + 0.5) * self.cell_size
+        radius = self.cell_size / SQRT3
+        x = radius * (SQRT3 * self.i + SQRT3 / 2 * self.j)
+        y = radius * 1.5 * self.j
+        return x, y
+
+    def to_geodataframe(self) -> gpd.GeoDataFrame:
+        """Cell polygons with ``COUNT`` and ``WEIGHT`` columns, e.g. for ``plot_map``"""
+        x, y = self.centers()
+        if self.shape == "square":
+            half = self.cell_size / 2
+            cells = geos.box(x - half, y - half, x + half, y + half)
+        else:
+            radius = self.cell_size / SQRT3
+            angles = np.radians(np.arange(6) * 60 - 30)
+            vertices = np.stack(
+                [
+                    x[:, None] + radius * np.cos(angles),
+                    y[:, None] + radius * np.sin(angles),
+                ],
+                axis=-1,
+            )
+            cells = geos.polygons(vertices)
+        return gpd.GeoDataFrame(
+            {"COUNT": self.count, "WEIGHT": self.weight},
+            geometry=from_geos(cells, crs=self.crs),
+        )
+
+    def to_arrays(self) -> dict:
+        return {name: np.asarray(value) for name, value in asdict(self).items()}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "HotspotGrid":
+        return cls(
+            shape=str(arrays["shape"]),
+            cell_size=float(arrays["cell_size"]),
+            i=arrays["i"],
+            j=arrays["j"],
+            count=arrays["count"],
+            weight=arrays["weight"],
+            crs=str(arrays["crs"]),
+        )
+
+
+def _square_cells(x, y, cell_size):
+    return np.floor(x / cell_size), np.floor(y / cell_size)
+
+
+def _hex_cells(x, y, cell_size):
+    """Axial coordinates of the pointy-top hexagons containing each point.
+
+    ``cell_size`` is the distance between the centers of adjacent hexagons.
+    """
+    radius = cell_size / SQRT3
+    q = (SQRT3 / 3 * x - y / 3) / radius
+    r = (2 / 3 * y) / radius
+    # Round cube coordinates (q, r, -q - r), fixing the component with the largest error
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq[fix_q] = -rr[fix_q] - rs[fix_q]
+    rr[fix_r] = -rq[fix_r] - rs[fix_r]
+    return rq, rr
+
+
+def hotspot_grid(
+    crashes: gpd.GeoDataFrame,
+    shape: str = "hex",
+    cell_size: float = 250.0,
+    weights: dict = SEVERITY_WEIGHTS,
+) -> HotspotGrid:
+    """Bin crashes into a square or hex grid.
+
+    Args:
+        crashes (geopandas.GeoDataFrame): crashes as returned by
+            ``process_crash_data.get_crash_data``.
+        shape (str): ``"square"`` or ``"hex"``.
+        cell_size (float): width of square cells, or distance between the centers of
+            adjacent hexagons, in CRS units.
+        weights (dict): weight of each severity, see ``SEVERITY_WEIGHTS``.
+
+    Returns:
+        HotspotGrid: the occupied cells.
+    """
+    if shape not in GRID_SHAPES:
+        raise ValueError(f"Grid shape must be one of {GRID_SHAPES}, got {shape}")
+    x, y, w = _coordinates(crashes, severity_weights(crashes, weights))
+    cells = _square_cells if shape == "square" else _hex_cells
+    i, j = cells(x, y, cell_size)
+    occupied, inverse = np.unique(
+        np.stack([i, j]).astype(np.int64), axis=1, return_inverse=True
+    )
+    inverse = inverse.ravel()
+    return HotspotGrid(
+        shape=shape,
+        cell_size=float(cell_size),
+        i=occupied[0].astype(np.int32),
+        j=occupied[1].astype(np.int32),
+        count=np.bincount(inverse, minlength=occupied.shape[1]).astype(np.int32),
+        weight=np.bincount(inverse, weights=w, minlength=occupied.shape[1]).astype(
+            np.float32
+        ),
+        crs=str(crashes.crs),
+    )
+
+
+@dataclass
+class DensitySurface:
+    """Severity-weighted crash density on a raster of square cells.
+
+    ``density[row, col]`` is the density at the center of the cell whose lower left corner
+    is ``(xmin + col * cell_size, ymin + row * cell_size)``, in weighted crashes per square
+    kilometer.
+    """
+
+    bandwidth: float
+    cell_size: float
+    xmin: float
+    ymin: float
+    density: np.ndarray
+    crs: str = "EPSG:26986"
+
+    @property
+    def extent(self) -> tuple:
+        """``(xmin, xmax, ymin, ymax)`` of the raster, for ``imshow(..., origin="lower")``"""
+        n_rows, n_cols = self.density.shape
+        return (
+            self.xmin,
+            self.xmin + n_cols * self.cell_size,
+            self.ymin,
+            self.ymin + n_rows * self.cell_size,
+        )
+
+    def to_arrays(self) -> dict:
+        return {name: np.asarray(value) for name, value in asdict(self).items()}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "DensitySurface":
+        return cls(
+            bandwidth=float(arrays["bandwidth"]),
+            cell_size=float(arrays["cell_size"]),
+            xmin=float(arrays["xmin"]),
+            ymin=float(arrays["ymin"]),
+            density=arrays["density"],
+            crs=str(arrays["crs"]),
+        )
+
+
+def _gaussian_blur(grid: np.ndarray, sigma: float) -> np.ndarray:
+    """Convolve ``grid`` with a normalized Gaussian of ``sigma`` cells, by FFT"""
+    half = int(np.ceil(3 * sigma))
+    offsets = np.arange(-half, half + 1)
+    kernel_1d = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel = np.outer(kernel_1d, kernel_1d)
+    kernel /= kernel.sum()
+    shape = (grid.shape[0] + 2 * half, grid.shape[1] + 2 * half)
+    blurred = np.fft.irfft2(
+        np.fft.rfft2(grid, shape) * np.fft.rfft2(kernel, shape), shape
+    )
+    # The kernel is centered on offset ``half``, so the blurred grid starts there
+    rows = slice(half, half + grid.shape[0])
+    cols = slice(half, half + grid.shape[1])
+    return blurred[rows, cols]
+
+
+def kernel_density(
+    crashes: gpd.GeoDataFrame,
+    bandwidth: float = 200.0,
+    cell_size: float = 50.0,
+    weights: dict = SEVERITY_WEIGHTS,
+) -> DensitySurface:
+    """Gaussian kernel density of crashes, weighted by severity.
+
+    Crashes are binned into a raster of ``cell_size`` cells covering them, with a margin of
+    three bandwidths, which is then convolved with the kernel.  Each crash is located at the
+    center of its cell, so ``cell_size`` should be a fraction of ``bandwidth``.
+
+    Args:
+        crashes (geopandas.GeoDataFrame): crashes as returned by
+            ``process_crash_data.get_crash_data``.
+        bandwidth (float): standard deviation of the Gaussian kernel, in CRS units.
+        cell_size (float): width of the raster cells, in CRS units.
+        weights (dict): weight of each severity, see ``SEVERITY_WEIGHTS``.
+    """
+    x, y, w = _coordinates(crashes, severity_weights(crashes, weights))
+    if len(x) == 0:
+        raise ValueError("Can't estimate the density of an empty set of crashes")
+    margin = 3 * bandwidth
+    xmin = np.floor((x.min() - margin) / cell_size) * cell_size
+    ymin = np.floor((y.min() - margin) / cell_size) * cell_size
+    n_cols = int(np.ceil((x.max() + margin - xmin) / cell_size))
+    n_rows = int(np.ceil((y.max() + margin - ymin) / cell_size))
+
+    cols = ((x - xmin) // cell_size).astype(np.int64)
+    rows = ((y - ymin) // cell_size).astype(np.int64)
+    grid = np.bincount(
+        rows * n_cols + cols, weights=w, minlength=n_rows * n_cols
+    ).reshape(n_rows, n_cols)
+
+    square_km_per_cell = (cell_size / 1000) ** 2
+    density = _gaussian_blur(grid, bandwidth / cell_size) / square_km_per_cell
+    # FFT round-off leaves tiny negative values where there are no crashes
+    return DensitySurface(
+        bandwidth=float(bandwidth),
+        cell_size=float(cell_size),
+        xmin=float(xmin),
+        ymin=float(ymin),
+        density=np.clip(density, 0, None).astype(np.float32),
+        crs=str(crashes.crs),
+    )
+
+
+def _read_crashes(path, towns):
+    # The cached loaders below take the digests of the town boundaries read here and of the
+    # cleaning code only so that they're part of their cache key
+    return read_crash_data(path, town_boundaries=get_town_boundaries(towns=towns))
+
+
+def _hotspot_arrays(
+    path, towns, shape, cell_size, weights, town_boundaries_digest, cleaning_digest
+):
+    return hotspot_grid(
+        _read_crashes(path, towns), shape, cell_size, weights
+    ).to_arrays()
+
+
+def _density_arrays(
+    path, towns, bandwidth, cell_size, weights, town_boundaries_digest, cleaning_digest
+):
+    return kernel_density(
+        _read_crashes(path, towns), bandwidth, cell_size, weights
+    ).to_arrays()
+
+
+def get_crash_hotspots(
+    towns=("MILTON",),
+    shape: str = "hex",
+    cell_size: float = 250.0,
+    weights: dict = SEVERITY_WEIGHTS,
+    crash_data_path=CRASH_DATA_PATH,
+) -> HotspotGrid:
+    """Hot-spot grid of the crashes in ``towns``, from cache when possible.
+
+    See ``hotspot_grid`` for the other arguments.
+    """
+    return HotspotGrid.from_arrays(
+        array_cache.load(
+            crash_data_path,
+            _hotspot_arrays,
+            towns=list(towns),
+            shape=shape,
+            cell_size=float(cell_size),
+            weights=weights,
+            town_boundaries_digest=file_digest(TOWN_BOUNDARIES_PATH),
+            cleaning_digest=crash_cleaning_digest(),
+        )
+    )
+
+
+def get_crash_density(
+    towns=("MILTON",),
+    bandwidth: float = 200.0,
+    cell_size: float = 50.0,
+    weights: dict = SEVERITY_WEIGHTS,
+    crash_data_path=CRASH_DATA_PATH,
+) -> DensitySurface:
+    """Kernel density of the crashes in ``towns``, from cache when possible.
+
+    See ``kernel_density`` for the other arguments.
+    """
+    return DensitySurface.from_arrays(
+        array_cache.load(
+            crash_data_path,
+            _density_arrays,
+            towns=list(towns),
+            bandwidth=float(bandwidth),
+            cell_size=float(cell_size),
+            weights=weights,
+            town_boundaries_digest=file_digest(TOWN_BOUNDARIES_PATH),
+            cleaning_digest=crash_cleaning_digest(),
+        )
+    )
+
+
+def hotspot_table(grid: HotspotGrid, top: int = 10) -> pd.DataFrame:
+    """The ``top`` cells of a grid by total severity weight, with their centers"""
+    x, y = grid.centers()
+    table = pd.DataFrame({"x": x, "y": y, "COUNT": grid.count, "WEIGHT": grid.weight})
+    return table.nlargest(top, "WEIGHT").reset_index(drop=True)
@@ -0,0 +1,124 @@
+"""Cleaned crash records as a memory-mapped Arrow table.
+
+Parsing the raw crash export (datetimes, severity mapping, point geometry, town clipping) is
+the slow part of loading crashes.  ``CrashStore`` holds the cleaned records as an Arrow table
+without geometry: coordinates are plain float columns, and categorical columns such as
+``severity`` are dictionary encoded.  Stores are written as uncompressed Arrow IPC (Feather)
+files, which ``CrashStore.open`` memory maps without reading or copying them, so every process
+opening the same file shares one copy in the page cache.  Geometry is only built by
+``to_geodataframe``, for the rows and columns asked for.
+
+``process_crash_data.get_crash_store`` keeps the store of the Milton crashes in the
+``cache.arrow_cache``, keyed by the content hash of the raw export.
+"""
+import json
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import feather
+
+from milton_maps.cache import write_mappable
+
+# Key of the schema metadata describing how to rebuild the crash geometry
+METADATA_KEY = b"milton_maps:crash_store"
+
+X_COLUMN = "X_Cooordinate"
+Y_COLUMN = "Y_Cooordinate"
+
+
+def crash_table(crashes: gpd.GeoDataFrame) -> pa.Table:
+    """Arrow table of crash records, with the geometry left out.  The points are rebuilt
+    from the ``X_Cooordinate`` and ``Y_Cooordinate`` columns."""
+    table = pa.Table.from_pandas(
+        pd.DataFrame(crashes.drop(columns=crashes.geometry.name))
+    )
+    geometry = {
+        "column": crashes.geometry.name,
+        "position": crashes.columns.get_loc(crashes.geometry.name),
+        "x": X_COLUMN,
+        "y": Y_COLUMN,
+        "crs": crashes.crs.to_json() if crashes.crs is not None else None,
+    }
+    return table.replace_schema_metadata(
+        {**table.schema.metadata, METADATA_KEY: json.dumps(geometry)}
+    )
+
+
+class CrashStore:
+    """Cleaned crash records backed by an Arrow table, typically memory mapped.
+
+    Args:
+        table (pyarrow.Table): records from ``crash_table``.
+    """
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self._geometry = json.loads(table.schema.metadata[METADATA_KEY])
+
+    @classmethod
+    def from_crashes(cls, crashes: gpd.GeoDataFrame) -> "CrashStore":
+        return cls(crash_table(crashes))
+
+    @classmethod
+    def open(cls, path) -> "CrashStore":
+        """Memory map a store written by ``write``, without reading it"""
+        return cls(feather.read_table(path, memory_map=True))
+
+    def write(self, path):
+        """Write the store as an uncompressed Feather file, which can be memory mapped"""
+        write_mappable(self.table, path)
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def columns(self) -> list:
+        return self.table.column_names
+
+    def coordinates(self) -> tuple:
+        """Arrays of the x and y coordinates of the crashes.  They are views of the memory
+        mapped file when the store was opened from one."""
+        return tuple(self.table[self._geometry[axis]].to_numpy() for axis in ("x", "y"))
+
+    def filter(self, **values) -> "CrashStore":
+        """Crashes whose columns have the given values, e.g. ``year=[2021, 2022]`` or
+        ``severity="Fatal Injury"``.  Filtering works on the Arrow table, without
+        converting it to pandas."""
+        mask = None
+        for column, value in values.items():
+            if not isinstance(value, (list, tuple, set)):
+                value = [value]
+            matches = pc.is_in(self.table[column], value_set=pa.array(list(value)))
+            mask = matches if mask is None else pc.and_(mask, matches)
+        if mask is None:
+            return self
+        return CrashStore(self.table.filter(mask))
+
+    def to_pandas(self, columns: list = None) -> pd.DataFrame:
+        """Crash records as a DataFrame, without geometry"""
+        table = self.table
+        if columns is not None:
+            index_columns = [
+                c
+                for c in table.schema.pandas_metadata["index_columns"]
+                if isinstance(c, str)
+            ]
+            table = table.select(list(dict.fromkeys([*columns, *index_columns])))
+        return table.to_pandas()
+
+    def to_geodataframe(self, columns: list = None) -> gpd.GeoDataFrame:
+        """Crash records as a GeoDataFrame of points, as returned by
+        ``process_crash_data.read_crash_data``, or the ``columns`` of them followed by the
+        geometry"""
+        df = self.to_pandas(columns)
+        x, y = self.coordinates()
+        name = self._geometry["column"]
+        # All columns come in their original order, with the geometry back in its place.
+        # Selected columns come in the order asked for, followed by the geometry.
+        position = len(df.columns)
+        if columns is None:
+            position = self._geometry.get("position", position)
+        df.insert(position, name, gpd.points_from_xy(x, y, crs=self._geometry["crs"]))
+        return gpd.GeoDataFrame(df, geometry=name, crs=self._geometry["crs"])
@@ -1,19 +1,63 @@
+import contextlib
+import contextvars
+import json
 import logging
 import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
 
 import pandas as pd
 
+from milton_maps.archives import is_archive_path, member_size
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # Not available on Windows; peak RSS is not recorded there
+
 LOG_FORMAT = "%(asctime)s %(name)s %(levelname)s: %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Stage metrics are logged to this logger as structured records, and written as JSON lines
+# to the metrics file configured by ``configure_logging``.
+METRICS_LOGGER_NAME = "metrics"
+
+logger = logging.getLogger("logging_config")
+metrics_logger = logging.getLogger(METRICS_LOGGER_NAME)
+
+# Stages currently running in this thread or task, innermost last
+_active_stages = contextvars.ContextVar("active_stages", default=())
+
+
+class JsonMetricsFormatter(logging.Formatter):
+    """Formats stage metrics records as one JSON object per line"""
+
+    def format(self, record):
+        metrics = getattr(record, "metrics", {"message": record.getMessage()})
+        return json.dumps(
+            {
+                "timestamp": datetime.fromtimestamp(
+                    record.created, tz=timezone.utc
+                ).isoformat(),
+                **metrics,
+            }
+        )
+
+
+def metrics_path(log_file) -> str:
+    """Default metrics file written alongside ``log_file``, e.g. pipeline.metrics.jsonl"""
+    return str(Path(log_file).with_suffix(".metrics.jsonl"))
 
-def configure_logging(log_file="pipeline.log"):
 
+def configure_logging(log_file="pipeline.log", metrics_file=None):
     # Get root logger
     root_logger = logging.getLogger()
 
     if root_logger.hasHandlers():
         root_logger.handlers.clear()
+    # Handlers decide what is emitted where
+    root_logger.setLevel(logging.DEBUG)
 
     # Create console handler and set level to INFO
     # We will log DEBUG messages to files only.
@@ -34,6 +78,25 @@ def configure_logging(log_file="pipeline.log"):
     # Prevent double-logging...
     root_logger.propagate = False
 
+    # Stage metrics go only to the JSON lines file; a readable summary of each stage is
+    # logged separately to the root handlers.
+    metrics_handler = logging.FileHandler(metrics_file or metrics_path(log_file))
+    metrics_handler.setFormatter(JsonMetricsFormatter())
+    metrics_logger.handlers.clear()
+    metrics_logger.addHandler(metrics_handler)
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False
+
+
+class _DataFrameRepr:
+    """Renders a dataframe only when a handler actually formats the log message"""
+
+    def __init__(self, df):
+        self.df = df
+
+    def __str__(self):
+        return str(self.df)
+
 
 def log_dataframe(
     logger: logging.Logger,
@@ -42,9 +105,120 @@ def log_dataframe(
     loglevel: int = logging.INFO,
 ):
     """
-    Convenience function to include a short dataframe result and description in logs
+    Convenience function to include a short dataframe result and description in logs.
+
+    The dataframe is rendered lazily, so this costs nothing when the message is filtered out.
     """
+    if logger.isEnabledFor(loglevel):
+        logger.log(loglevel, "%s:\n    %s", description, _DataFrameRepr(df))
+
+
+def _peak_rss_bytes(who=None):
+    if resource is None:
+        return None
+    who = resource.RUSAGE_SELF if who is None else who
+    max_rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
 
-    msg = f"""{description}:
-    {str(df)}"""
-    logger.log(loglevel, msg)
+def _size_on_disk(path) -> int:
+    if is_archive_path(path):
+        return member_size(path)
+    path = Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+class StageMetrics:
+    """Resource usage of one pipeline stage, accumulated while it runs.
+
+    Rows and bytes are recorded by ``record_read`` and ``record_write``, which
+    ``artifacts.read_artifact`` and ``artifacts.write_artifact`` call automatically.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_bytes = None
+        self.peak_child_rss_bytes = None
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.stage,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "peak_child_rss_bytes": self.peak_child_rss_bytes,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+
+
+def record_read(path=None, df=None):
+    """Add the size of ``path`` and the rows of ``df`` to the inputs of each running stage"""
+    stages = _active_stages.get()
+    if not stages:
+        return
+    n_bytes = _size_on_disk(path) if path is not None else 0
+    n_rows = len(df) if df is not None else 0
+    for stage in stages:
+        stage.bytes_read += n_bytes
+        stage.rows_in += n_rows
+
+
+def record_write(path=None, df=None):
+    """Add the size of ``path`` and the rows of ``df`` to the outputs of each running stage"""
+    stages = _active_stages.get()
+    if not stages:
+        return
+    n_bytes = _size_on_disk(path) if path is not None else 0
+    n_rows = len(df) if df is not None else 0
+    for stage in stages:
+        stage.bytes_written += n_bytes
+        stage.rows_out += n_rows
+
+
+@contextlib.contextmanager
+def stage_timer(stage: str):
+    """Measure a pipeline stage and log its metrics when it finishes.
+
+    Records wall time, CPU time of this process, peak resident set size of this process and
+    of any finished worker processes, and the rows and bytes read and written.  Metrics are
+    logged as a JSON record to the ``metrics`` logger and summarized in the pipeline log.
+    Peak RSS is the high-water mark of the whole process, not just of this stage.
+
+    Can be used as a context manager, which yields the ``StageMetrics`` being accumulated::
+
+        with stage_timer("process_openspace") as metrics:
+            ...
+
+    or as a decorator of a stage function, ``@stage_timer("process_openspace")``.
+    """
+    metrics = StageMetrics(stage)
+    token = _active_stages.set(_active_stages.get() + (metrics,))
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield metrics
+    finally:
+        metrics.wall_seconds = round(time.perf_counter() - wall_start, 4)
+        metrics.cpu_seconds = round(time.process_time() - cpu_start, 4)
+        metrics.peak_rss_bytes = _peak_rss_bytes()
+        if resource is not None:
+            metrics.peak_child_rss_bytes = _peak_rss_bytes(resource.RUSAGE_CHILDREN)
+        _active_stages.reset(token)
+        metrics_logger.info(stage, extra={"metrics": metrics.to_dict()})
+        logger.info(
+            f"{stage} finished in {metrics.wall_seconds:.2f}s "
+            f"({metrics.cpu_seconds:.2f}s CPU): {metrics.rows_in} rows in, "
+            f"{metrics.rows_out} rows out, {metrics.bytes_read / 2**20:.1f} MiB read, "
+            f"{metrics.bytes_written / 2**20:.1f} MiB written"
+        )
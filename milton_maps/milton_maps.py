@@ -1,11 +1,13 @@
+import html
 import warnings
 from typing import Tuple
 
 import geopandas as gpd
-import matplotlib
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 
+from milton_maps.spatial import from_geos, geos, to_geos
+
 # Use codes as defined by the [codebook](https://www.mass.gov/files/documents/2016/08/wr/classificationcodebook.pdf)
 
 USE_CODES = {
@@ -72,7 +74,9 @@ PRIMARY_PURPOSE_CODES = {
 }
 
 
-def transform_use_codes(use_codes: pd.Series) -> pd.Series:
+def transform_use_codes(
+    use_codes: pd.Series, town_ids: pd.Series = None, town_use_codes: dict = None
+) -> pd.Series:
     """
     Standardizes use codes by extracting first three digits and looking up description
 
@@ -80,17 +84,35 @@ def transform_use_codes(use_codes: pd.Series) -> pd.Series:
     by assessors. If the codes contain a four-digit use code, because the meaning of the fourth digit varies from community-to-community,
     the standard requires a lookup table. See the end of this Section for more details on this look-up table.
 
+    Each distinct code (or TOWN_ID and code pair) is looked up once and the descriptions are
+    broadcast back to the rows, so the cost depends on the number of distinct codes, not rows.
+
+    Args:
+        use_codes (pandas.Series): USE_CODE values.
+        town_ids (pandas.Series): TOWN_ID of each row.  Required to use ``town_use_codes``.
+        town_use_codes (dict): TOWN_ID => {four-digit USE_CODE: description}, the towns'
+            look-up tables (see ``process_assessor_db.read_use_code_lookup``).  Codes missing
+            from their town's table are described by their first three digits.
+
+    Returns:
+        pandas.Series: descriptions, ``"Other"`` for codes that aren't in any table.
     """
+    town_use_codes = town_use_codes or {}
+    if town_ids is None or not town_use_codes:
+        keys = use_codes
+    else:
+        keys = pd.MultiIndex.from_arrays([town_ids, use_codes])
+    key_index, unique_keys = pd.factorize(keys, use_na_sentinel=False)
 
-    def use_codes_map(use_code):
-        try:
-            use_description = USE_CODES[use_code]
-        except KeyError:
-            use_description = "Other"
-        return use_description
+    def use_codes_map(key):
+        town_id, use_code = key if isinstance(key, tuple) else (None, key)
+        if not isinstance(use_code, str):
+            return "Other"
+        town_description = town_use_codes.get(town_id, {}).get(use_code)
+        return town_description or USE_CODES.get(use_code[:3], "Other")
 
-    use_code_descriptions = use_codes.str[:3].map(use_codes_map)
-    return use_code_descriptions
+    descriptions = np.array([use_codes_map(key) for key in unique_keys], dtype=object)
+    return pd.Series(descriptions[key_index], index=use_codes.index)
 
 
 def plot_map(
@@ -106,6 +128,8 @@ def plot_map(
     cmap: str = "gist_earth",
     fig=None,
     ax=None,
+    raster: bool = False,
+    resolution: float = None,
     **style_kwds,
 ):
     """Generic function to plot maps from GeoDataFrame.
@@ -121,6 +145,8 @@ def plot_map(
         title (str): the title of the figure. Defaults to ``None``, in which case no title will be set.
         cmap (str): the color map to use in the map plot. Defaults to ``'gist_earth'``. The color maps available in matplotlib can be found here: https://matplotlib.org/3.1.0/tutorials/colors/colormaps.html
         ax: (matplotlib.axes._subplots.AxesSubplot) matplotlib axis object to add plot to
+        raster (bool): ``True`` to aggregate the geometries onto a grid of pixels with numpy and draw it as one image, which is much faster for large layers.  See ``rendering.rasterize``. Defaults to ``False``.
+        resolution (float): pixel size in meters of a raster map. Defaults to 2000 pixels along the longer side of the map.
 
     Returns:
         matplotlib.axes._subplots.AxesSubplot: matplotlib plot.
@@ -135,17 +161,34 @@ def plot_map(
         )
 
     if not ax:
+        # Imported here because pyplot is slow to import and only needed for plotting
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots(1, figsize=figsize)
     ax.grid()
-    gdf.plot(
-        ax=ax,
-        column=column,
-        categorical=categorical,
-        legend=legend,
-        markersize=markersize,
-        cmap=cmap,
-        **style_kwds,
-    )
+    if raster:
+        from milton_maps.rendering import draw_raster
+
+        draw_raster(
+            ax,
+            gdf,
+            column,
+            categorical=categorical,
+            legend=legend,
+            cmap=cmap,
+            resolution=resolution,
+            **style_kwds,
+        )
+    else:
+        gdf.plot(
+            ax=ax,
+            column=column,
+            categorical=categorical,
+            legend=legend,
+            markersize=markersize,
+            cmap=cmap,
+            **style_kwds,
+        )
 
     # Shrink current axis by `axis_scale`
     box = ax.get_position()
@@ -167,15 +210,46 @@ def plot_map(
     return ax
 
 
+def _fill_missing(values, navalue) -> pd.Series:
+    """``values`` with missing values replaced by ``navalue``.  Categoricals are converted to
+    plain values, since ``navalue`` usually isn't one of their categories."""
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+    return values.fillna(navalue)
+
+
+def categorical_colormap(values, colormap: str, navalue="None") -> dict:
+    """Assign a distinct color to each unique value, in order of first appearance.
+
+    Colors are spread evenly over the colormap.  Qualitative colormaps (e.g. ``tab10``) use
+    their listed colors in order while there are enough of them, and are interpolated into a
+    continuous colormap when there are more categories than colors, so categories never
+    share a color.
+
+    Returns:
+        dict: value => hex color string.  Missing values are keyed by ``navalue``.
+    """
+    import matplotlib
+
+    categories = list(_fill_missing(values, navalue).unique())
+    cmap = matplotlib.colormaps[colormap]
+    if isinstance(cmap, matplotlib.colors.ListedColormap):
+        if len(categories) <= cmap.N:
+            colors = cmap(np.arange(len(categories)))
+        else:
+            colors = matplotlib.colors.LinearSegmentedColormap.from_list(
+                colormap, cmap.colors
+            )(np.linspace(0, 1, len(categories)))
+    else:
+        colors = cmap(np.linspace(0, 1, len(categories)))
+    return dict(zip(categories, (matplotlib.colors.rgb2hex(c) for c in colors)))
+
+
 def make_choropleth_style_function(
     df: pd.DataFrame, attr: str, colormap: str, navalue="None"
 ):
-    cmap = matplotlib.cm.get_cmap(colormap)
-    attr_values = list(df[attr].fillna(navalue).unique())
-    colormap_dict = {
-        attr_values[i]: matplotlib.colors.rgb2hex(cmap(i))
-        for i in range(len(attr_values))
-    }
+    colormap_dict = categorical_colormap(df[attr], colormap, navalue=navalue)
 
     def stylefunc(x):
         val = x["properties"][attr]
@@ -207,6 +281,100 @@ def html_legend(cmap_dict):
     return table_html
 
 
+def popup_html(df: pd.DataFrame, columns: list, labels: list = None) -> pd.Series:
+    """Render one HTML popup per row, built with vectorized string operations.
+
+    Args:
+        df (pandas.DataFrame): rows to describe.
+        columns (list): columns to include, one line each.
+        labels (list): display labels for ``columns``. Defaults to the column names.
+
+    Returns:
+        pandas.Series: popup HTML aligned with ``df``.
+    """
+    labels = columns if labels is None else labels
+    lines = [
+        f"<b>{html.escape(str(label))}</b>: "
+        + df[column]
+        .astype(str)
+        .str.replace("&", "&amp;", regex=False)
+        .str.replace("<", "&lt;", regex=False)
+        .str.replace(">", "&gt;", regex=False)
+        for column, label in zip(columns, labels)
+    ]
+    return lines[0].str.cat(lines[1:], sep="<br>")
+
+
+def feature_style(feature: dict) -> dict:
+    """folium ``style_function`` for layers written by ``export_styled_geojson``.
+
+    Styles are precomputed, so this only reads them from the feature's properties.
+    """
+    properties = feature["properties"]
+    return {"fillColor": properties["fillColor"], "color": properties["color"]}
+
+
+def export_styled_geojson(
+    gdf: gpd.GeoDataFrame,
+    output_path,
+    attr: str,
+    colormap: str = "tab20",
+    popup_columns: list = None,
+    popup_labels: list = None,
+    simplify_tolerance: float = None,
+    precision: int = 6,
+    navalue="None",
+) -> dict:
+    """Write a compact GeoJSON layer with precomputed styles and popups for web maps.
+
+    Fill colors and popup HTML are computed for all features at once and stored as the
+    ``fillColor``, ``color`` and ``popup`` properties, so the browser (or folium, with
+    ``style_function=feature_style``) needs no per-feature Python callback.  Only the styled
+    and popup columns are exported, geometries are optionally simplified, and coordinates
+    are snapped to ``precision`` decimal degrees.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): layer to export, in a projected CRS in meters.
+        output_path: path of the GeoJSON file to write.
+        attr (str): categorical column to color features by.
+        colormap (str): matplotlib colormap name. See ``categorical_colormap``.
+        popup_columns (list): columns to show in the popup. Defaults to ``[attr]``.
+        popup_labels (list): display labels for ``popup_columns``.
+        simplify_tolerance (float): if set, simplify geometries to this many meters before
+            export.
+        precision (int): decimal places kept in longitude/latitude coordinates. 6 decimal
+            places is about 10 cm.
+        navalue: category used for missing values of ``attr``.
+
+    Returns:
+        dict: the value => color mapping, e.g. for ``html_legend``.
+    """
+    popup_columns = [attr] if popup_columns is None else popup_columns
+    columns = list(dict.fromkeys([attr] + popup_columns))
+    layer = gdf[columns + [gdf.geometry.name]].copy()
+
+    if simplify_tolerance is not None:
+        layer.geometry = layer.geometry.simplify(
+            simplify_tolerance, preserve_topology=True
+        )
+    layer = layer.to_crs("EPSG:4326")
+    layer.geometry = from_geos(
+        geos.set_precision(to_geos(layer.geometry), 10**-precision),
+        index=layer.index,
+        crs=layer.crs,
+    )
+
+    colormap_dict = categorical_colormap(layer[attr], colormap, navalue=navalue)
+    layer["fillColor"] = _fill_missing(layer[attr], navalue).map(colormap_dict)
+    layer["color"] = layer["fillColor"]
+    layer["popup"] = popup_html(layer, popup_columns, popup_labels)
+
+    layer[["fillColor", "color", "popup", layer.geometry.name]].to_file(
+        output_path, driver="GeoJSON", COORDINATE_PRECISION=precision
+    )
+    return colormap_dict
+
+
 # def add_basemap(ax, zoom, url=ctx.sources.ST_TONER_LITE):
 #     xmin, xmax, ymin, ymax = ax.axis()
 #     basemap, extent = ctx.bounds2img(xmin, ymin, xmax, ymax, zoom=zoom, source=url)
@@ -0,0 +1,517 @@
+"""Usage: milton_maps run [STAGE ...] [--workers N] [--force]
+
+Arguments:
+  STAGE       stages to run, along with the stages they depend on [default: all stages]
+Options:
+  --workers N   number of stages run concurrently [default: Python's thread pool default]
+  --force       run stages even if their inputs are unchanged
+
+Runs the processing stages of dvc.yaml in a single process, writing the same outputs.
+Processed frames are kept in memory and handed directly to the stages that consume them, and
+stages that don't depend on each other run concurrently.  A stage is skipped when the content
+of its inputs, its code and its outputs are unchanged since it last ran, as recorded in
+data/interim/pipeline_state.json.  A stage's code includes the milton_maps modules it imports
+(see ``code_deps``).
+"""
+import hashlib
+import importlib
+import inspect
+import json
+import logging
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import click
+
+from milton_maps import (
+    crash_cube,
+    process_assessor_db,
+    process_crash_cube,
+    process_openspace,
+    process_openspace_access,
+    process_road_intersections,
+    process_tax_parcels,
+    process_town_boundaries,
+)
+from milton_maps.archives import archive_member, archive_of
+from milton_maps.artifacts import read_artifact, write_artifact
+from milton_maps.cache import file_digest
+from milton_maps.logging_config import record_read, stage_timer
+
+logger = logging.getLogger("pipeline")
+
+STATE_PATH = "data/interim/pipeline_state.json"
+
+# Raw layers are read directly from the downloaded archives
+RAW_TOWNS_PATH = archive_member("data/raw/townssurvey_shp.zip", "TOWNSSURVEY_POLY.shp")
+RAW_OPENSPACE_PATH = archive_member("data/raw/openspace.zip", "OPENSPACE_POLY.shp")
+RAW_ROADS_PATH = archive_member("data/raw/MassDOT_Roads_SHP.zip", "EOTROADS_ARC.shp")
+TOWN_BOUNDARIES_PATH = "data/processed/town_boundaries.shp.zip"
+OPENSPACE_PATH = "data/processed/openspace.shp.zip"
+ROAD_INTERSECTIONS_PATH = "data/processed/road_intersections.parquet"
+RESIDENTIAL_TAX_PARCELS_PATH = "data/processed/residential_tax_parcels.pkl"
+OPENSPACE_ACCESS_PATH = "data/processed/residential_openspace_access.pkl"
+CRASH_DATA_PATH = "data/raw/MiltonCrashDetails.csv"
+CRASH_CUBE_PATH = "data/processed/crash_cube.npz"
+
+
+@dataclass
+class TownSources:
+    """Raw parcel data of one town and where its processed assessor DB is written"""
+
+    name: str
+    town_id: int
+    assessor_gdb_path: str
+    tax_parcels_path: str
+
+    @property
+    def assessor_layer(self) -> str:
+        return f"M{self.town_id:03d}Assess"
+
+    @property
+    def assessor_db_path(self) -> str:
+        return f"data/processed/{self.name}_assessor_db.pkl"
+
+    @property
+    def source_hashes_path(self) -> str:
+        return process_assessor_db.source_hashes_path(self.assessor_db_path)
+
+
+TOWNS = [
+    TownSources(
+        "milton",
+        189,
+        archive_member(
+            "data/raw/M189_parcels_gdb.zip", "M189_parcels_CY22_FY22_sde.gdb"
+        ),
+        archive_member(
+            "data/raw/L3_SHP_M189_MILTON.zip",
+            "L3_SHP_M189_Milton/M189TaxPar_CY22_FY22.shp",
+        ),
+    ),
+    TownSources(
+        "quincy",
+        243,
+        archive_member(
+            "data/raw/M243_parcels_gdb.zip", "M243_parcels_CY22_FY22_sde.gdb"
+        ),
+        archive_member(
+            "data/raw/L3_SHP_M243_QUINCY.zip",
+            "L3_SHP_M243_Quincy/M243TaxPar_CY22_FY23.shp",
+        ),
+    ),
+]
+
+
+@dataclass
+class Stage:
+    """A pipeline stage.
+
+    Attributes:
+        name (str): stage name, as in dvc.yaml.
+        run (Callable): ``run(store)`` loads the stage's inputs from, and saves its outputs to,
+            an ``ArtifactStore``.
+        deps (list): paths of the files the stage reads, including its source code.  Raw
+            archives are listed as a whole, rather than the members read from them.
+        outs (list): paths of the files the stage writes.
+    """
+
+    name: str
+    run: Callable
+    deps: list
+    outs: list
+
+
+class ArtifactStore:
+    """Frames saved by stages during a run, shared with the stages that consume them.
+
+    Saved frames are written to disk and kept in memory until ``release``d.  Loading any other
+    path reads it from disk.  Frames are shared, not copied, so stages must not modify the
+    frames they load from the store.
+
+    Consumers get the frame they would read back from disk, as when the stages run one by one
+    under DVC.  Pickles round-trip exactly, so the saved frame itself is kept.  Other formats
+    don't: shapefiles truncate column names to 10 characters and change dtypes, and parquet
+    outputs may be sorted or quantized (see ``artifacts.write_artifact``), so those are read
+    back once after they are written.
+
+    Args:
+        consumed (set): paths that later stages load.  Other saved frames are only written,
+            not read back or kept.  Defaults to ``None``, keeping every saved frame.
+    """
+
+    def __init__(self, consumed: set = None):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._consumed = None if consumed is None else {str(p) for p in consumed}
+
+    def load(self, path, **kwargs):
+        with self._lock:
+            data = self._data.get(str(path))
+        if data is not None:
+            record_read(df=data if not isinstance(data, dict) else None)
+            return data
+        if str(path).endswith(".json"):
+            with open(path) as f:
+                return json.load(f)
+        return read_artifact(path, **kwargs)
+
+    def save(self, path, data, **kwargs):
+        if str(path).endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(data, f)
+        else:
+            write_artifact(data, path, **kwargs)
+            if self._consumed is not None and str(path) not in self._consumed:
+                return
+            if not str(path).lower().endswith(".pkl"):
+                data = read_artifact(path)
+        with self._lock:
+            self._data[str(path)] = data
+
+    def release(self, path):
+        with self._lock:
+            self._data.pop(str(path), None)
+
+
+def path_digest(path):
+    """Content hash of a file, or of every file under a directory.  ``None`` if missing."""
+    path = Path(path)
+    if path.is_file():
+        return file_digest(path)
+    if not path.is_dir():
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for file in sorted(p for p in path.rglob("*") if p.is_file()):
+        digest.update(f"{file.relative_to(path)}:{file_digest(file)}\n".encode())
+    return digest.hexdigest()
+
+
+def code_deps(*modules) -> list:
+    """Source files of ``modules`` and of the milton_maps modules they import, directly or
+    through one another, e.g. ``artifacts`` and ``spatial``"""
+    package = __name__.split(".")[0]
+    files = {}
+    to_visit = list(modules)
+    while to_visit:
+        module = to_visit.pop()
+        if module.__name__ in files:
+            continue
+        files[module.__name__] = module.__file__
+        for value in vars(module).values():
+            name = value.__name__ if inspect.ismodule(value) else None
+            if name is None:
+                name = getattr(value, "__module__", None)
+            if name == package:
+                # ``import milton_maps as mm`` reads the API of milton_maps.milton_maps
+                name = f"{package}.milton_maps"
+            if isinstance(name, str) and name.startswith(f"{package}."):
+                to_visit.append(importlib.import_module(name))
+    return sorted(files.values())
+
+
+def _stage_code(*modules) -> list:
+    # This module defines the run functions of the stages
+    return code_deps(*modules) + [__file__]
+
+
+def _run_town_boundaries(store):
+    town_boundaries = process_town_boundaries.build_town_boundaries(
+        store.load(RAW_TOWNS_PATH)
+    )
+    store.save(TOWN_BOUNDARIES_PATH, town_boundaries)
+    for tolerance in process_town_boundaries.SIMPLIFY_TOLERANCES:
+        store.save(
+            process_town_boundaries.simplified_path(TOWN_BOUNDARIES_PATH, tolerance),
+            process_town_boundaries.simplify_town_boundaries(
+                town_boundaries, tolerance
+            ),
+        )
+    store.save(
+        process_town_boundaries.TOWN_IDS_PATH,
+        process_town_boundaries.town_ids(town_boundaries),
+    )
+
+
+def _run_openspace(store):
+    openspace = process_openspace.clean_openspace(store.load(RAW_OPENSPACE_PATH))
+    store.save(OPENSPACE_PATH, openspace)
+
+
+def _run_road_intersections(store):
+    intersections = process_road_intersections.find_intersections(
+        process_road_intersections.normalize_road_columns(store.load(RAW_ROADS_PATH))
+    )
+    store.save(ROAD_INTERSECTIONS_PATH, intersections)
+
+
+def _assessor_db_runner(town: TownSources):
+    def run(store):
+        assessor_df = process_assessor_db.read_assessor_db(
+            town.assessor_gdb_path, town.assessor_layer
+        )
+        town_ids_map = store.load(process_town_boundaries.TOWN_IDS_PATH)
+        use_code_lookup = process_assessor_db.read_use_code_lookup(
+            town.assessor_gdb_path
+        )
+        hashes = process_assessor_db.source_hashes(
+            assessor_df, town_ids_map, use_code_lookup
+        )
+        assessor_df = process_assessor_db.clean_assessor_db(
+            assessor_df, town_ids_map, use_code_lookup
+        )
+        store.save(town.assessor_db_path, assessor_df)
+        Path(town.source_hashes_path).parent.mkdir(exist_ok=True)
+        store.save(town.source_hashes_path, hashes.to_frame())
+
+    return run
+
+
+def _run_tax_parcels(store):
+    residential_tax_parcels = process_tax_parcels.join_tax_parcels(
+        [store.load(town.tax_parcels_path) for town in TOWNS],
+        [store.load(town.assessor_db_path) for town in TOWNS],
+    )
+    store.save(RESIDENTIAL_TAX_PARCELS_PATH, residential_tax_parcels, sort_by="TOWN")
+
+
+def _run_openspace_access(store):
+    openspace_access = process_openspace_access.openspace_access(
+        store.load(RESIDENTIAL_TAX_PARCELS_PATH), store.load(OPENSPACE_PATH)
+    )
+    store.save(OPENSPACE_ACCESS_PATH, openspace_access)
+
+
+def _run_crash_cube(store):
+    # The cube reads the town boundaries and roads through process_crash_data's layer cache
+    cube = process_crash_cube.crash_cube_for_towns(
+        CRASH_DATA_PATH, ["MILTON"], store.load(ROAD_INTERSECTIONS_PATH)
+    )
+    cube.save(CRASH_CUBE_PATH)
+
+
+def pipeline_stages() -> list:
+    """The processing stages of dvc.yaml"""
+    town_boundaries_outs = [TOWN_BOUNDARIES_PATH] + [
+        process_town_boundaries.simplified_path(TOWN_BOUNDARIES_PATH, tolerance)
+        for tolerance in process_town_boundaries.SIMPLIFY_TOLERANCES
+    ]
+    stages = [
+        Stage(
+            "process_town_boundaries",
+            _run_town_boundaries,
+            deps=_stage_code(process_town_boundaries) + [archive_of(RAW_TOWNS_PATH)],
+            outs=town_boundaries_outs + [process_town_boundaries.TOWN_IDS_PATH],
+        ),
+        Stage(
+            "process_road_intersections",
+            _run_road_intersections,
+            deps=_stage_code(process_road_intersections) + [archive_of(RAW_ROADS_PATH)],
+            outs=[ROAD_INTERSECTIONS_PATH],
+        ),
+        Stage(
+            "process_openspace",
+            _run_openspace,
+            deps=_stage_code(process_openspace) + [archive_of(RAW_OPENSPACE_PATH)],
+            outs=[OPENSPACE_PATH],
+        ),
+    ]
+    for town in TOWNS:
+        stages.append(
+            Stage(
+                f"process_{town.name}_assessor_db",
+                _assessor_db_runner(town),
+                deps=_stage_code(process_assessor_db)
+                + [
+                    archive_of(town.assessor_gdb_path),
+                    process_town_boundaries.TOWN_IDS_PATH,
+                ],
+                outs=[town.assessor_db_path, town.source_hashes_path],
+            )
+        )
+    stages.append(
+        Stage(
+            "process_tax_parcels",
+            _run_tax_parcels,
+            deps=_stage_code(process_tax_parcels)
+            + [archive_of(town.tax_parcels_path) for town in TOWNS]
+            + [town.assessor_db_path for town in TOWNS],
+            outs=[RESIDENTIAL_TAX_PARCELS_PATH],
+        )
+    )
+    stages.append(
+        Stage(
+            "process_openspace_access",
+            _run_openspace_access,
+            deps=_stage_code(process_openspace_access)
+            + [
+                RESIDENTIAL_TAX_PARCELS_PATH,
+                OPENSPACE_PATH,
+            ],
+            outs=[OPENSPACE_ACCESS_PATH],
+        )
+    )
+    stages.append(
+        Stage(
+            "process_crash_cube",
+            _run_crash_cube,
+            deps=_stage_code(process_crash_cube, crash_cube)
+            + [
+                CRASH_DATA_PATH,
+                TOWN_BOUNDARIES_PATH,
+                ROAD_INTERSECTIONS_PATH,
+                archive_of(RAW_ROADS_PATH),
+            ],
+            outs=[CRASH_CUBE_PATH],
+        )
+    )
+    return stages
+
+
+def _with_upstream(stages: list, targets) -> list:
+    """The ``targets`` stages and every stage they depend on, in their original order"""
+    by_name = {stage.name: stage for stage in stages}
+    unknown = set(targets) - set(by_name)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}")
+    producers = {out: stage.name for stage in stages for out in stage.outs}
+    selected = set()
+    to_visit = list(targets)
+    while to_visit:
+        name = to_visit.pop()
+        if name not in selected:
+            selected.add(name)
+            to_visit.extend(producers[d] for d in by_name[name].deps if d in producers)
+    return [stage for stage in stages if stage.name in selected]
+
+
+class _StageState:
+    """Digests of each stage's deps and outs when it last ran, persisted to ``path``"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._state = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def is_current(self, stage: Stage, dep_digests: dict) -> bool:
+        recorded = self._state.get(stage.name)
+        return (
+            recorded is not None
+            and recorded["deps"] == dep_digests
+            and recorded["outs"] == {out: path_digest(out) for out in stage.outs}
+        )
+
+    def update(self, stage: Stage, dep_digests: dict):
+        outs = {out: path_digest(out) for out in stage.outs}
+        with self._lock:
+            self._state[stage.name] = {"deps": dep_digests, "outs": outs}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self._state, indent=2, sort_keys=True))
+
+
+def _run_stage(stage: Stage, store: ArtifactStore, state: _StageState, force: bool):
+    """Run ``stage`` unless it is up to date.  Returns whether it ran."""
+    dep_digests = {str(dep): path_digest(dep) for dep in stage.deps}
+    missing = [dep for dep, digest in dep_digests.items() if digest is None]
+    if missing:
+        raise FileNotFoundError(f"Stage {stage.name} is missing inputs {missing}")
+    if not force and state.is_current(stage, dep_digests):
+        logger.info(f"Skipping {stage.name}: inputs and outputs are unchanged")
+        return False
+
+    logger.info(f"Running {stage.name}")
+    with stage_timer(stage.name):
+        stage.run(store)
+    state.update(stage, dep_digests)
+    return True
+
+
+def run_pipeline(
+    targets=None,
+    stages: list = None,
+    max_workers: int = None,
+    force: bool = False,
+    state_path=STATE_PATH,
+) -> list:
+    """Run pipeline stages in dependency order in this process.
+
+    A stage starts as soon as the stages producing its inputs have finished, so independent
+    stages run concurrently in a pool of ``max_workers`` threads.  Frames saved by a stage are
+    kept in memory until every stage that reads them has finished.
+
+    Args:
+        targets (list): names of the stages to run, along with their upstream stages.
+            Defaults to all stages.
+        stages (list): the ``Stage`` DAG. Defaults to ``pipeline_stages()``.
+        max_workers (int): maximum number of stages run at once.
+        force (bool): run stages even if they are up to date.
+        state_path: where to record the deps and outs digests of the stages that ran.
+
+    Returns:
+        list: names of the stages that ran, in order of completion.
+    """
+    stages = pipeline_stages() if stages is None else stages
+    if targets:
+        stages = _with_upstream(stages, targets)
+
+    producers = {out: stage.name for stage in stages for out in stage.outs}
+    upstream = {
+        stage.name: {producers[dep] for dep in stage.deps if dep in producers}
+        for stage in stages
+    }
+    n_consumers = {}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep in producers:
+                n_consumers[dep] = n_consumers.get(dep, 0) + 1
+
+    store = ArtifactStore(consumed=set(n_consumers))
+    state = _StageState(state_path)
+    pending = {stage.name: stage for stage in stages}
+    finished = set()
+    ran = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            for stage in [s for s in pending.values() if upstream[s.name] <= finished]:
+                del pending[stage.name]
+                future = executor.submit(_run_stage, stage, store, state, force)
+                running[future] = stage
+            if not running:
+                raise ValueError(f"Stages {sorted(pending)} have circular dependencies")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                if future.result():
+                    ran.append(stage.name)
+                finished.add(stage.name)
+                # Free frames that no remaining stage reads
+                for out in stage.outs:
+                    if n_consumers.get(out, 0) == 0:
+                        store.release(out)
+                for dep in stage.deps:
+                    if dep in n_consumers:
+                        n_consumers[dep] -= 1
+                        if n_consumers[dep] == 0:
+                            store.release(dep)
+    return ran
+
+
+@click.command()
+@click.argument("targets", nargs=-1)
+@click.option("--workers", type=int, default=None, help="Number of concurrent stages")
+@click.option("--force", is_flag=True, help="Run stages even if they are up to date")
+def main(targets, workers, force):
+    """Console script for running the processing pipeline in one process"""
+    ran = run_pipeline(targets, max_workers=workers, force=force)
+    logger.info(f"Ran {len(ran)} stages: {', '.join(ran) or 'none'}")
+
+
+if __name__ == "__main__":
+    argv = sys.argv
+    sys.exit(main(argv))  # pragma: no cover
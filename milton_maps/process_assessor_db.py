@@ -1,65 +1,416 @@
-"""Usage: milton_maps process_assessor_db INPUT LAYER OUTPUT
+"""Usage: milton_maps process_assessor_db INPUT LAYER OUTPUT [--previous PATH] [--changes PATH] [--compact] [--validation MODE]
 
 Arguments:
   INPUT       path to GDB file containing assessor DB in layer LAYER
   LAYER       layer within GDB file containing asessor DB
-  OUTPUT      output path to write processed Assessor DB as a pickled dataframe
+  OUTPUT      output path to write processed Assessor DB as a pickled dataframe, or as
+              GeoParquet if OUTPUT ends with .parquet.  The hashes of the raw records are
+              written next to it, to _source_hashes/OUTPUT.parquet
+Options:
+  --previous PATH   processed Assessor DB of a previous fiscal year, with its source hashes.
+                    Only parcels added or changed since then are reprocessed.
+  --changes PATH    where to write the log of parcels added, removed and changed since
+                    PREVIOUS, as parquet
+  --compact         store repetitive strings as categoricals and downcast numerics
+  --validation MODE "full" to check every parcel, or "sampled" to check a sample of the
+                    parcels in development runs [default: $MILTON_MAPS_VALIDATION, or full]
 """
+import hashlib
 import json
+import logging
 import sys
+from pathlib import Path
 
 import click
+import fiona
 import geopandas as gpd
-import joblib
+import numpy as np
+import pandas as pd
 from fiona.errors import DriverError
 
 import milton_maps as mm
+from milton_maps.artifacts import is_parquet, read_artifact, write_artifact
+from milton_maps.cache import code_digest
+from milton_maps.compact import compact_frame, memory_report
+from milton_maps.logging_config import log_dataframe, record_read, stage_timer
+from milton_maps.process_town_boundaries import TOWN_IDS_PATH
+from milton_maps.validation import MODES, Check, ValidationSuite
 
+logger = logging.getLogger("process_assessor_db")
 
-def process_assessor_db(input_path, layer, output_path):
+# Hash of each parcel's raw record, stored next to the processed output (see
+# source_hashes_path) so that the next fiscal year's records can be compared against it
+SOURCE_HASH_COLUMN = "SOURCE_HASH"
+
+# Column of the cleaning_digest, hashed with every raw record by source_hashes
+CLEANING_DIGEST_COLUMN = "_CLEANING_DIGEST"
+
+# Subdirectory of the output's directory holding the source hashes.  Parquet readers skip
+# paths starting with "_", so a directory of per-town outputs still reads as one dataset.
+SOURCE_HASHES_DIR = "_source_hashes"
+
+# Columns appended to the raw records by clean_assessor_db
+DERIVED_COLUMNS = ["USE_DESCRIPTION", "IS_RESIDENTIAL", "TOWN"]
+
+# Columns stored as categoricals by process_assessor_db(compact=True)
+ASSESSOR_CATEGORICAL_COLUMNS = [
+    "USE_CODE",
+    "USE_DESCRIPTION",
+    "TOWN",
+    "STYLE",
+    "ZONING",
+]
+
+ASSESSOR_DB_VALIDATION = ValidationSuite(
+    "assessor_db",
+    [
+        Check(
+            "every TOWN_ID is mapped to a TOWN",
+            lambda assessor_df: assessor_df["TOWN"].notna(),
+            rows=True,
+        ),
+    ],
+    # One notna() is much cheaper than hashing every column and coordinate of the records
+    cache=False,
+)
+
+
+def read_assessor_db(input_path, layer) -> gpd.GeoDataFrame:
+    """Read the assessor DB in ``layer`` of a town's parcel GDB"""
     try:
         assessor_df = gpd.read_file(input_path, layer=layer)
     except ValueError:
         raise ValueError(f"{input_path} does not contain the layer {layer}")
     except DriverError:
         raise ValueError(f"{input_path} does not exist")
+    record_read(input_path, assessor_df)
+    return assessor_df
 
+
+def read_use_code_lookup(input_path) -> dict:
+    """Read the town's look-up table of four-digit use codes from its parcel GDB.
+
+    Towns that use four-digit codes publish their meaning in a ``*_UC_LUT`` layer with
+    ``USE_CODE`` and ``USE_DESC`` fields.
+
+    Returns:
+        dict: USE_CODE => description, empty if the GDB has no look-up table.
+    """
+    layers = [
+        layer for layer in fiona.listlayers(input_path) if layer.endswith("UC_LUT")
+    ]
+    if not layers:
+        return {}
+    lookup = gpd.read_file(input_path, layer=layers[0], ignore_geometry=True)
+    record_read(input_path, lookup)
+    lookup = lookup.dropna(subset=["USE_CODE", "USE_DESC"])
+    return dict(zip(lookup.USE_CODE.str.strip(), lookup.USE_DESC.str.strip()))
+
+
+def parcel_index(assessor_df: pd.DataFrame) -> pd.Index:
+    """Unique parcel key of each record of a raw assessor DB"""
     # LOC_ID is globally unique, but is sometimes missing.  TOWN_ID + PROP_ID is guaranteed to be unique,
     # so we replace LOC_ID with the combination of those two fields when missting.
-    assessor_df.index = assessor_df.LOC_ID.fillna(
-        assessor_df.TOWN_ID.astype(str) + assessor_df.PROP_ID
+    return pd.Index(
+        assessor_df.LOC_ID.fillna(assessor_df.TOWN_ID.astype(str) + assessor_df.PROP_ID)
+    )
+
+
+def cleaning_digest(town_ids_map: dict, use_code_lookup: dict = None) -> str:
+    """Hash of what ``clean_assessor_db`` derives its columns from: its code, including
+    ``milton_maps.transform_use_codes`` and ``RESIDENTIAL_USE_CODES``, the town names and the
+    town's use code look-up table"""
+    digest = hashlib.blake2b(digest_size=16)
+    for func in (clean_assessor_db, mm.transform_use_codes):
+        digest.update(code_digest(func).encode())
+    digest.update(
+        json.dumps(
+            [mm.RESIDENTIAL_USE_CODES, town_ids_map, use_code_lookup or {}],
+            sort_keys=True,
+        ).encode()
+    )
+    return digest.hexdigest()
+
+
+def source_hashes(
+    assessor_df: pd.DataFrame, town_ids_map: dict, use_code_lookup: dict = None
+) -> pd.Series:
+    """64-bit hash of each raw record's values, including its geometry if it has one, indexed
+    by ``parcel_index``.
+
+    The ``cleaning_digest`` of ``town_ids_map`` and ``use_code_lookup`` is hashed with every
+    record, so a record is reprocessed by ``update_assessor_db`` when the town names, the use
+    codes or the cleaning code change, even if the record itself didn't.
+    """
+    values = pd.DataFrame(assessor_df, copy=False)
+    if (
+        isinstance(assessor_df, gpd.GeoDataFrame)
+        and assessor_df.geometry.name in values
+    ):
+        values = values.assign(
+            **{assessor_df.geometry.name: assessor_df.geometry.to_wkb()}
+        )
+    values = values.assign(
+        **{CLEANING_DIGEST_COLUMN: cleaning_digest(town_ids_map, use_code_lookup)}
+    )
+    hashes = pd.util.hash_pandas_object(values, index=False)
+    return pd.Series(
+        hashes.values, index=parcel_index(assessor_df), name=SOURCE_HASH_COLUMN
     )
 
+
+def source_hashes_path(output_path) -> str:
+    """Path of the ``source_hashes`` of the raw records of a processed assessor DB, e.g.
+    milton_assessor_db.pkl => _source_hashes/milton_assessor_db.parquet"""
+    output_path = Path(output_path)
+    stem = output_path.name.split(".")[0]
+    return str(output_path.parent / SOURCE_HASHES_DIR / f"{stem}.parquet")
+
+
+def clean_assessor_db(
+    assessor_df: gpd.GeoDataFrame,
+    town_ids_map: dict,
+    use_code_lookup: dict = None,
+    validation: str = None,
+):
+    """Index a raw assessor DB by LOC_ID and append human-readable fields.
+
+    Args:
+        assessor_df (geopandas.GeoDataFrame): raw assessor DB, modified in place.
+        town_ids_map (dict): TOWN_ID => TOWN name, keyed by strings.
+        use_code_lookup (dict): the town's four-digit USE_CODE => description look-up table
+            (see ``read_use_code_lookup``).
+        validation (str): ``full`` or ``sampled`` validation of the result, see
+            ``validation.ValidationSuite.validate``.
+
+    Raises:
+        validation.ValidationError: if the result fails ``ASSESSOR_DB_VALIDATION``.
+    """
+    assessor_df.index = parcel_index(assessor_df)
+
     # Clean up multiple spaces in site address field
     assessor_df["SITE_ADDR"] = assessor_df["SITE_ADDR"].str.split().str.join(" ")
 
     # Append human-readable fields
-    assessor_df["USE_DESCRIPTION"] = mm.transform_use_codes(assessor_df.USE_CODE)
+    town_use_codes = {
+        town_id: use_code_lookup or {} for town_id in assessor_df.TOWN_ID.unique()
+    }
+    assessor_df["USE_DESCRIPTION"] = mm.transform_use_codes(
+        assessor_df.USE_CODE, assessor_df.TOWN_ID, town_use_codes
+    )
     assessor_df["IS_RESIDENTIAL"] = (
         assessor_df["USE_CODE"].str[:3].isin(mm.RESIDENTIAL_USE_CODES)
     )
 
-    with open("data/processed/town_ids.json", "r") as f:
+    assessor_df["TOWN"] = assessor_df["TOWN_ID"].astype(str).map(town_ids_map)
+    ASSESSOR_DB_VALIDATION.validate(assessor_df, mode=validation)
+    return assessor_df
+
+
+def _changed_columns(new: pd.DataFrame, old: pd.DataFrame) -> pd.Series:
+    """Comma-separated names of the columns that differ between aligned rows of two frames"""
+    columns = new.columns
+    # Geometries are compared as WKB, which is much faster than comparing shapes
+    new, old = (
+        df.assign(**{df.geometry.name: df.geometry.to_wkb()})
+        if isinstance(df, gpd.GeoDataFrame)
+        else df
+        for df in (new, old)
+    )
+    differs = pd.DataFrame(
+        {c: ~(new[c].eq(old[c]) | (new[c].isna() & old[c].isna())) for c in columns},
+        index=new.index,
+    )
+    # Multiplying booleans by strings keeps the names of the columns that differ
+    return differs.dot(columns + ",").str.rstrip(",")
+
+
+def update_assessor_db(
+    assessor_df: gpd.GeoDataFrame,
+    previous: gpd.GeoDataFrame,
+    previous_hashes: pd.Series,
+    town_ids_map: dict,
+    use_code_lookup: dict = None,
+    validation: str = None,
+    hashes: pd.Series = None,
+):
+    """Process a new fiscal year's raw assessor DB, reusing unchanged parcels of the previous one.
+
+    Parcels are matched on the index built by ``parcel_index``.  A parcel has changed when the
+    hash of its raw record differs from the one stored next to the previous output (see
+    ``source_hashes_path``), and only added and changed parcels go through
+    ``clean_assessor_db``.  The hashes cover the inputs and code of the cleaning too (see
+    ``source_hashes``), so the result equals
+    ``clean_assessor_db(assessor_df, town_ids_map, use_code_lookup)``.
+
+    Args:
+        assessor_df (geopandas.GeoDataFrame): raw assessor DB of the new fiscal year.
+        previous (geopandas.GeoDataFrame): processed assessor DB of a previous fiscal year.
+        previous_hashes (pandas.Series): ``source_hashes`` of the raw records of ``previous``.
+        town_ids_map (dict): TOWN_ID => TOWN name, keyed by strings.
+        use_code_lookup (dict): see ``clean_assessor_db``.
+        validation (str): see ``clean_assessor_db``.
+        hashes (pandas.Series): ``source_hashes`` of ``assessor_df``, if already computed.
+
+    Returns:
+        tuple: the processed assessor DB, and a change log indexed by PARCEL_ID with columns
+            ``CHANGE`` (``added``, ``removed`` or ``changed``), ``TOWN_ID``, ``PROP_ID`` and
+            ``CHANGED_COLUMNS``, the processed columns whose values changed.  The change log
+            is ``None`` if the previous assessor DB can't be compared record by record, in
+            which case every record is reprocessed.
+    """
+    index = parcel_index(assessor_df)
+    processed_columns = list(assessor_df.columns) + DERIVED_COLUMNS
+    if (
+        list(previous.columns) != processed_columns
+        or not index.is_unique
+        or not previous.index.is_unique
+        or not previous.index.isin(previous_hashes.index).all()
+    ):
+        logger.warning(
+            "Previous assessor DB has different columns, duplicate parcels or missing "
+            "source hashes, reprocessing all records"
+        )
+        return (
+            clean_assessor_db(assessor_df, town_ids_map, use_code_lookup, validation),
+            None,
+        )
+
+    # Compare hashes as uint64; aligning with missing values would round them to floats
+    is_added = ~index.isin(previous.index)
+    is_changed = np.zeros(len(index), dtype=bool)
+    if hashes is None:
+        hashes = source_hashes(assessor_df, town_ids_map, use_code_lookup)
+    is_changed[~is_added] = (
+        hashes.values[~is_added] != previous_hashes.loc[index[~is_added]].values
+    )
+    is_removed = ~previous.index.isin(index)
+    logger.info(
+        f"{is_added.sum()} parcels added, {is_changed.sum()} changed and "
+        f"{is_removed.sum()} removed since the previous assessor DB"
+    )
+
+    updated = clean_assessor_db(
+        assessor_df[is_added | is_changed].copy(),
+        town_ids_map,
+        use_code_lookup,
+        validation,
+    )
+    unchanged = previous.loc[index[~(is_added | is_changed)]]
+    # Skip empty parts, which would upcast the dtypes of the concatenated columns
+    parts = [part for part in (unchanged, updated) if len(part)] or [updated]
+    result = pd.concat(parts).loc[index]
+
+    changed = updated.loc[index[is_changed]]
+    changes = pd.concat(
+        [
+            result.loc[index[is_added], ["TOWN_ID", "PROP_ID"]].assign(CHANGE="added"),
+            previous.loc[is_removed, ["TOWN_ID", "PROP_ID"]].assign(CHANGE="removed"),
+            changed[["TOWN_ID", "PROP_ID"]].assign(
+                CHANGE="changed",
+                CHANGED_COLUMNS=_changed_columns(changed, previous.loc[changed.index]),
+            ),
+        ]
+    )
+    changes.index.name = "PARCEL_ID"
+    return result, pd.DataFrame(
+        changes[["CHANGE", "TOWN_ID", "PROP_ID", "CHANGED_COLUMNS"]]
+    )
+
+
+@stage_timer("process_assessor_db")
+def process_assessor_db(
+    input_path,
+    layer,
+    output_path,
+    previous_path=None,
+    changes_path=None,
+    compact=False,
+    validation=None,
+):
+    """Process a town's assessor DB.
+
+    The hashes of the raw records are written next to the output, to ``source_hashes_path``.
+    If ``previous_path`` is a processed assessor DB of a previous fiscal year with such
+    hashes, only parcels added or changed since then are reprocessed (see
+    ``update_assessor_db``), and the change log is written to ``changes_path`` if given.
+    If ``compact``, the output is stored with ``ASSESSOR_CATEGORICAL_COLUMNS`` as
+    categoricals and numerics downcast (see ``compact.compact_frame``).  ``validation`` is
+    the validation mode of the processed records, see ``clean_assessor_db``.
+    """
+    assessor_df = read_assessor_db(input_path, layer)
+    use_code_lookup = read_use_code_lookup(input_path)
+    with open(TOWN_IDS_PATH, "r") as f:
         town_ids_map = json.load(f)
+    hashes = source_hashes(assessor_df, town_ids_map, use_code_lookup)
 
-    assessor_df["TOWN"] = assessor_df["TOWN_ID"].astype(str).map(town_ids_map)
-    # Check all IDs were mapped
-    assert not assessor_df["TOWN"].isnull().values.any()
+    update = previous_path is not None and Path(previous_path).exists()
+    if update and not Path(source_hashes_path(previous_path)).exists():
+        logger.warning(
+            f"No source hashes of {previous_path}, reprocessing all records instead of "
+            "updating it"
+        )
+        update = False
+
+    if update:
+        previous_hashes = read_artifact(source_hashes_path(previous_path))
+        assessor_db, changes = update_assessor_db(
+            assessor_df,
+            read_artifact(previous_path),
+            previous_hashes[SOURCE_HASH_COLUMN],
+            town_ids_map,
+            use_code_lookup,
+            validation,
+            hashes,
+        )
+        if changes_path is not None and changes is not None:
+            write_artifact(changes, changes_path)
+    else:
+        assessor_db = clean_assessor_db(
+            assessor_df, town_ids_map, use_code_lookup, validation
+        )
 
-    joblib.dump(assessor_df, output_path)
+    if compact:
+        assessor_db = compact_frame(assessor_db, ASSESSOR_CATEGORICAL_COLUMNS)
+        log_dataframe(
+            logger, memory_report(assessor_db), f"Memory used by {output_path}"
+        )
+    write_artifact(assessor_db, output_path)
+    hashes_path = Path(source_hashes_path(output_path))
+    hashes_path.parent.mkdir(parents=True, exist_ok=True)
+    write_artifact(hashes.to_frame(), hashes_path)
 
 
 @click.command()
 @click.argument("input_path")
 @click.argument("layer")
 @click.argument("output_path")
-def main(input_path, layer, output_path):
+@click.option(
+    "--previous", default=None, help="Processed assessor DB of a previous fiscal year"
+)
+@click.option(
+    "--changes", default=None, help="Where to write the change log, as parquet"
+)
+@click.option(
+    "--compact", is_flag=True, help="Store categoricals and downcast numerics"
+)
+@click.option(
+    "--validation",
+    type=click.Choice(MODES),
+    default=None,
+    help="Validate every parcel or a sample",
+)
+def main(input_path, layer, output_path, previous, changes, compact, validation):
     """Console script for processing assessor DB"""
     if input_path[-3:].lower() != "gdb":
         raise ValueError(f"Input file must be a GDB file, got {input_path}")
-    if output_path[-3:].lower() != "pkl":
+    if output_path[-3:].lower() != "pkl" and not is_parquet(output_path):
         output_path += ".pkl"
-    process_assessor_db(input_path, layer, output_path)
+    if changes is not None and not is_parquet(changes):
+        raise ValueError(f"Change log must be written as parquet, got {changes}")
+    process_assessor_db(
+        input_path, layer, output_path, previous, changes, compact, validation
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""Usage: milton_maps process_assessor_dbs INPUT_DIR OUTPUT_DIR [--workers N] [--incremental] [--compact]
+
+Arguments:
+  INPUT_DIR   directory searched recursively for per-town parcel GDB files, e.g.
+              M189_parcels_gdb/M189_parcels_CY22_FY22_sde.gdb, or zip archives of them,
+              e.g. M189_parcels_gdb.zip, which are read without extracting them
+  OUTPUT_DIR  directory to write one processed Assessor DB parquet file per town
+Options:
+  --workers N     number of towns processed in parallel [default: number of CPUs]
+  --incremental   update each town's existing output in OUTPUT_DIR, reprocessing only parcels
+                  added or changed since it was written, and write a change log per town to
+                  OUTPUT_DIR/_changes
+  --compact       store repetitive strings as categoricals and downcast numerics
+"""
+import logging
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import click
+import fiona
+
+from milton_maps.archives import find_members, is_archive_path
+from milton_maps.logging_config import record_write, stage_timer
+from milton_maps.process_assessor_db import process_assessor_db
+
+logger = logging.getLogger("process_assessor_dbs")
+
+# Parcel GDBs are published per town as M<3 digit TOWN_ID>_parcels_<vintage>.gdb
+TOWN_GDB_PATTERN = re.compile(r"M(\d{3})_parcels_.*\.gdb$", re.IGNORECASE)
+
+
+def find_assessor_dbs(input_dir) -> dict:
+    """Map each TOWN_ID to the path of its parcel GDB under ``input_dir``.
+
+    GDBs inside zip archives are addressed with ``zip://`` paths (see ``archives``).  If a
+    town's GDB has also been extracted from its archive, the extracted copy is used.
+    """
+    gdb_paths = [str(p) for p in sorted(Path(input_dir).rglob("*.gdb"))]
+    for archive_path in sorted(Path(input_dir).rglob("*.zip")):
+        gdb_paths.extend(find_members(archive_path, re.compile(r"\.gdb$", re.I)))
+
+    town_gdbs = {}
+    for gdb_path in gdb_paths:
+        match = TOWN_GDB_PATTERN.search(Path(gdb_path).name)
+        if match is None:
+            logger.warning(f"Skipping {gdb_path}, which is not named like a parcel GDB")
+            continue
+        town_id = int(match.group(1))
+        if town_id in town_gdbs:
+            if is_archive_path(gdb_path) and not is_archive_path(town_gdbs[town_id]):
+                continue  # Archive of a GDB that has already been found extracted
+            raise ValueError(
+                f"Found multiple GDBs for TOWN_ID {town_id}: {town_gdbs[town_id]}, {gdb_path}"
+            )
+        town_gdbs[town_id] = gdb_path
+    return town_gdbs
+
+
+def assessor_layer(gdb_path) -> str:
+    """Name of the assessor table within a parcel GDB, e.g. M189Assess"""
+    layers = [layer for layer in fiona.listlayers(gdb_path) if layer.endswith("Assess")]
+    if len(layers) != 1:
+        raise ValueError(f"Expected one assessor layer in {gdb_path}, found {layers}")
+    return layers[0]
+
+
+# Subdirectory of the output directory holding per-town change logs.  Parquet readers skip
+# paths starting with "_", so the output directory still reads as one dataset.
+CHANGES_DIR = "_changes"
+
+
+def _process_town(gdb_path, output_path, incremental=False, compact=False):
+    previous_path, changes_path = None, None
+    if incremental:
+        previous_path = output_path
+        changes_path = (
+            output_path.parent / CHANGES_DIR / f"{output_path.stem}_changes.parquet"
+        )
+        changes_path.parent.mkdir(exist_ok=True)
+    process_assessor_db(
+        str(gdb_path),
+        assessor_layer(gdb_path),
+        str(output_path),
+        previous_path=previous_path,
+        changes_path=changes_path,
+        compact=compact,
+    )
+    return output_path
+
+
+@stage_timer("process_assessor_dbs")
+def process_assessor_dbs(
+    input_dir,
+    output_dir,
+    max_workers: int = None,
+    incremental: bool = False,
+    compact: bool = False,
+) -> list:
+    """Process every town's assessor DB under ``input_dir`` in a pool of worker processes.
+
+    Each worker writes its town's processed frame directly to
+    ``OUTPUT_DIR/M<TOWN_ID>_assessor_db.parquet`` and returns only the path, so no more than
+    ``max_workers`` town frames are in memory at once.  The source hashes of each town's
+    records are kept in ``OUTPUT_DIR/_source_hashes`` (see
+    ``process_assessor_db.source_hashes_path``), so the output directory can be read as a
+    single dataset with ``artifacts.read_artifact``.
+
+    With ``incremental``, each town's existing output is treated as the previous fiscal year
+    (see ``process_assessor_db.update_assessor_db``), so a refresh only reprocesses changed
+    parcels.  Towns without an existing output are processed in full.  With ``compact``, each
+    town's frame is stored compactly (see ``process_assessor_db.process_assessor_db``).
+
+    Returns:
+        list: paths of the per-town parquet files written.
+    """
+    town_gdbs = find_assessor_dbs(input_dir)
+    if not town_gdbs:
+        raise ValueError(f"No parcel GDB files found in {input_dir}")
+    logger.info(f"Processing assessor DBs for {len(town_gdbs)} towns")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    written = []
+    failures = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                _process_town,
+                gdb_path,
+                output_dir / f"M{town_id:03d}_assessor_db.parquet",
+                incremental,
+                compact,
+            ): town_id
+            for town_id, gdb_path in town_gdbs.items()
+        }
+        for future in as_completed(futures):
+            town_id = futures[future]
+            try:
+                written.append(future.result())
+                # Workers write their own outputs; count them towards this stage too
+                record_write(written[-1])
+            except Exception as e:
+                logger.error(
+                    f"Failed to process assessor DB for TOWN_ID {town_id}: {e}"
+                )
+                failures[town_id] = e
+
+    if failures:
+        raise RuntimeError(
+            f"Assessor DB processing failed for TOWN_IDs {sorted(failures)}"
+        )
+    return sorted(written)
+
+
+@click.command()
+@click.argument("input_dir")
+@click.argument("output_dir")
+@click.option("--workers", type=int, default=None, help="Number of worker processes")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only reprocess parcels changed since the last run",
+)
+@click.option(
+    "--compact", is_flag=True, help="Store categoricals and downcast numerics"
+)
+def main(input_dir, output_dir, workers, incremental, compact):
+    """Console script for processing all assessor DBs in a directory"""
+    process_assessor_dbs(
+        input_dir,
+        output_dir,
+        max_workers=workers,
+        incremental=incremental,
+        compact=compact,
+    )
+
+
+if __name__ == "__main__":
+    argv = sys.argv
+    sys.exit(main(argv))  # pragma: no cover
@@ -0,0 +1,60 @@
+"""Usage: milton_maps process_crash_cube CRASHES OUTPUT [--towns NAMES]
+
+Arguments:
+  CRASHES     path to a MassDOT crash details CSV export
+  OUTPUT      output path to write the crash cube, as .npz
+Options:
+  --towns NAMES   comma separated names of the towns whose crashes are counted [default: MILTON]
+
+Counts the crashes in the towns by year, month, hour, severity, town, location (intersection
+or mid-block), route, road segment and direction of travel.  See ``crash_cube``.
+"""
+import sys
+
+import click
+
+from milton_maps.crash_cube import build_crash_cube
+from milton_maps.logging_config import stage_timer
+from milton_maps.process_crash_data import (
+    get_road_intersections,
+    get_town_boundaries,
+    get_town_roads,
+    read_crash_data,
+)
+from milton_maps.process_road_intersections import classify_crash_locations
+from milton_maps.road_corridors import assign_crashes_to_segments
+
+
+def crash_cube_for_towns(crash_data_path, towns, intersections=None):
+    """Build the crash cube of the crashes in ``towns``, located on their roads"""
+    crashes = read_crash_data(
+        crash_data_path, town_boundaries=get_town_boundaries(towns=towns)
+    )
+    crashes = assign_crashes_to_segments(crashes, get_town_roads(towns))
+    if intersections is None:
+        intersections = get_road_intersections()
+    crashes = classify_crash_locations(crashes, intersections)
+    return build_crash_cube(crashes)
+
+
+@stage_timer("process_crash_cube")
+def process_crash_cube(crash_data_path, output_path, towns=("MILTON",)):
+    crash_cube_for_towns(crash_data_path, towns).save(output_path)
+
+
+@click.command()
+@click.argument("crash_data_path")
+@click.argument("output_path")
+@click.option(
+    "--towns", default="MILTON", help="Comma separated names of the towns to count"
+)
+def main(crash_data_path, output_path, towns):
+    """Console script for building the crash cube"""
+    if not output_path.lower().endswith(".npz"):
+        output_path += ".npz"
+    process_crash_cube(crash_data_path, output_path, towns.upper().split(","))
+
+
+if __name__ == "__main__":
+    argv = sys.argv
+    sys.exit(main(argv))  # pragma: no cover
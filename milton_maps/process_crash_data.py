@@ -3,7 +3,20 @@ from pathlib import Path
 
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point
+
+from milton_maps.archives import archive_member
+from milton_maps.artifacts import read_artifact
+from milton_maps.cache import arrow_cache, code_digest, file_digest, layer_cache
+from milton_maps.crash_store import CrashStore, crash_table
+from milton_maps.logging_config import record_read
+from milton_maps.process_road_intersections import (
+    STREET_COLUMN,
+    classify_crash_locations,
+    read_roads,
+)
+from milton_maps.process_town_boundaries import simplified_path
+from milton_maps.road_corridors import assign_crashes_to_segments
+from milton_maps.spatial import assign_towns
 
 logger = logging.getLogger("process_crash_data")
 
@@ -27,34 +40,66 @@ INJURY_MAP = {
 ROOT_DIR = Path(__file__).parent.parent
 
 
-def get_milton_boundaries():
-    town_boundaries = gpd.read_file(
-        ROOT_DIR / "data/processed/town_boundaries.shp.zip"
-    ).set_index("TOWN_ID")
-    milton_boundaries = town_boundaries[town_boundaries.TOWN.isin(["MILTON"])]
-    return milton_boundaries
+TOWN_BOUNDARIES_PATH = ROOT_DIR / "data/processed/town_boundaries.shp.zip"
+# Road segments layer of the MassDOT roads archive, read without extracting it
+MASSDOT_ROADS_PATH = archive_member(
+    ROOT_DIR / "data/raw/MassDOT_Roads_SHP.zip", "EOTROADS_ARC.shp"
+)
+ROAD_INTERSECTIONS_PATH = ROOT_DIR / "data/processed/road_intersections.parquet"
 
 
-def get_crash_data(milton_boundaries=None) -> gpd.GeoDataFrame:
+def _read_town_boundaries(path, towns=None):
+    town_boundaries = gpd.read_file(path).set_index("TOWN_ID")
+    if towns is not None:
+        town_boundaries = town_boundaries[town_boundaries.TOWN.isin(towns)]
+    return town_boundaries
 
-    if not milton_boundaries:
-        milton_boundaries = get_milton_boundaries()
 
-    # Read in crash data, which is in a CSV file with CRLF line endings, skipping 2 (??) rows.
-    crash_data = pd.read_csv(
-        ROOT_DIR / "data/raw/MiltonCrashDetails.csv",
-        skiprows=2,
-        dtype={
-            "Maximum_Injury_Severity_Reported": "category",
-            "Crash_Severity": "category",
-            "At_Roadway_Intersection": "category",
-        },
+def get_town_boundaries(tolerance: int = None, towns=None):
+    """Load the processed boundaries of all Massachusetts towns, indexed by TOWN_ID
+
+    Args:
+        tolerance (int): load the boundaries simplified to this many meters, one of
+            ``process_town_boundaries.SIMPLIFY_TOLERANCES``. For maps, see
+            ``process_town_boundaries.tolerance_for_scale``. Defaults to ``None``, the full
+            resolution boundaries.
+        towns (list): optional TOWN names to keep, e.g. ``["MILTON", "QUINCY"]``.
+    """
+    path = TOWN_BOUNDARIES_PATH
+    if tolerance is not None:
+        path = simplified_path(TOWN_BOUNDARIES_PATH, tolerance)
+    if towns is None:
+        return layer_cache.load(path, _read_town_boundaries)
+    return layer_cache.load(path, _read_town_boundaries, towns=list(towns))
+
+
+def get_milton_boundaries():
+    return layer_cache.load(
+        TOWN_BOUNDARIES_PATH, _read_town_boundaries, towns=["MILTON"]
     )
-    crash_data.shape
+
+
+CRASH_DATA_PATH = ROOT_DIR / "data/raw/MiltonCrashDetails.csv"
+
+# Crash_Date and Crash_Time are exported as e.g. "15-Jul-2022" and "10:30 PM"
+CRASH_DATETIME_FORMAT = "%d-%b-%Y %I:%M %p"
+
+CATEGORICAL_CRASH_COLUMNS = [
+    "Maximum_Injury_Severity_Reported",
+    "Crash_Severity",
+    "At_Roadway_Intersection",
+    "severity",
+]
+
+
+def _clean_crash_records(crash_data: pd.DataFrame) -> gpd.GeoDataFrame:
+    """Derive datetime, year, severity and point geometry for one block of raw crash records"""
 
     # combine text Crash_Date and Crash_Time fields into a single datetime field, assuming EST timezone.
     crash_data["Crash_DateTime"] = pd.to_datetime(
-        crash_data["Crash_Date"] + " " + crash_data["Crash_Time"], utc=True
+        crash_data["Crash_Date"] + " " + crash_data["Crash_Time"],
+        format=CRASH_DATETIME_FORMAT,
+        utc=True,
     ).dt.tz_convert("EST")
     crash_data["year"] = crash_data["Crash_DateTime"].dt.year
     crash_data["severity"] = (
@@ -68,56 +113,201 @@ def get_crash_data(milton_boundaries=None) -> gpd.GeoDataFrame:
     - [ ] Transform Manner of Colission into a categorical variable.
     """
 
-    logger.info(
-        f"Found {crash_data[crash_data['X_Cooordinate'].isnull() | crash_data['Y_Cooordinate'].isnull()].shape[0]} records missing coordinates, and will be dropped"
-    )
     crash_data = crash_data.dropna(subset=["X_Cooordinate", "Y_Cooordinate"])
-    geometry = crash_data.apply(
-        lambda row: Point(row["X_Cooordinate"], row["Y_Cooordinate"]), axis=1
+    geometry = gpd.points_from_xy(
+        crash_data["X_Cooordinate"], crash_data["Y_Cooordinate"], crs="EPSG:26986"
     )
-    crash_geodf = gpd.GeoDataFrame(data=crash_data, geometry=geometry, crs="EPSG:26986")
-    # apply `milton_boundaries` as a mask to the crash_geodf
-    crash_geodf2 = gpd.clip(crash_geodf, milton_boundaries)
-    # determine how many records were dropped by the geoclip
+    return gpd.GeoDataFrame(data=crash_data, geometry=geometry, crs="EPSG:26986")
+
+
+def read_crash_data(
+    path=CRASH_DATA_PATH,
+    town_boundaries: gpd.GeoDataFrame = None,
+    town_ids=None,
+    chunksize: int = None,
+) -> gpd.GeoDataFrame:
+    """Read a MassDOT crash details CSV export into a GeoDataFrame of crash points.
+
+    Args:
+        path: path to the crash details CSV export. Defaults to the Milton export.
+        town_boundaries (geopandas.GeoDataFrame): optional town polygons indexed by TOWN_ID.
+            When given, every crash is tagged with the TOWN_ID of the town containing it
+            (see ``spatial.assign_towns``) and crashes outside of all towns are dropped.
+        town_ids (list): optional TOWN_IDs to keep.  Requires ``town_boundaries``.
+        chunksize (int): if set, stream the CSV in blocks of ``chunksize`` rows, cleaning and
+            filtering each block before reading the next one.  Peak memory is then bounded by the
+            block size plus the retained records, which makes statewide exports tractable.
+            Defaults to ``None``, which reads the whole file at once.
+
+    Returns:
+        geopandas.GeoDataFrame: cleaned crash records in EPSG:26986.  The result does not
+        depend on ``chunksize``.
+    """
+    if town_ids is not None and town_boundaries is None:
+        raise ValueError("Filtering on town_ids requires town_boundaries")
+
+    # Read in crash data, which is in a CSV file with CRLF line endings, skipping 2 (??) rows.
+    # Categorical columns are read as strings and categorized once at the end, so that every
+    # chunk shares the same categories.
+    if chunksize is None:
+        chunks = [pd.read_csv(path, skiprows=2)]
+    else:
+        chunks = pd.read_csv(path, skiprows=2, chunksize=chunksize)
+
+    n_missing_coordinates = 0
+    n_outside_towns = 0
+    crash_blocks = []
+    record_read(path)
+    for crash_data in chunks:
+        record_read(df=crash_data)
+        crash_block = _clean_crash_records(crash_data)
+        n_missing_coordinates += crash_data.shape[0] - crash_block.shape[0]
+        if town_boundaries is not None:
+            crash_block["TOWN_ID"] = assign_towns(crash_block, town_boundaries)
+            if town_ids is None:
+                in_towns = crash_block["TOWN_ID"].notna()
+            else:
+                in_towns = crash_block["TOWN_ID"].isin(town_ids)
+            n_outside_towns += (~in_towns).sum()
+            crash_block = crash_block[in_towns]
+        crash_blocks.append(crash_block)
+
     logger.info(
-        f"Found {crash_geodf.shape[0] - crash_geodf2.shape[0]} records outside Milton were dropped by the geoclip."
+        f"Found {n_missing_coordinates} records missing coordinates, and will be dropped"
     )
-    return crash_geodf2
+    if town_boundaries is not None:
+        # determine how many records were dropped by the town filter
+        logger.info(
+            f"Found {n_outside_towns} records outside the selected towns were dropped."
+        )
 
+    crash_geodf = gpd.GeoDataFrame(
+        pd.concat(crash_blocks), geometry="geometry", crs="EPSG:26986"
+    )
+    for column in CATEGORICAL_CRASH_COLUMNS:
+        crash_geodf[column] = crash_geodf[column].astype("category")
+    return crash_geodf
 
-def get_randolph_ave_shape():
-    massdot_roads = gpd.read_file(ROOT_DIR / "data/raw/MassDOT_Roads_SHP.zip")
-    randolph_ave = massdot_roads.loc[
-        (massdot_roads.RT_NUMBER == "28")
-        & (massdot_roads.STREET_NAM.str.lower().str.contains("randolph"))
+
+def crash_cleaning_digest() -> str:
+    """Hash of ``read_crash_data`` and of the helpers and constants it uses, such as
+    ``INJURY_MAP`` and ``CRASH_DATETIME_FORMAT``, for the keys of cached cleaned crashes
+    """
+    return code_digest(read_crash_data)
+
+
+def _read_crash_table(path, town_boundaries_digest, cleaning_digest):
+    # The digests of the boundaries and of the cleaning code are only parameters so that
+    # they're part of the cache key
+    return crash_table(read_crash_data(path, town_boundaries=get_milton_boundaries()))
+
+
+def get_crash_store() -> CrashStore:
+    """Open the cleaned Milton crash records, memory mapped from the ``cache.arrow_cache``.
+
+    The first call parses the raw export like ``get_crash_data``.  Later calls, in any
+    process, map the cached table until the raw export, the town boundaries or the code
+    cleaning the records (see ``crash_cleaning_digest``) change.
+    """
+    table = arrow_cache.load(
+        CRASH_DATA_PATH,
+        _read_crash_table,
+        town_boundaries_digest=file_digest(TOWN_BOUNDARIES_PATH),
+        cleaning_digest=crash_cleaning_digest(),
+    )
+    return CrashStore(table)
+
+
+def get_crash_data(milton_boundaries=None, chunksize: int = None) -> gpd.GeoDataFrame:
+    """Load Milton crash records, tagged with TOWN_ID and restricted to Milton.
+
+    Args:
+        milton_boundaries (geopandas.GeoDataFrame): town polygons indexed by TOWN_ID to
+            restrict crashes to. Defaults to the Milton boundary from
+            ``get_milton_boundaries()``.
+        chunksize (int): if set, stream the CSV in blocks of ``chunksize`` rows. See
+            ``read_crash_data``.
+
+    With the default arguments, the records are loaded from ``get_crash_store()`` instead
+    of parsing the raw export again.
+    """
+    if milton_boundaries is None and chunksize is None:
+        return get_crash_store().to_geodataframe()
+    if milton_boundaries is None:
+        milton_boundaries = get_milton_boundaries()
+
+    return read_crash_data(
+        CRASH_DATA_PATH,
+        town_boundaries=milton_boundaries,
+        chunksize=chunksize,
+    )
+
+
+def _read_route_segments(path, rt_number, street_name):
+    massdot_roads = read_roads(path)
+    return massdot_roads.loc[
+        (massdot_roads.RT_NUMBER == rt_number)
+        & (massdot_roads[STREET_COLUMN].str.lower().str.contains(street_name))
     ]
 
-    return randolph_ave
 
+def _read_town_roads(path, towns, town_boundaries_digest):
+    # The digest of the boundaries is only a parameter so that it's part of the cache key
+    town_boundaries = get_town_boundaries()
+    return read_roads(path, mask=town_boundaries[town_boundaries.TOWN.isin(towns)])
+
+
+def get_town_roads(towns=("MILTON",)):
+    """Load the MassDOT road segments intersecting the named towns, e.g. for
+    ``road_corridors.assign_crashes_to_segments``"""
+    return layer_cache.load(
+        MASSDOT_ROADS_PATH,
+        _read_town_roads,
+        towns=list(towns),
+        town_boundaries_digest=file_digest(TOWN_BOUNDARIES_PATH),
+    )
+
+
+def get_randolph_ave_shape():
+    return layer_cache.load(
+        MASSDOT_ROADS_PATH, _read_route_segments, rt_number="28", street_name="randolph"
+    )
 
-def randolph_ave_upstream_vs_intersection(crash_geodf=None, randolph_ave=None):
+
+def get_road_intersections():
+    """Load the road intersection nodes written by ``process_road_intersections``"""
+    return read_artifact(ROAD_INTERSECTIONS_PATH)
+
+
+def randolph_ave_upstream_vs_intersection(
+    crash_geodf=None, randolph_ave=None, intersections=None
+):
     if randolph_ave is None:
         randolph_ave = get_randolph_ave_shape()
 
     if crash_geodf is None:
         crash_geodf = get_crash_data()
 
+    if intersections is None:
+        intersections = get_road_intersections()
+
     # Filter crash points to those within 20 meters of randolph avenue line
-    randolph_ave_buffer = randolph_ave.buffer(20)
-    # Crash points inside the randolph_ave_buffer
-    randolph_ave_crashes = gpd.clip(crash_geodf, randolph_ave_buffer)
-
-    # Create a polygon buffer of 30 meters around the latitude longitude (42.224225, -71.070639), which is the Chickatawbutt/Randolph intersection.
-    # in the same CRS as the crash data.
-    chickatawbut_randolph_intersection = (
-        gpd.GeoSeries(
-            Point(-71.070639, 42.224225), crs="EPSG:4326"  # Latitude/Longitude CRS
-        )
-        .to_crs("EPSG:26986")  # This CRS measures units in meters
-        .buffer(20)
+    randolph_ave_crashes = assign_crashes_to_segments(
+        crash_geodf, randolph_ave, tolerance=20
     )
+    randolph_ave_crashes = randolph_ave_crashes[
+        randolph_ave_crashes["SEGMENT_ID"].notna()
+    ]
 
-    intersection_crashes = gpd.clip(crash_geodf, chickatawbut_randolph_intersection)
+    # Crashes within 20 meters of the Chickatawbut/Randolph intersection node(s).
+    chickatawbut_randolph_ids = intersections.index[
+        intersections.STREETS.str.contains("CHICKATAWBUT")
+        & intersections.STREETS.str.contains("RANDOLPH")
+    ]
+    classified_crashes = classify_crash_locations(crash_geodf, intersections, radius=20)
+    intersection_crashes = crash_geodf.loc[
+        classified_crashes.INTERSECTION_ID.isin(chickatawbut_randolph_ids).values
+    ].copy()
     logger.info(f"Intersection crashes shape: {intersection_crashes.shape}")
 
     upstream_crashes = randolph_ave_crashes.loc[
@@ -2,19 +2,20 @@
 
 Arguments:
   INPUT       path to SHP file containing assessor DB in layer LAYER
-  OUTPUT      output path to write processed Assessor DB as a pickled dataframe
+  OUTPUT      output path to write processed Assessor DB as a zipped shapefile, or as
+              GeoParquet if OUTPUT ends with .parquet
 """
 import sys
 
 import click
-import geopandas as gpd
 
 import milton_maps as mm
+from milton_maps.artifacts import is_parquet, read_artifact, write_artifact
+from milton_maps.logging_config import stage_timer
 
 
-def process_openspace(input_path, output_path):
-    openspace = gpd.read_file(input_path)
-
+def clean_openspace(openspace):
+    """Replace coded open space fields with human-readable values, modifying ``openspace``"""
     # Manager is only populated when it differs from owner.  Backfill to make field human-readable
     openspace["MANAGER"] = openspace["FEE_OWNER"].fillna(openspace["MANAGER"])
 
@@ -22,8 +23,13 @@ def process_openspace(input_path, output_path):
     openspace["PUB_ACCESS"] = openspace["PUB_ACCESS"].map(mm.PUBLIC_ACCESS_CODES)
     openspace["PRIM_PURP"] = openspace["PRIM_PURP"].map(mm.PRIMARY_PURPOSE_CODES)
     openspace["LEV_PROT"] = openspace["LEV_PROT"].map(mm.LEVEL_OF_PROTECTION_CODES)
+    return openspace
 
-    openspace.to_file(output_path, driver="ESRI Shapefile")
+
+@stage_timer("process_openspace")
+def process_openspace(input_path, output_path):
+    openspace = read_artifact(input_path)
+    write_artifact(clean_openspace(openspace), output_path)
 
 
 @click.command()
@@ -31,10 +37,10 @@ def process_openspace(input_path, output_path):
 @click.argument("output_path")
 def main(input_path, output_path):
     """Console script for processing assessor DB"""
-    if input_path[-3:].lower() != "shp":
-        raise ValueError(f"Input file must be a SHP file, got {input_path}")
+    if input_path[-3:].lower() != "shp" and not is_parquet(input_path):
+        raise ValueError(f"Input file must be a SHP or parquet file, got {input_path}")
     output_file = output_path
-    if output_path[-7:].lower() != "shp.zip":
+    if output_path[-7:].lower() != "shp.zip" and not is_parquet(output_path):
         output_file += ".shp.zip"
     process_openspace(input_path, output_file)
 
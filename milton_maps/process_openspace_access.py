@@ -0,0 +1,189 @@
+"""Usage: milton_maps process_openspace_access PARCELS OPENSPACE OUTPUT [--radii METERS]
+
+Arguments:
+  PARCELS     path to the residential tax parcels written by process_tax_parcels
+  OPENSPACE   path to the open space layer written by process_openspace
+  OUTPUT      output path to write the parcels annotated with open space access metrics as a
+              pickled dataframe, or as GeoParquet if OUTPUT ends with .parquet
+Options:
+  --radii METERS   comma separated distances within which to total protected open space
+                   acreage [default: 400,800,1600]
+
+Annotates each parcel with the distance to the nearest open space that is open to the public,
+and with the acreage of protected open space within each radius.
+"""
+import logging
+import sys
+
+import click
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+import milton_maps as mm
+from milton_maps.artifacts import is_parquet, read_artifact, write_artifact
+from milton_maps.logging_config import stage_timer
+from milton_maps.spatial import geos, query_within_distance, to_geos
+
+logger = logging.getLogger("process_openspace_access")
+
+# Distances in meters, the unit of the Mass State Plane CRS of the MassGIS layers.  Roughly
+# a 5, 10 and 20 minute walk.
+DEFAULT_RADII = [400, 800, 1600]
+
+PUBLIC_ACCESS = mm.PUBLIC_ACCESS_CODES["Y"]
+# Open space counted as protected by protected_acres_within
+PROTECTED_LEVELS = [mm.LEVEL_OF_PROTECTION_CODES["P"]]
+
+SQUARE_METERS_PER_ACRE = 4046.8564224
+
+
+def _has_geometry(geometries: gpd.GeoSeries) -> np.ndarray:
+    return (~(geometries.isna() | geometries.is_empty)).values
+
+
+def nearest_public_openspace(
+    parcels: gpd.GeoDataFrame, openspace: gpd.GeoDataFrame
+) -> pd.DataFrame:
+    """Nearest open space open to the public from each parcel.
+
+    Args:
+        parcels (geopandas.GeoDataFrame): parcel polygons.
+        openspace (geopandas.GeoDataFrame): open space cleaned by
+            ``process_openspace.clean_openspace``, in the same CRS as ``parcels``.
+
+    Returns:
+        pandas.DataFrame: indexed like ``parcels``, with the ``SITE_NAME`` of the nearest
+        public open space as ``NEAREST_PUBLIC_OPENSPACE`` and the distance to its edge in
+        CRS units as ``NEAREST_PUBLIC_OPENSPACE_DIST`` (0 for parcels touching it).  Both
+        are missing for parcels without a geometry.
+    """
+    public = openspace[openspace.PUB_ACCESS == PUBLIC_ACCESS]
+    names = np.full(len(parcels), None, dtype=object)
+    distances = np.full(len(parcels), np.nan)
+
+    has_geometry = _has_geometry(parcels.geometry)
+    if len(public) and has_geometry.any():
+        (parcel_idx, public_idx), nearest_distances = public.sindex.nearest(
+            parcels.geometry[has_geometry], return_all=False, return_distance=True
+        )
+        positions = np.flatnonzero(has_geometry)[parcel_idx]
+        names[positions] = public.SITE_NAME.values[public_idx]
+        distances[positions] = nearest_distances
+    return pd.DataFrame(
+        {
+            "NEAREST_PUBLIC_OPENSPACE": names,
+            "NEAREST_PUBLIC_OPENSPACE_DIST": distances,
+        },
+        index=parcels.index,
+    )
+
+
+def acres_column(radius) -> str:
+    """Name of the column holding the protected acreage within ``radius``"""
+    return f"PROTECTED_ACRES_{radius:g}M"
+
+
+def protected_acres_within(
+    parcels: gpd.GeoDataFrame,
+    openspace: gpd.GeoDataFrame,
+    radii: list = DEFAULT_RADII,
+    protection_levels: list = PROTECTED_LEVELS,
+) -> pd.DataFrame:
+    """Acreage of protected open space within each radius of each parcel.
+
+    An open space's whole acreage counts towards a parcel if any part of it is within the
+    radius of the parcel's edge.  The spatial index is queried once with the largest radius,
+    and the distances of the candidate pairs are binned into every radius.
+
+    Args:
+        parcels (geopandas.GeoDataFrame): parcel polygons.
+        openspace (geopandas.GeoDataFrame): open space cleaned by
+            ``process_openspace.clean_openspace``, in the same CRS as ``parcels``.
+        radii (list): distances in CRS units.
+        protection_levels (list): ``LEV_PROT`` values of the open space to count.
+
+    Returns:
+        pandas.DataFrame: indexed like ``parcels``, with one column per radius named by
+        ``acres_column``.  Parcels without a geometry have no acreage.
+    """
+    protected = openspace[openspace.LEV_PROT.isin(protection_levels)]
+    if "GIS_ACRES" in protected:
+        acres = protected.GIS_ACRES.values
+    else:
+        acres = protected.geometry.area.values / SQUARE_METERS_PER_ACRE
+
+    parcel_geometries = to_geos(parcels.geometry)
+    protected_geometries = to_geos(protected.geometry)
+    parcel_idx, protected_idx = query_within_distance(
+        protected_geometries, parcel_geometries, max(radii, default=0)
+    )
+    distances = geos.distance(
+        parcel_geometries[parcel_idx], protected_geometries[protected_idx]
+    )
+
+    totals = {}
+    for radius in radii:
+        within = distances <= radius
+        totals[acres_column(radius)] = np.bincount(
+            parcel_idx[within],
+            weights=acres[protected_idx[within]],
+            minlength=len(parcels),
+        )
+    return pd.DataFrame(totals, index=parcels.index)
+
+
+def openspace_access(
+    parcels: gpd.GeoDataFrame,
+    openspace: gpd.GeoDataFrame,
+    radii: list = DEFAULT_RADII,
+) -> gpd.GeoDataFrame:
+    """``parcels`` with the columns of ``nearest_public_openspace`` and
+    ``protected_acres_within`` appended"""
+    if openspace.crs != parcels.crs:
+        openspace = openspace.to_crs(parcels.crs)
+    nearest = nearest_public_openspace(parcels, openspace)
+    acres = protected_acres_within(parcels, openspace, radii)
+    return parcels.assign(
+        **{column: nearest[column].values for column in nearest},
+        **{column: acres[column].values for column in acres},
+    )
+
+
+@stage_timer("process_openspace_access")
+def process_openspace_access(
+    parcels_path, openspace_path, output_path, radii=DEFAULT_RADII
+):
+    parcels = read_artifact(parcels_path)
+    openspace = read_artifact(
+        openspace_path,
+        columns=["SITE_NAME", "PUB_ACCESS", "LEV_PROT", "GIS_ACRES", "geometry"],
+    )
+    parcels = openspace_access(parcels, openspace, radii)
+    logger.info(
+        f"Annotated {len(parcels)} parcels; median distance to public open space "
+        f"{parcels.NEAREST_PUBLIC_OPENSPACE_DIST.median():.0f}"
+    )
+    write_artifact(parcels, output_path)
+
+
+@click.command()
+@click.argument("parcels_path")
+@click.argument("openspace_path")
+@click.argument("output_path")
+@click.option(
+    "--radii",
+    default=",".join(str(r) for r in DEFAULT_RADII),
+    help="Comma separated radii in meters",
+)
+def main(parcels_path, openspace_path, output_path, radii):
+    """Console script for computing open space access metrics of parcels"""
+    if output_path[-3:].lower() != "pkl" and not is_parquet(output_path):
+        output_path += ".pkl"
+    radii = [float(r) for r in radii.split(",")]
+    process_openspace_access(parcels_path, openspace_path, output_path, radii)
+
+
+if __name__ == "__main__":
+    argv = sys.argv
+    sys.exit(main(argv))  # pragma: no cover
@@ -0,0 +1,214 @@
+"""Usage: milton_maps process_road_intersections INPUT OUTPUT
+
+Arguments:
+  INPUT       path to the MassDOT roads shapefile (or zip/parquet) containing road segments
+  OUTPUT      output path to write the road intersection point layer, as GeoParquet if OUTPUT
+              ends with .parquet, otherwise as a zipped shapefile
+"""
+import logging
+import sys
+
+import click
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from milton_maps.artifacts import read_artifact, write_artifact
+from milton_maps.logging_config import record_read, stage_timer
+from milton_maps.spatial import from_geos, geos, to_geos
+
+logger = logging.getLogger("process_road_intersections")
+
+# Crossing points closer than this many meters are treated as one intersection node.
+NODE_PRECISION = 0.5
+
+# Street name column of the MassDOT road segments layer, EOTROADS_ARC
+STREET_COLUMN = "STREETNAME"
+
+# Other layers of the MassDOT roads archive truncate the column names differently.  Roads are
+# renamed to the EOTROADS_ARC names when read, so that any of them can be used.
+ROAD_COLUMN_ALIASES = {"STREET_NAM": STREET_COLUMN}
+
+
+def normalize_road_columns(roads: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """``roads`` with its columns named as in the EOTROADS_ARC layer"""
+    aliases = {
+        alias: name
+        for alias, name in ROAD_COLUMN_ALIASES.items()
+        if alias in roads.columns and name not in roads.columns
+    }
+    return roads.rename(columns=aliases) if aliases else roads
+
+
+def read_roads(path, mask=None) -> gpd.GeoDataFrame:
+    """Read a MassDOT roads layer, with its columns named as in EOTROADS_ARC.
+
+    Args:
+        path: path to the layer, e.g. a member of the MassDOT roads archive.
+        mask: optional geometries or GeoDataFrame; only road segments intersecting them are
+            read.
+    """
+    if mask is None:
+        return normalize_road_columns(read_artifact(path))
+    roads = gpd.read_file(path, mask=mask)
+    record_read(path, roads)
+    return normalize_road_columns(roads)
+
+
+def intersection_ids(node_keys: np.ndarray) -> np.ndarray:
+    """Stable ID of each node, from its coordinates rounded to ``NODE_PRECISION``: the rounded
+    x in the high 32 bits and the rounded y in the low 32 bits.  A node keeps its ID across
+    runs, whatever other roads are read."""
+    x, y = node_keys[:, 0].astype(np.int64), node_keys[:, 1].astype(np.int64)
+    return (x << 32) + (y & 0xFFFFFFFF)
+
+
+def _endpoint_keys(lines: np.ndarray) -> tuple:
+    """Rounded coordinates of the first and last vertex of each line"""
+    starts = geos.get_point(geos.get_geometry(lines, 0), 0)
+    ends = geos.get_point(geos.get_geometry(lines, -1), -1)
+    return tuple(
+        np.round(geos.get_coordinates(points) / NODE_PRECISION).astype(np.int64)
+        for points in (starts, ends)
+    )
+
+
+def find_intersections(
+    roads: gpd.GeoDataFrame, street_column: str = STREET_COLUMN
+) -> gpd.GeoDataFrame:
+    """Derive every intersection node of a road network.
+
+    Candidate pairs of touching segments come from one bulk query of the segments' STR-tree,
+    and the crossing points of all pairs are computed in one vectorized GEOS call.  Junctions
+    are found from the segments' topology, not their names: a node is an intersection where
+    three or more segments meet, or where a segment passes through it, as at a crossing or
+    a T-junction with an unsplit street.  Nodes where exactly two segments meet end to end,
+    such as the joints between consecutive segments of a street, are not intersections.
+
+    Returns:
+        geopandas.GeoDataFrame: one point per node, indexed by INTERSECTION_ID (see
+        ``intersection_ids``) in increasing order, with the names of the streets meeting
+        there (STREETS), the number of segments meeting there (N_SEGMENTS), and the X and Y
+        coordinates.
+    """
+    streets = roads[street_column].fillna("").str.strip().str.upper().values
+    left, right = roads.sindex.query_bulk(roads.geometry, predicate="intersects")
+    is_candidate = left < right
+    left, right = left[is_candidate], right[is_candidate]
+
+    lines = to_geos(roads.geometry)
+    crossings, pair_idx = geos.get_parts(
+        geos.intersection(lines[left], lines[right]), return_index=True
+    )
+    # Overlapping collinear segments intersect in lines rather than points; skip those
+    is_point = geos.get_type_id(crossings) == 0
+    crossings, pair_idx = crossings[is_point], pair_idx[is_point]
+
+    coords = geos.get_coordinates(crossings)
+    nodes, node_idx = np.unique(
+        np.round(coords / NODE_PRECISION).astype(np.int64),
+        axis=0,
+        return_inverse=True,
+    )
+    node_idx = node_idx.ravel()
+
+    node_segments = pd.DataFrame(
+        {
+            "node": np.concatenate([node_idx, node_idx]),
+            "segment": np.concatenate([left[pair_idx], right[pair_idx]]),
+        }
+    ).drop_duplicates()
+    node_keys = nodes[node_segments["node"].values]
+    starts, ends = _endpoint_keys(lines[node_segments["segment"].values])
+    node_segments["passes_through"] = ~(
+        (node_keys == starts).all(axis=1) | (node_keys == ends).all(axis=1)
+    )
+    by_node = node_segments.groupby("node")
+    n_segments = by_node.size()
+    is_junction = (n_segments >= 3) | by_node["passes_through"].any()
+    node_segments["street"] = streets[node_segments["segment"].values]
+    node_segments = node_segments[
+        node_segments["node"].isin(is_junction.index[is_junction])
+    ]
+    # Unnamed segments count towards N_SEGMENTS but are left out of STREETS
+    named = node_segments[node_segments["street"] != ""]
+    junctions = is_junction.index[is_junction].values
+    node_streets = (
+        named[["node", "street"]]
+        .drop_duplicates()
+        .sort_values(["node", "street"])
+        .groupby("node")["street"]
+        .agg(" & ".join)
+        .reindex(junctions, fill_value="")
+    )
+
+    node_xy = nodes[junctions] * NODE_PRECISION
+    intersections = gpd.GeoDataFrame(
+        {
+            "STREETS": node_streets.values,
+            "N_SEGMENTS": n_segments.loc[junctions].values,
+            "X": node_xy[:, 0],
+            "Y": node_xy[:, 1],
+        },
+        geometry=from_geos(geos.points(node_xy)).values,
+        crs=roads.crs,
+        index=pd.Index(intersection_ids(nodes[junctions]), name="INTERSECTION_ID"),
+    )
+    logger.info(f"Found {len(intersections)} intersections among {len(roads)} roads")
+    return intersections.sort_index()
+
+
+def classify_crash_locations(
+    crashes: gpd.GeoDataFrame, intersections: gpd.GeoDataFrame, radius: float = 20
+) -> gpd.GeoDataFrame:
+    """Classify each crash as at an intersection or mid-block.
+
+    Args:
+        crashes (geopandas.GeoDataFrame): crash points, e.g. from ``get_crash_data()``.
+        intersections (geopandas.GeoDataFrame): output of ``find_intersections``.
+        radius (float): crashes within this many meters of an intersection node are
+            intersection crashes.
+
+    Returns:
+        geopandas.GeoDataFrame: ``crashes`` with the columns LOCATION ("intersection" or
+        "mid-block"), INTERSECTION_ID and INTERSECTION_DISTANCE of the nearest node within
+        ``radius``.
+    """
+    if intersections.crs != crashes.crs:
+        intersections = intersections.to_crs(crashes.crs)
+
+    (crash_idx, node_idx), distances = intersections.sindex.nearest(
+        crashes.geometry, return_all=False, max_distance=radius, return_distance=True
+    )
+    intersection_id = pd.Series(pd.NA, index=crashes.index, dtype="Int64")
+    intersection_id.iloc[crash_idx] = intersections.index.values[node_idx]
+    intersection_distance = np.full(len(crashes), np.nan)
+    intersection_distance[crash_idx] = distances
+
+    classified = crashes.copy()
+    classified["LOCATION"] = np.where(
+        intersection_id.notna(), "intersection", "mid-block"
+    )
+    classified["INTERSECTION_ID"] = intersection_id
+    classified["INTERSECTION_DISTANCE"] = intersection_distance
+    return classified
+
+
+@stage_timer("process_road_intersections")
+def process_road_intersections(input_path, output_path):
+    roads = read_roads(input_path)
+    intersections = find_intersections(roads)
+    write_artifact(intersections, output_path)
+
+
+@click.command()
+@click.argument("input_path")
+@click.argument("output_path")
+def main(input_path, output_path):
+    """Console script for deriving road intersections"""
+    process_road_intersections(input_path, output_path)
+
+
+if __name__ == "__main__":
+    argv = sys.argv
+    sys.exit(main(argv))  # pragma: no cover
@@ -1,53 +1,159 @@
-"""Usage: milton_maps process_tax_parcels TAX_PARCELS ASSESSOR_DBS OUTPUT
+"""Usage: milton_maps process_tax_parcels TAX_PARCELS ASSESSOR_DBS OUTPUT [--quantize METERS]
 
 Arguments:
-  TAX_PARCELS      comma separated list of paths to SHP files containing tax parcels for towns
-  ASSESSOR_DBS     comma separated list of paths to pkl files containing cleaned assessor DB dataframes for towns
-  OUTPUT           output path to write processed Assessor DB as a pickled dataframe
+  TAX_PARCELS      comma separated list of paths to SHP or parquet files containing tax parcels for towns
+  ASSESSOR_DBS     comma separated list of paths to pkl or parquet files containing cleaned assessor DB dataframes for towns
+  OUTPUT           output path to write processed Assessor DB as a pickled dataframe, or as GeoParquet
+                   if OUTPUT ends with .parquet.  If OUTPUT has no extension, it is a dedicated directory to which
+                   each town's residential parcels are appended as a separate parquet file, so only one
+                   town is held in memory at a time
+Options:
+  --quantize METERS  round parcel coordinates to a grid of METERS, e.g. 0.01, and store them as
+                     delta-encoded integers.  Only for parquet outputs
 """
+import logging
 import sys
+from pathlib import Path
 
 import click
-import geopandas as gpd
-import joblib
 import pandas as pd
 
+from milton_maps.artifacts import is_parquet, read_artifact, write_artifact
+from milton_maps.logging_config import stage_timer
 
-def process_tax_parcels(tax_parcel_paths, assessor_db_paths, output):
-    tax_parcels = pd.concat([gpd.read_file(t) for t in tax_parcel_paths])
-    assessor_db = pd.concat([joblib.load(a) for a in assessor_db_paths])
-    tax_parcels_extended = tax_parcels.set_index("LOC_ID").join(
-        assessor_db[
+logger = logging.getLogger("process_tax_parcels")
+
+# Columns read from the processed assessor DBs
+ASSESSOR_COLUMNS = [
+    "PROP_ID",
+    "LOC_ID",
+    "TOWN",
+    "YEAR_BUILT",
+    "USE_DESCRIPTION",
+    "RES_AREA",
+    "ZONING",
+    "UNITS",
+    "STYLE",
+    "LOT_SIZE",
+    "TOTAL_VAL",
+    "LAND_VAL",
+    "SITE_ADDR",
+    "IS_RESIDENTIAL",
+]
+
+
+def read_residential_assessor_db(path) -> pd.DataFrame:
+    """Read the ``ASSESSOR_COLUMNS`` of the residential records of a processed assessor DB.
+
+    Parquet assessor DBs skip non-residential rows as they are read.
+    """
+    if is_parquet(path):
+        return read_artifact(
+            path, columns=ASSESSOR_COLUMNS, filters=[("IS_RESIDENTIAL", "==", True)]
+        )
+    assessor_db = read_artifact(path, columns=ASSESSOR_COLUMNS)
+    return assessor_db[assessor_db.IS_RESIDENTIAL]
+
+
+def join_town_tax_parcels(tax_parcels, assessor_db):
+    """Join a town's residential assessor DB records to its tax parcels.
+
+    Non-residential records are dropped first, and only tax parcels with a residential record
+    are joined.  Records without a tax parcel are kept, with missing geometry.
+    """
+    assessor_db = assessor_db.loc[
+        assessor_db.IS_RESIDENTIAL.fillna(False).astype(bool),
+        [c for c in ASSESSOR_COLUMNS if c in assessor_db],
+    ]
+    tax_parcels = tax_parcels[tax_parcels.LOC_ID.isin(assessor_db.index)]
+    return tax_parcels.set_index("LOC_ID").join(assessor_db, how="right")
+
+
+def join_tax_parcels(tax_parcels: list, assessor_dbs: list):
+    """Join the assessor DB records of several towns to their tax parcels, keeping residential
+    parcels.
+
+    ``tax_parcels`` and ``assessor_dbs`` are matched up town by town.
+    """
+    return pd.concat(
+        [
+            join_town_tax_parcels(town_tax_parcels, town_assessor_db)
+            for town_tax_parcels, town_assessor_db in zip(tax_parcels, assessor_dbs)
+        ]
+    ).sort_index()
+
+
+def _read_town_tax_parcels(tax_parcel_path, assessor_db_path):
+    return join_town_tax_parcels(
+        read_artifact(tax_parcel_path),
+        read_residential_assessor_db(assessor_db_path),
+    )
+
+
+def town_output_path(output_dir, tax_parcel_path) -> Path:
+    """Path of the file holding one town's residential parcels in an OUTPUT directory"""
+    return Path(output_dir) / f"{Path(str(tax_parcel_path)).stem}.parquet"
+
+
+@stage_timer("process_tax_parcels")
+def process_tax_parcels(tax_parcel_paths, assessor_db_paths, output, quantize=None):
+    """Join each town's residential assessor DB records to its tax parcels.
+
+    Every tax parcel column is kept, but only the ``ASSESSOR_COLUMNS`` of the assessor DBs
+    are read, and non-residential records are dropped before joining.  If ``output`` has no
+    extension, it is a directory dedicated to this stage, that each town's residential
+    parcels are appended to as soon as they are joined (see ``town_output_path``), and which
+    can be read as one dataset with ``artifacts.read_artifact``.  Otherwise the towns are
+    combined into a single file.  Parquet geometries are quantized to a grid of ``quantize``
+    meters if it is given.
+
+    Raises:
+        ValueError: if the ``output`` directory holds parquet files other than those of the
+            towns being joined, which would be read as part of the dataset.
+    """
+    if Path(output).suffix:
+        residential_tax_parcels = pd.concat(
             [
-                "PROP_ID",
-                "LOC_ID",
-                "TOWN",
-                "YEAR_BUILT",
-                "USE_DESCRIPTION",
-                "RES_AREA",
-                "ZONING",
-                "UNITS",
-                "STYLE",
-                "LOT_SIZE",
-                "TOTAL_VAL",
-                "LAND_VAL",
-                "SITE_ADDR",
-                "IS_RESIDENTIAL",
+                _read_town_tax_parcels(t, a)
+                for t, a in zip(tax_parcel_paths, assessor_db_paths)
             ]
-        ],
-        how="outer",
-    )
-    residential_tax_parcels = tax_parcels_extended[
-        tax_parcels_extended.IS_RESIDENTIAL.fillna(False)
-    ]
-    joblib.dump(residential_tax_parcels, output)
+        ).sort_index()
+        write_artifact(
+            residential_tax_parcels, output, sort_by="TOWN", quantize=quantize
+        )
+        return
+
+    output_dir = Path(output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    town_paths = [town_output_path(output_dir, p) for p in tax_parcel_paths]
+    # Only this stage's files are removed; anything else in the directory is left to the user
+    other_paths = sorted(set(output_dir.glob("*.parquet")) - set(town_paths))
+    if other_paths:
+        raise ValueError(
+            f"{output_dir} holds parquet files that aren't residential parcels of the towns "
+            f"being joined: {', '.join(p.name for p in other_paths)}.  Write to a dedicated "
+            "directory, or remove them"
+        )
+    for town_path in town_paths:
+        town_path.unlink(missing_ok=True)
+    for tax_parcel_path, assessor_db_path, town_path in zip(
+        tax_parcel_paths, assessor_db_paths, town_paths
+    ):
+        town_tax_parcels = _read_town_tax_parcels(tax_parcel_path, assessor_db_path)
+        write_artifact(town_tax_parcels, town_path, sort_by="TOWN", quantize=quantize)
+        logger.info(
+            f"Appended {len(town_tax_parcels)} residential parcels of {tax_parcel_path}"
+        )
 
 
 @click.command()
 @click.argument("tax_parcel_paths")
 @click.argument("assessor_db_paths")
 @click.argument("output")
-def main(tax_parcel_paths, assessor_db_paths, output):
+@click.option(
+    "--quantize", type=float, default=None, help="Grid size of parquet coordinates"
+)
+def main(tax_parcel_paths, assessor_db_paths, output, quantize):
     """Console script for processing assessor DB"""
     tax_parcel_paths = tax_parcel_paths.split(",")
     assessor_db_paths = assessor_db_paths.split(",")
@@ -56,7 +162,7 @@ def main(tax_parcel_paths, assessor_db_paths, output):
             "Must provide an equal number of tax parcel and assessor db files"
         )
 
-    process_tax_parcels(tax_parcel_paths, assessor_db_paths, output)
+    process_tax_parcels(tax_parcel_paths, assessor_db_paths, output, quantize)
 
 
 if __name__ == "__main__":
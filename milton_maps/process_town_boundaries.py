@@ -1,44 +1,154 @@
-"""Usage: milton_maps process_town_boundaries INPUT OUTPUT
+"""Usage: milton_maps process_town_boundaries INPUT OUTPUT [--quantize METERS] [--validation MODE]
 
 Arguments:
   INPUT       path to GDB file containing assessor DB
-  OUTPUT      output path to write processed Assessor DB as a pickled dataframe
+  OUTPUT      output path to write processed Assessor DB as a zipped shapefile, or as
+              GeoParquet if OUTPUT ends with .parquet
+Options:
+  --quantize METERS  round boundary coordinates to a grid of METERS, e.g. 0.01, and store them
+                     as delta-encoded integers.  Only for parquet outputs
+  --validation MODE  "full" to check every town, or "sampled" to check a sample of the towns in
+                     development runs [default: $MILTON_MAPS_VALIDATION, or full]
 """
 import json
 import logging
 import sys
+from pathlib import Path
 
 import click
 import geopandas as gpd
-from shapely.geometry import MultiPolygon
+import numpy as np
+import pandas as pd
 
+from milton_maps.artifacts import is_parquet, read_artifact, write_artifact
+from milton_maps.logging_config import stage_timer
+from milton_maps.spatial import assign_towns, from_geos, geos, to_geos
+from milton_maps.validation import MODES, Check, ValidationSuite
 
-def process_town_boundaries(input_path, output_path):
-    """"""
+# Tolerances, in meters, of the simplified boundaries written alongside the full-resolution
+# output. 5 m is indistinguishable from full resolution on a single-town map; 100 m is plenty
+# for a statewide map.
+SIMPLIFY_TOLERANCES = [5, 25, 100]
+
+# TOWN_ID => TOWN name mapping written for downstream stages
+TOWN_IDS_PATH = "data/processed/town_ids.json"
+
+# There are 351 towns in Massachusetts
+MA_TOWN_COUNT = 351
+
+
+def _areas_reconcile(town_boundaries, towns):
+    """Each town's multipolygon area closely matches the summed areas of its raw polygons"""
+    raw = towns[towns["TOWN_ID"].isin(town_boundaries.index)]
+    raw_areas = raw.groupby("TOWN_ID")["SHAPE_AREA"].sum()
+    areas = town_boundaries["SHAPE_AREA"]
+    return (areas - raw_areas.reindex(areas.index)).divide(raw_areas) < 1e-9
+
+
+def _town_is_constant(town_boundaries, towns):
+    """All of each town's raw polygons share one TOWN name, which the merged town kept"""
+    # constant_attributes drops TOWN if it varies within any town
+    if "TOWN" not in town_boundaries.columns:
+        return np.zeros(len(town_boundaries), dtype=bool)
+    raw = towns[towns["TOWN_ID"].isin(town_boundaries.index)]
+    names = raw.groupby("TOWN_ID")["TOWN"].agg(["nunique", "first"])
+    names = names.reindex(town_boundaries.index)
+    return (names["nunique"] == 1) & (names["first"] == town_boundaries["TOWN"])
+
+
+TOWN_BOUNDARIES_VALIDATION = ValidationSuite(
+    "town_boundaries",
+    [
+        Check(
+            f"one row per town, for the {MA_TOWN_COUNT} towns of Massachusetts",
+            lambda town_boundaries, towns: len(town_boundaries) == MA_TOWN_COUNT
+            and town_boundaries.index.is_unique,
+        ),
+        Check(
+            "TOWN is constant within each town",
+            _town_is_constant,
+            rows=True,
+        ),
+        Check(
+            "19 columns",
+            lambda town_boundaries, towns: town_boundaries.shape[1] == 19,
+        ),
+        Check(
+            "areas match the summed areas of the raw polygons",
+            _areas_reconcile,
+            rows=True,
+        ),
+    ],
+    # Group-bys of 351 towns are much cheaper than hashing every raw coordinate
+    cache=False,
+)
+
+
+def simplified_path(output_path, tolerance) -> str:
+    """Path of the boundaries simplified to ``tolerance`` meters, e.g.
+    town_boundaries.shp.zip => town_boundaries_25m.shp.zip"""
+    output_path = Path(output_path)
+    stem, *suffixes = output_path.name.split(".")
+    return str(output_path.with_name(".".join([f"{stem}_{tolerance}m", *suffixes])))
+
+
+def tolerance_for_scale(meters_per_pixel: float):
+    """Coarsest simplification tolerance that is still finer than one pixel at a map scale.
+
+    Returns ``None`` (full resolution) when even the finest tolerance would be visible.
+    """
+    tolerances = [t for t in SIMPLIFY_TOLERANCES if t <= meters_per_pixel]
+    return max(tolerances) if tolerances else None
+
+
+def dissolve_towns(towns: gpd.GeoDataFrame) -> gpd.GeoSeries:
+    """Collect each town's polygons into a single multipolygon, indexed by TOWN_ID.
+
+    Polygons are gathered with one vectorized GEOS call rather than a Python aggregation
+    per town.  Parts are collected, not unioned, so the area of each multipolygon is exactly
+    the sum of the areas of its parts.
+    """
+    parts = towns[["TOWN_ID", "geometry"]].explode(index_parts=False)
+    parts = parts.sort_values("TOWN_ID", kind="stable")
+    town_ids, town_index = np.unique(parts["TOWN_ID"].values, return_inverse=True)
+    multipolygons = geos.multipolygons(to_geos(parts.geometry), indices=town_index)
+    return from_geos(
+        multipolygons, index=pd.Index(town_ids, name="TOWN_ID"), crs=towns.crs
+    )
 
-    towns = gpd.read_file(input_path)
+
+def constant_attributes(towns: gpd.GeoDataFrame) -> pd.DataFrame:
+    """One row per TOWN_ID holding the columns that never vary within a town"""
+    attributes = towns.drop(columns=["TOWN_ID", towns.geometry.name])
+    first = attributes.groupby(towns["TOWN_ID"]).transform("first")
+    is_constant = (attributes.eq(first) | attributes.isna()).all(axis=0)
+    return attributes.loc[:, is_constant].groupby(towns["TOWN_ID"]).first()
+
+
+def build_town_boundaries(
+    towns: gpd.GeoDataFrame, validation: str = None
+) -> gpd.GeoDataFrame:
+    """Merge the raw town survey polygons into one validated row per town.
+
+    Args:
+        towns (geopandas.GeoDataFrame): raw town survey polygons.
+        validation (str): ``full`` or ``sampled`` validation of the result, see
+            ``validation.ValidationSuite.validate``.
+
+    Raises:
+        validation.ValidationError: if the result fails ``TOWN_BOUNDARIES_VALIDATION``.
+    """
     logging.info(
         f"There are {towns.TOWN_ID.nunique()} unique towns in the dataset, but the dataframe has shape {towns.shape}, so there are multiple rows per town"
     )
 
     # The raw dataset contains one row for each disconnected region of a town. For our purposes, we want to merge these into a single multipolygon per town
-    town_boundaries_series = towns.groupby("TOWN_ID")["geometry"].agg(
-        lambda x: MultiPolygon(list(x))
-    )
-    town_attributes = (
-        towns.set_index("TOWN_ID")
-        .loc[:, towns.groupby("TOWN_ID").nunique().max() == 1]
-        .drop_duplicates()
-    )
-
-    # There are 351 towns in Massachusetts.  Validate the data against this fact.
-    assert town_attributes.shape[0] == 351
+    town_boundaries_series = dissolve_towns(towns)
+    town_attributes = constant_attributes(towns)
 
     # Join multipolygon boundaries to attribute dataframe
-    town_boundaries = (
-        gpd.GeoDataFrame(town_boundaries_series)
-        .merge(town_attributes, left_index=True, right_index=True)
-        .set_crs(towns.crs)
+    town_boundaries = gpd.GeoDataFrame(
+        town_attributes, geometry=town_boundaries_series, crs=towns.crs
     )
     town_boundaries["SHAPE_AREA"] = town_boundaries["geometry"].area  # Square Meters
     town_boundaries["ACRES"] = (
@@ -48,39 +158,103 @@ def process_town_boundaries(input_path, output_path):
         town_boundaries["SHAPE_AREA"] / 2.59e6
     )  # Square meters per square mile
 
-    # Sanity checks
-    # 1. Check that "TOWN" has not been dropped
-    #   (it should be a uniquely associated with TOWN_ID) and save the
-    #   TOWN_ID=>TOWN mapping
-    assert "TOWN" in town_boundaries.columns
+    TOWN_BOUNDARIES_VALIDATION.validate(town_boundaries, mode=validation, towns=towns)
+    return town_boundaries
+
 
-    # 2. The Multipolygon's areas should very closely match the sum of shapefile areas over each TOWN_ID
-    direct_sum_old_areas = towns.groupby("TOWN_ID")["SHAPE_AREA"].sum()
-    assert (town_boundaries["SHAPE_AREA"] - direct_sum_old_areas).divide(
-        direct_sum_old_areas
-    ).max() < 1e-9
+def simplify_town_boundaries(
+    town_boundaries: gpd.GeoDataFrame, tolerance
+) -> gpd.GeoDataFrame:
+    """Boundaries for maps that don't need survey-grade boundaries, simplified to
+    ``tolerance`` meters without opening gaps or overlaps between neighboring towns.
+
+    As in TopoJSON, each border is simplified once rather than once per town: the town
+    boundaries are noded into arcs running between the points where three or more towns meet,
+    each arc is simplified with its end points fixed, and the faces enclosed by the simplified
+    arcs are given back to the towns containing them.  A town left without any face, e.g.
+    one narrower than ``tolerance``, is simplified on its own instead.
+    """
+    geometries = to_geos(town_boundaries.geometry)
+    arcs = geos.line_merge(geos.union_all(geos.boundary(geometries)))
+    arcs = geos.simplify(geos.get_parts(arcs), tolerance, preserve_topology=True)
+    # Simplified arcs may cross where the originals ran closer than ``tolerance``; noding
+    # them again leaves slivers there, which go to whichever town contains them
+    faces = geos.get_parts(geos.polygonize(geos.get_parts(geos.union_all(arcs))))
+    face_towns = assign_towns(
+        gpd.GeoDataFrame(
+            geometry=from_geos(geos.point_on_surface(faces), crs=town_boundaries.crs)
+        ),
+        town_boundaries,
+    )
+    # Faces in no town are holes, or gaps between towns
+    in_town = face_towns.notna().values
+    faces, face_towns = faces[in_town], face_towns.values[in_town].astype(int)
+    order = np.argsort(face_towns, kind="stable")
+    town_ids, town_index = np.unique(face_towns[order], return_inverse=True)
+    multipolygons = geos.multipolygons(faces[order], indices=town_index)
+    # Faces of a town split by a sliver share an edge, which makes their collection invalid
+    invalid = ~geos.is_valid(multipolygons)
+    multipolygons[invalid] = geos.buffer(multipolygons[invalid], 0)
+    multipolygons = pd.Series(list(multipolygons), index=town_ids)
+
+    simplified = town_boundaries.copy()
+    independently = town_boundaries.simplify(tolerance, preserve_topology=True)
+    has_faces = simplified.index.isin(town_ids)
+    simplified["geometry"] = independently
+    simplified.loc[has_faces, "geometry"] = from_geos(
+        multipolygons.loc[simplified.index[has_faces]].values,
+        index=simplified.index[has_faces],
+        crs=town_boundaries.crs,
+    )
+    return simplified
+
+
+def town_ids(town_boundaries: gpd.GeoDataFrame) -> dict:
+    """TOWN_ID => TOWN name mapping, keyed by strings as it is when read back from json"""
+    return {str(k): v for k, v in town_boundaries["TOWN"].items()}
+
+
+@stage_timer("process_town_boundaries")
+def process_town_boundaries(input_path, output_path, quantize=None, validation=None):
+    """"""
 
-    # 3. We should have one row per town and 19 columns
-    assert town_boundaries.shape == (351, 19)
+    towns = read_artifact(input_path)
+    town_boundaries = build_town_boundaries(towns, validation)
 
     # Save consolidated shapefile
-    town_boundaries.to_file(output_path, driver="ESRI Shapefile")
-    # Save town_id => town name mapping for downstream use.  Note json format converts integer keys to strings.
-    with open("data/processed/town_ids.json", "w") as f:
-        json.dump(town_boundaries["TOWN"].to_dict(), f)
+    write_artifact(town_boundaries, output_path, quantize=quantize)
+    # Save simplified versions
+    for tolerance in SIMPLIFY_TOLERANCES:
+        write_artifact(
+            simplify_town_boundaries(town_boundaries, tolerance),
+            simplified_path(output_path, tolerance),
+            quantize=quantize,
+        )
+    # Save town_id => town name mapping for downstream use.
+    with open(TOWN_IDS_PATH, "w") as f:
+        json.dump(town_ids(town_boundaries), f)
 
 
 @click.command()
 @click.argument("input_path")
 @click.argument("output_path")
-def main(input_path, output_path):
+@click.option(
+    "--quantize", type=float, default=None, help="Grid size of parquet coordinates"
+)
+@click.option(
+    "--validation",
+    type=click.Choice(MODES),
+    default=None,
+    help="Validate every town or a sample",
+)
+def main(input_path, output_path, quantize, validation):
     """Console script for processing assessor DB"""
-    if input_path[-3:].lower() != "shp":
-        raise ValueError(f"Input file must be a SHP file, got {input_path}")
+    if input_path[-3:].lower() != "shp" and not is_parquet(input_path):
+        raise ValueError(f"Input file must be a SHP or parquet file, got {input_path}")
     output_file = output_path
-    if output_path[-3:].lower() != "zip":
+    if output_path[-3:].lower() != "zip" and not is_parquet(output_path):
         output_file += "zip"
-    process_town_boundaries(input_path, output_file)
+    process_town_boundaries(input_path, output_file, quantize, validation)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,398 @@
+"""Compact storage of geometries as quantized, delta-encoded integer coordinates.
+
+Processed geometries are in EPSG:26986 meters, at double precision, which resolves far finer
+than anything mapped or measured here.  ``QuantizedGeometries`` rounds every coordinate to a
+grid of ``precision`` CRS units (e.g. 0.01 for centimeters) and stores each ring, or each
+line or point, as the integer offset of its first vertex from the origin followed by the
+integer steps to its other vertices.  Steps between neighboring vertices are small, so they
+fit in 32 bit integers and compress well.
+
+In parquet artifacts (see ``artifacts.write_artifact(..., quantize=...)``), the geometry
+column is stored as a struct of the geometry type and nested lists of parts, rings and
+interleaved x, y steps, row aligned with the attributes so column projection and row filters
+work as usual.  ``read_quantized`` loads the integer arrays without building any geometry;
+geometries are decoded on access, for all rows at once or only for the rows selected.
+"""
+import json
+from dataclasses import dataclass
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from milton_maps.spatial import from_geos, geos, to_geos
+
+# Key of the parquet schema metadata describing the quantized geometry column
+METADATA_KEY = b"milton_maps:quantized"
+
+# geos geometry type ids, by the kind of their parts
+POINT_TYPES = [0, 4]
+LINE_TYPES = [1, 2, 5]
+POLYGON_TYPES = [3, 6]
+MULTI_TYPES = {4: "multipoints", 5: "multilinestrings", 6: "multipolygons"}
+
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def _lengths_to_offsets(lengths: np.ndarray) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+
+
+def _runs(offsets: np.ndarray, positions: np.ndarray) -> tuple:
+    """Children of ``positions`` given the ``offsets`` of each parent's children, and the
+    position in ``positions`` of the parent of each child"""
+    if (
+        len(positions) == len(offsets) - 1
+        and (positions == np.arange(len(positions))).all()
+    ):
+        # Every parent, in order
+        lengths = np.diff(offsets)
+        return np.arange(offsets[-1]), np.repeat(np.arange(len(lengths)), lengths)
+    starts, stops = offsets[positions], offsets[positions + 1]
+    lengths = stops - starts
+    parent = np.repeat(np.arange(len(positions)), lengths)
+    offset = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return starts[parent] + offset, parent
+
+
+def _renumber(selected: np.ndarray, n: int) -> np.ndarray:
+    """Array mapping each of ``range(n)`` to its position in the sorted positions
+    ``selected``, or to -1 if it isn't selected"""
+    numbers = np.full(n, -1)
+    numbers[selected] = np.arange(len(selected))
+    return numbers
+
+
+@dataclass
+class QuantizedGeometries:
+    """Geometries as quantized, delta-encoded coordinates.
+
+    Attributes:
+        types (numpy.ndarray): geos type id of each geometry, -1 for missing geometries.
+        part_offsets (numpy.ndarray): parts of geometry ``i`` are
+            ``part_offsets[i]:part_offsets[i + 1]``.  Single geometries have one part.
+        ring_offsets (numpy.ndarray): rings of each part.  Points and lines have one ring.
+        vertex_offsets (numpy.ndarray): vertices of each ring.
+        steps (numpy.ndarray): ``(vertices, 2)`` int32 array of the x, y offset of each
+            vertex from the previous vertex of its ring, in units of ``precision``.  The
+            first vertex of a ring is offset from the origin.
+        precision (float): grid size of the coordinates, in CRS units.
+        crs: coordinate reference system of the geometries.
+    """
+
+    types: np.ndarray
+    part_offsets: np.ndarray
+    ring_offsets: np.ndarray
+    vertex_offsets: np.ndarray
+    steps: np.ndarray
+    precision: float
+    crs: object = None
+
+    @classmethod
+    def from_geoseries(
+        cls, geometries: gpd.GeoSeries, precision: float
+    ) -> "QuantizedGeometries":
+        """Quantize ``geometries`` to a grid of ``precision`` CRS units.
+
+        Raises:
+            ValueError: for geometry collections, or coordinates too large for 32 bit
+                integers at this precision.
+        """
+        geometries_ = to_geos(geometries)
+        types = geos.get_type_id(geometries_)
+        if (types == 7).any():
+            raise ValueError("Geometry collections can't be quantized")
+
+        parts, part_geometry = geos.get_parts(geometries_, return_index=True)
+        is_polygon = np.isin(types[part_geometry], POLYGON_TYPES)
+        polygon_rings, ring_polygon = geos.get_rings(
+            parts[is_polygon], return_index=True
+        )
+        # Points and lines are their own single ring
+        ring_part = np.concatenate(
+            [np.flatnonzero(is_polygon)[ring_polygon], np.flatnonzero(~is_polygon)]
+        )
+        order = np.argsort(ring_part, kind="stable")
+        rings = np.concatenate([polygon_rings, parts[~is_polygon]])[order]
+        ring_part = ring_part[order]
+        coords, vertex_ring = geos.get_coordinates(rings, return_index=True)
+
+        vertex_offsets = _lengths_to_offsets(
+            np.bincount(vertex_ring, minlength=len(rings))
+        )
+        grid = np.rint(coords / precision).astype(np.int64)
+        steps = grid.copy()
+        steps[1:] -= grid[:-1]
+        # The first vertex of each ring is offset from the origin, not the previous ring
+        starts = vertex_offsets[:-1][np.diff(vertex_offsets) > 0]
+        steps[starts] = grid[starts]
+        if len(steps) and np.abs(steps).max() > INT32_MAX:
+            raise ValueError(
+                f"Coordinates are too large to quantize to a grid of {precision}"
+            )
+        return cls(
+            types=types.astype(np.int8),
+            part_offsets=_lengths_to_offsets(
+                np.bincount(part_geometry, minlength=len(geometries_))
+            ),
+            ring_offsets=_lengths_to_offsets(
+                np.bincount(ring_part, minlength=len(parts))
+            ),
+            vertex_offsets=vertex_offsets,
+            steps=steps.astype(np.int32),
+            precision=precision,
+            crs=geometries.crs,
+        )
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, i: int):
+        """Decode geometry ``i`` to a shapely geometry"""
+        return self.decode([i]).iloc[0]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            a.nbytes
+            for a in (
+                self.types,
+                self.part_offsets,
+                self.ring_offsets,
+                self.vertex_offsets,
+                self.steps,
+            )
+        )
+
+    def decode(self, positions=None, index=None) -> gpd.GeoSeries:
+        """Decode geometries to a GeoSeries.
+
+        Args:
+            positions: positions, or boolean mask, of the geometries to decode.  Defaults to
+                all of them.
+            index: index of the returned GeoSeries.
+
+        Returns:
+            geopandas.GeoSeries: with missing and empty geometries as ``None``.
+        """
+        if positions is None:
+            positions = np.arange(len(self))
+        positions = np.asarray(positions)
+        if positions.dtype == bool:
+            positions = np.flatnonzero(positions)
+        types = self.types[positions].astype(int)
+
+        parts, part_geometry = _runs(self.part_offsets, positions)
+        rings, ring_part = _runs(self.ring_offsets, parts)
+        vertices, vertex_ring = _runs(self.vertex_offsets, rings)
+
+        # Undo the delta encoding by one running sum over every ring.  The sum of the steps
+        # of a ring is its last vertex, so each ring restarts from the origin once that is
+        # taken off its first step.
+        steps = self.steps[vertices].astype(np.int64)
+        lengths = np.bincount(vertex_ring, minlength=len(rings))
+        starts = _lengths_to_offsets(lengths)[:-1][lengths > 0]
+        if len(starts):
+            steps[starts[1:]] -= np.add.reduceat(steps, starts)[:-1]
+        coords = np.cumsum(steps, axis=0) * self.precision
+
+        part_types = types[part_geometry]
+        decoded_parts = np.full(len(parts), None, dtype=object)
+        for kinds, build in [
+            (POINT_TYPES, self._points),
+            (LINE_TYPES, self._lines),
+            (POLYGON_TYPES, self._polygons),
+        ]:
+            selected = np.isin(part_types, kinds)
+            if selected.any():
+                decoded_parts[selected] = build(
+                    coords, vertex_ring, ring_part, np.flatnonzero(selected), len(parts)
+                )
+
+        decoded = np.full(len(positions), None, dtype=object)
+        single = ~np.isin(part_types, list(MULTI_TYPES))
+        decoded[part_geometry[single]] = decoded_parts[single]
+        for type_id, constructor in MULTI_TYPES.items():
+            selected = part_types == type_id
+            if selected.any():
+                geometry, inverse = np.unique(
+                    part_geometry[selected], return_inverse=True
+                )
+                decoded[geometry] = getattr(geos, constructor)(
+                    decoded_parts[selected], indices=inverse
+                )
+        return from_geos(decoded, index=index, crs=self.crs)
+
+    @staticmethod
+    def _points(coords, vertex_ring, ring_part, parts, n_parts):
+        vertex_part = _renumber(parts, n_parts)[ring_part[vertex_ring]]
+        vertices = np.flatnonzero(vertex_part >= 0)
+        return geos.points(
+            coords[vertices],
+            indices=vertex_part[vertices],
+            out=np.full(len(parts), None, dtype=object),
+        )
+
+    @staticmethod
+    def _lines(coords, vertex_ring, ring_part, parts, n_parts):
+        vertex_part = _renumber(parts, n_parts)[ring_part[vertex_ring]]
+        vertices = np.flatnonzero(vertex_part >= 0)
+        return geos.linestrings(
+            coords[vertices],
+            indices=vertex_part[vertices],
+            out=np.full(len(parts), None, dtype=object),
+        )
+
+    @staticmethod
+    def _polygons(coords, vertex_ring, ring_part, parts, n_parts):
+        if len(parts) == n_parts:
+            # Every part is a polygon
+            linearrings = geos.linearrings(
+                coords,
+                indices=vertex_ring,
+                out=np.full(len(ring_part), None, dtype=object),
+            )
+            return geos.polygons(
+                linearrings,
+                indices=ring_part,
+                out=np.full(n_parts, None, dtype=object),
+            )
+        ring_polygon = _renumber(parts, n_parts)[ring_part]
+        rings = np.flatnonzero(ring_polygon >= 0)
+        vertex_linearring = _renumber(rings, len(ring_part))[vertex_ring]
+        vertices = np.flatnonzero(vertex_linearring >= 0)
+        linearrings = geos.linearrings(
+            coords[vertices],
+            indices=vertex_linearring[vertices],
+            out=np.full(len(rings), None, dtype=object),
+        )
+        return geos.polygons(
+            linearrings,
+            indices=ring_polygon[rings],
+            out=np.full(len(parts), None, dtype=object),
+        )
+
+    def to_arrow(self) -> pa.StructArray:
+        """Row per geometry: ``{type, parts: [[[x0, y0, dx1, dy1, ...], ...], ...]}``"""
+        steps = pa.array(self.steps.ravel())
+        rings = pa.ListArray.from_arrays(pa.array(self.vertex_offsets * 2), steps)
+        parts = pa.ListArray.from_arrays(pa.array(self.ring_offsets), rings)
+        geometries = pa.ListArray.from_arrays(pa.array(self.part_offsets), parts)
+        return pa.StructArray.from_arrays(
+            [pa.array(self.types), geometries], names=["type", "parts"]
+        )
+
+    @classmethod
+    def from_arrow(cls, array, precision: float, crs=None) -> "QuantizedGeometries":
+        """Inverse of ``to_arrow``, without copying the coordinates of a single chunk"""
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks() if array.num_chunks != 1 else array.chunk(0)
+        types, geometries = array.flatten()
+
+        def flatten(lists):
+            offsets = lists.offsets.to_numpy()
+            return offsets - offsets[0], lists.flatten()
+
+        part_offsets, parts = flatten(geometries)
+        ring_offsets, rings = flatten(parts)
+        vertex_offsets, steps = flatten(rings)
+        return cls(
+            types=types.to_numpy(zero_copy_only=False),
+            part_offsets=part_offsets,
+            ring_offsets=ring_offsets,
+            vertex_offsets=vertex_offsets // 2,
+            steps=steps.to_numpy().reshape(-1, 2),
+            precision=precision,
+            crs=crs,
+        )
+
+
+def quantized_table(gdf: gpd.GeoDataFrame, precision: float) -> pa.Table:
+    """Arrow table of ``gdf`` with its geometry column quantized to ``precision`` CRS units"""
+    name = gdf.geometry.name
+    geometries = QuantizedGeometries.from_geoseries(gdf.geometry, precision)
+    table = pa.Table.from_pandas(pd.DataFrame(gdf.drop(columns=name)))
+    table = table.append_column(name, geometries.to_arrow())
+    encoding = {
+        "column": name,
+        "columns": list(gdf.columns),
+        "precision": precision,
+        "crs": gdf.crs.to_json() if gdf.crs is not None else None,
+    }
+    return table.replace_schema_metadata(
+        {**table.schema.metadata, METADATA_KEY: json.dumps(encoding)}
+    )
+
+
+def quantized_encoding(schema: pa.Schema) -> dict:
+    """Description of the quantized geometry column of a parquet schema, ``None`` if it
+    has none"""
+    metadata = schema.metadata or {}
+    if METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[METADATA_KEY])
+
+
+@dataclass
+class QuantizedFrame:
+    """Attributes of a quantized artifact, with its geometries decoded on access.
+
+    Attributes:
+        attributes (pandas.DataFrame): every column but the geometry column.
+        geometries (QuantizedGeometries): geometry of each row of ``attributes``.
+        geometry_name (str): name of the geometry column.
+        columns (list): column order of the decoded GeoDataFrame.
+    """
+
+    attributes: pd.DataFrame
+    geometries: QuantizedGeometries
+    geometry_name: str = "geometry"
+    columns: list = None
+
+    def __len__(self) -> int:
+        return len(self.attributes)
+
+    def to_geodataframe(self, rows=None) -> gpd.GeoDataFrame:
+        """Decode the geometries of ``rows``, a boolean mask or positions, or of every row"""
+        positions = np.arange(len(self)) if rows is None else np.asarray(rows)
+        if positions.dtype == bool:
+            positions = np.flatnonzero(positions)
+        attributes = self.attributes.iloc[positions]
+        geometry = self.geometries.decode(positions, index=attributes.index)
+        gdf = gpd.GeoDataFrame(
+            attributes.assign(**{self.geometry_name: geometry}),
+            geometry=self.geometry_name,
+        )
+        columns = [c for c in self.columns or gdf.columns if c in gdf.columns]
+        return gdf[columns]
+
+
+def read_quantized(path, columns: list = None, filters: list = None) -> QuantizedFrame:
+    """Read a parquet artifact written with ``quantize``, without decoding its geometries.
+
+    Args:
+        path: parquet file, or directory of parquet files.
+        columns (list): optional attribute columns to read.  The geometry column is always
+            read.
+        filters (list): optional pyarrow row filters.
+    """
+    dataset = pq.ParquetDataset(path)
+    encoding = quantized_encoding(dataset.schema)
+    if encoding is None:
+        raise ValueError(f"{path} has no quantized geometry column")
+    name = encoding["column"]
+    if columns is not None:
+        columns = [c for c in columns if c != name] + [name]
+    table = pq.read_table(
+        path, columns=columns, filters=filters, use_pandas_metadata=True
+    )
+    return QuantizedFrame(
+        attributes=table.drop([name]).to_pandas(),
+        geometries=QuantizedGeometries.from_arrow(
+            table[name], encoding["precision"], encoding["crs"]
+        ),
+        geometry_name=name,
+        columns=encoding["columns"],
+    )
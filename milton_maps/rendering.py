@@ -0,0 +1,321 @@
+"""Raster rendering of large layers, and batch rendering of many maps.
+
+``plot_map`` draws every geometry as a matplotlib artist, which is slow for layers of hundreds
+of thousands of parcels or crashes.  ``rasterize`` instead aggregates the layer onto a grid of
+pixels with numpy: points are binned into the pixel containing them, lines contribute their
+vertices densified to half a pixel, and polygons the pixels whose centers they contain, found
+by a scanline fill.  Polygons too small to contain a pixel center contribute a point on their
+surface, so they still show.
+``plot_map(..., raster=True)`` draws the grid with a single ``imshow``.
+
+``render_maps`` renders one map per group of a layer, e.g. per TOWN_ID, across a process pool.
+Categories and color limits are fixed once for the whole layer, so a value has the same color
+on every map.
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from milton_maps.milton_maps import categorical_colormap, plot_map
+from milton_maps.spatial import geos, to_geos
+
+logger = logging.getLogger("rendering")
+
+# Pixels along the longer side of the raster when no resolution is given
+DEFAULT_RASTER_SIZE = 2000
+
+# geos geometry type ids
+POINT_TYPES = [0, 4]
+LINE_TYPES = [1, 2, 5]
+POLYGON_TYPES = [3, 6]
+
+
+@dataclass
+class Raster:
+    """A layer aggregated onto a grid of pixels.
+
+    Attributes:
+        values (numpy.ndarray): ``(rows, columns)`` array of pixel values, from south to
+            north, ``NaN`` where no geometry was drawn.  For categorical layers, the position
+            of the pixel's category in ``categories``.
+        extent (tuple): ``(xmin, xmax, ymin, ymax)`` of the grid, as expected by ``imshow``.
+        categories (list): categories of a categorical layer, ``None`` otherwise.
+    """
+
+    values: np.ndarray
+    extent: tuple
+    categories: list = None
+
+
+def _runs(starts: np.ndarray, stops: np.ndarray):
+    """Positions of the runs and the integers in ``range(start, stop)`` of each run"""
+    lengths = np.maximum(stops - starts, 0)
+    run = np.repeat(np.arange(len(lengths)), lengths)
+    offset = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return run, starts[run] + offset
+
+
+def _polygon_samples(polygons, xmin, ymin, resolution, shape):
+    """Positions in ``polygons`` and flat pixel indexes of the pixel centers they contain.
+
+    Scanline fill: every ring edge is intersected with the center lines of the pixel rows it
+    spans, and the pixels between successive crossings of a polygon along a row are inside it,
+    by the even-odd rule.
+    """
+    rows, cols = shape
+    parts, part_polygon = geos.get_parts(polygons, return_index=True)
+    rings, ring_part = geos.get_rings(parts, return_index=True)
+    coords, vertex_ring = geos.get_coordinates(rings, return_index=True)
+    # Vertices in pixel units, with the center of pixel (i, j) at (j, i)
+    coords = (coords - (xmin, ymin)) / resolution - 0.5
+    is_edge = vertex_ring[:-1] == vertex_ring[1:]
+    start, end = coords[:-1][is_edge], coords[1:][is_edge]
+    edge_polygon = part_polygon[ring_part[vertex_ring[:-1][is_edge]]]
+
+    # Rows whose center line an edge crosses, half-open so a vertex is crossed once
+    low = np.minimum(start[:, 1], end[:, 1])
+    high = np.maximum(start[:, 1], end[:, 1])
+    edge, row = _runs(
+        np.ceil(low).astype(int).clip(0, rows), np.ceil(high).astype(int).clip(0, rows)
+    )
+    (x0, y0), (x1, y1) = start[edge].T, end[edge].T
+    x = x0 + (row - y0) * (x1 - x0) / (y1 - y0)
+    polygon = edge_polygon[edge]
+
+    # Pair successive crossings of each polygon along each row
+    order = np.lexsort((x, row, polygon))
+    enter, leave = order[0::2], order[1::2]
+    run, col = _runs(
+        np.ceil(x[enter]).astype(int).clip(0, cols),
+        np.ceil(x[leave]).astype(int).clip(0, cols),
+    )
+    return polygon[enter][run], row[enter][run] * cols + col
+
+
+def rasterize(
+    gdf: gpd.GeoDataFrame,
+    column: str,
+    categorical: bool = True,
+    resolution: float = None,
+    size: int = DEFAULT_RASTER_SIZE,
+) -> Raster:
+    """Aggregate the values of ``column`` onto a grid of pixels covering ``gdf``.
+
+    A categorical pixel takes the category of the last geometry drawn on it, as when the
+    geometries are plotted in order.  A numeric pixel takes the mean value of the geometries
+    drawn on it, e.g. the mean of the crashes it contains.  Missing values aren't drawn.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): layer to rasterize.
+        column (str): column whose values are drawn.
+        categorical (bool): ``True`` if ``column`` is categorical.  The categories of a
+            ``pandas.Categorical`` column are kept, unused ones included; otherwise they are
+            the sorted unique values.
+        resolution (float): pixel size in CRS units.  Defaults to the size giving ``size``
+            pixels along the longer side of the layer's bounds.
+        size (int): see ``resolution``.
+
+    Returns:
+        Raster
+    """
+    xmin, ymin, xmax, ymax = gdf.total_bounds
+    if resolution is None:
+        resolution = max(xmax - xmin, ymax - ymin) / size or 1.0
+    shape = (
+        max(int(np.ceil((ymax - ymin) / resolution)), 1),
+        max(int(np.ceil((xmax - xmin) / resolution)), 1),
+    )
+
+    geometries = to_geos(gdf.geometry)
+    types = geos.get_type_id(geometries)
+    positions, pixels = [], []
+
+    def pixel_index(x, y):
+        col = np.floor((x - xmin) / resolution).astype(int).clip(0, shape[1] - 1)
+        row = np.floor((y - ymin) / resolution).astype(int).clip(0, shape[0] - 1)
+        return row * shape[1] + col
+
+    def add_vertices(idx, densify=None):
+        parts = geometries[idx]
+        if densify:
+            parts = geos.segmentize(parts, densify)
+        coords, part = geos.get_coordinates(parts, return_index=True)
+        positions.append(idx[part])
+        pixels.append(pixel_index(coords[:, 0], coords[:, 1]))
+
+    add_vertices(np.flatnonzero(np.isin(types, POINT_TYPES)))
+    add_vertices(np.flatnonzero(np.isin(types, LINE_TYPES)), densify=resolution / 2)
+
+    polygons = np.flatnonzero(np.isin(types, POLYGON_TYPES))
+    covered, covered_pixels = _polygon_samples(
+        geometries[polygons], xmin, ymin, resolution, shape
+    )
+    positions.append(polygons[covered])
+    pixels.append(covered_pixels)
+
+    # A point on the surface of polygons too small to cover a pixel center, and of anything
+    # else, e.g. geometry collections
+    other = np.setdiff1d(
+        np.flatnonzero(~np.isin(types, POINT_TYPES + LINE_TYPES) & (types >= 0)),
+        polygons[covered],
+    )
+    surface = geos.point_on_surface(geometries[other])
+    positions.append(other)
+    pixels.append(pixel_index(geos.get_x(surface), geos.get_y(surface)))
+
+    positions = np.concatenate(positions)
+    pixels = np.concatenate(pixels)
+    # Draw in the order of the layer, so that later geometries cover earlier ones
+    order = np.argsort(positions, kind="stable")
+    positions, pixels = positions[order], pixels[order]
+
+    values = np.full(shape[0] * shape[1], np.nan)
+    categories = None
+    if categorical:
+        codes = pd.Categorical(gdf[column])
+        categories = list(codes.categories)
+        codes = codes.codes[positions]
+        drawn = codes >= 0
+        # Fancy assignment keeps the last of repeated indexes
+        values[pixels[drawn]] = codes[drawn]
+    else:
+        numbers = gdf[column].to_numpy(dtype=float, na_value=np.nan)[positions]
+        drawn = ~np.isnan(numbers)
+        sums = np.bincount(pixels[drawn], weights=numbers[drawn], minlength=values.size)
+        counts = np.bincount(pixels[drawn], minlength=values.size)
+        np.divide(sums, counts, out=values, where=counts > 0)
+
+    extent = (xmin, xmin + shape[1] * resolution, ymin, ymin + shape[0] * resolution)
+    return Raster(values.reshape(shape), extent, categories)
+
+
+def draw_raster(
+    ax,
+    gdf: gpd.GeoDataFrame,
+    column: str,
+    categorical: bool = True,
+    legend: bool = True,
+    cmap: str = "gist_earth",
+    resolution: float = None,
+    vmin: float = None,
+    vmax: float = None,
+    **imshow_kwds,
+):
+    """Draw ``rasterize(gdf, column, ...)`` on ``ax``, with a legend of the categories of a
+    categorical column or a colorbar of a numeric one.  See ``plot_map``."""
+    import matplotlib
+
+    raster = rasterize(gdf, column, categorical=categorical, resolution=resolution)
+    image_kwds = dict(
+        extent=raster.extent, origin="lower", interpolation="nearest", **imshow_kwds
+    )
+    values = np.ma.masked_invalid(raster.values)
+    if categorical:
+        colors = categorical_colormap(raster.categories, cmap)
+        n = max(len(colors), 1)
+        image = ax.imshow(
+            values,
+            cmap=matplotlib.colors.ListedColormap(list(colors.values()) or ["none"]),
+            vmin=-0.5,
+            vmax=n - 0.5,
+            **image_kwds,
+        )
+        if legend and colors:
+            handles = [
+                matplotlib.patches.Patch(facecolor=color, label=str(category))
+                for category, color in colors.items()
+            ]
+            ax.legend(handles=handles, loc="upper left")
+    else:
+        image = ax.imshow(values, cmap=cmap, vmin=vmin, vmax=vmax, **image_kwds)
+        if legend:
+            ax.figure.colorbar(image, ax=ax)
+    return image
+
+
+# Styling shared by the maps rendered in a worker process, set by _init_worker
+_style = {}
+
+
+def _init_worker(style: dict):
+    import matplotlib
+
+    # Render to files without a display
+    matplotlib.use("Agg")
+    _style.update(style)
+
+
+def _render_map(gdf: gpd.GeoDataFrame, path: Path, title: str, dpi: int) -> Path:
+    import matplotlib.pyplot as plt
+
+    ax = plot_map(gdf, title=title, **_style)
+    ax.figure.savefig(path, dpi=dpi, bbox_inches="tight")
+    plt.close(ax.figure)
+    return path
+
+
+def render_maps(
+    gdf: gpd.GeoDataFrame,
+    column: str,
+    output_dir,
+    by: str = "TOWN_ID",
+    categorical: bool = True,
+    title: str = "{by} {key}",
+    dpi: int = 100,
+    max_workers: int = None,
+    **plot_kwargs,
+) -> dict:
+    """Render one map of ``column`` per group of ``gdf`` to PNG files, in a process pool.
+
+    Categorical columns are converted to ``pandas.Categorical`` once, so every map colors and
+    lists the same categories the same way.  Numeric columns share the color limits of the
+    whole layer unless ``vmin`` or ``vmax`` are given.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): layer to map.
+        column (str): column whose values are mapped.
+        output_dir (str or Path): directory the maps are written to, as
+            ``{column}_{key}.png``.
+        by (str): column grouping the geometries of each map.  Defaults to ``TOWN_ID``.
+        categorical (bool): see ``plot_map``.
+        title (str): title of each map, formatted with ``by`` and the group ``key``.
+        dpi (int): resolution of the PNG files.
+        max_workers (int): number of worker processes.  Defaults to the number of CPUs.
+        **plot_kwargs: passed to ``plot_map``, e.g. ``raster=True`` or ``cmap``.
+
+    Returns:
+        dict: group key => path of its map.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Only ship what the maps need to the workers
+    gdf = gdf[[by, column, gdf.geometry.name]]
+    if categorical:
+        gdf = gdf.assign(**{column: gdf[column].astype("category")})
+    else:
+        plot_kwargs.setdefault("vmin", gdf[column].min())
+        plot_kwargs.setdefault("vmax", gdf[column].max())
+    style = dict(column=column, categorical=categorical, **plot_kwargs)
+
+    with ProcessPoolExecutor(
+        max_workers, initializer=_init_worker, initargs=(style,)
+    ) as pool:
+        futures = {
+            key: pool.submit(
+                _render_map,
+                group.drop(columns=by),
+                output_dir / f"{column}_{key}.png",
+                title.format(by=by, key=key),
+                dpi,
+            )
+            for key, group in gdf.groupby(by)
+        }
+        paths = {key: future.result() for key, future in futures.items()}
+    logger.info(f"Rendered {len(paths)} maps of {column} to {output_dir}")
+    return paths
@@ -0,0 +1,247 @@
+"""Assign crashes to MassDOT road segments and locate them along their routes.
+
+``assign_crashes_to_segments`` matches every crash to its nearest road segment within a
+tolerance using the segments' spatial index, so all the corridors of a town are analyzed in
+one pass instead of one buffer-and-clip per road.  Each matched crash is also given a linear
+reference: its distance in meters along the segment and along the route the segment
+belongs to.
+"""
+import logging
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from milton_maps.process_road_intersections import STREET_COLUMN
+from milton_maps.spatial import geos, to_geos
+
+logger = logging.getLogger("road_corridors")
+
+# Column of the MassDOT roads layer holding the city/town code of a segment
+TOWN_COLUMN = "CITY"
+
+# Columns of the MassDOT roads layer that identify a route.  Routes are split by town, and
+# numbered routes by street name, e.g. Route 28 is "Randolph Avenue" in Milton.
+ROUTE_COLUMNS = [TOWN_COLUMN, "RT_NUMBER", STREET_COLUMN]
+
+# Segment geometries are rounded to this many meters before they are hashed into SEGMENT_IDs
+SEGMENT_ID_PRECISION = 0.01
+
+
+def _geometry_hashes(road_segments: gpd.GeoDataFrame) -> pd.Series:
+    """64-bit hash of each segment's geometry, rounded to ``SEGMENT_ID_PRECISION``"""
+    wkb = geos.to_wkb(
+        geos.set_precision(to_geos(road_segments.geometry), SEGMENT_ID_PRECISION)
+    )
+    return pd.util.hash_pandas_object(
+        pd.Series(wkb, index=road_segments.index), index=False
+    )
+
+
+def route_keys(
+    road_segments: gpd.GeoDataFrame, route_columns=ROUTE_COLUMNS
+) -> pd.Series:
+    """Label each segment with a normalized route name, e.g. "189 / 28 / randolph avenue".
+
+    Segments with no route number or street name don't belong to any longer route, and are
+    each labeled as a route of their own, e.g. "189 / unnamed 5f0c9a3e2b7d1c4a".
+    """
+    parts = pd.DataFrame(
+        {
+            column: road_segments[column].fillna("").astype(str).str.strip().str.lower()
+            for column in route_columns
+        },
+        index=road_segments.index,
+    )
+    keys = (
+        parts[route_columns[0]]
+        .str.cat([parts[column] for column in route_columns[1:]], sep=" / ")
+        .str.replace(r"( / )+", " / ", regex=True)
+        .str.strip(" /")
+    )
+    unnamed = (parts[[c for c in route_columns if c != TOWN_COLUMN]] == "").all(axis=1)
+    if unnamed.any():
+        geometry_hashes = _geometry_hashes(road_segments[unnamed])
+        keys[unnamed] = (
+            keys[unnamed].where(keys[unnamed] == "", keys[unnamed] + " / ")
+            + "unnamed "
+            + geometry_hashes.map("{:016x}".format)
+        )
+    return keys.rename("ROUTE")
+
+
+def segment_ids(
+    road_segments: gpd.GeoDataFrame, route_columns=ROUTE_COLUMNS
+) -> np.ndarray:
+    """Stable ID of each road segment: a 64-bit hash of its geometry, rounded to
+    ``SEGMENT_ID_PRECISION``, and of its route.
+
+    Segments read with a mask, as by ``process_crash_data.get_town_roads``, are indexed by
+    their position among the segments read, which changes with the mask, the towns and the
+    rows of the source.  A segment keeps its hash for as long as its geometry and route are
+    unchanged, so crash counts by segment can be compared between runs.
+    """
+    hashes = pd.util.hash_pandas_object(
+        pd.DataFrame(
+            {
+                "geometry": _geometry_hashes(road_segments).values,
+                "route": route_keys(road_segments, route_columns).values,
+            }
+        ),
+        index=False,
+    )
+    return hashes.values.view(np.int64)
+
+
+def segment_route_measures(
+    road_segments: gpd.GeoDataFrame, route_columns=ROUTE_COLUMNS, routes: list = None
+) -> pd.DataFrame:
+    """Position of each segment's endpoints along its route.
+
+    The segments of a route are merged into a single line, and each segment's first and last
+    vertices are projected onto it.  Where a route is not a single connected line, its pieces
+    are measured consecutively in the order ``linemerge`` returns them.
+
+    Args:
+        road_segments (geopandas.GeoDataFrame): MassDOT road segments.
+        route_columns (list): columns identifying the route of a segment.
+        routes (list): optional ``route_keys`` of the routes to measure.  The segments of other
+            routes are left unmeasured.
+
+    Returns:
+        pandas.DataFrame: ROUTE, ROUTE_START and ROUTE_END (meters), indexed like
+        ``road_segments``.
+    """
+    keys = route_keys(road_segments, route_columns)
+    lines = to_geos(road_segments.geometry)
+    # First vertex of the first part and last vertex of the last part of each segment
+    starts = geos.get_point(geos.get_geometry(lines, 0), 0)
+    ends = geos.get_point(geos.get_geometry(lines, -1), -1)
+
+    route_start = np.full(len(lines), np.nan)
+    route_end = np.full(len(lines), np.nan)
+    route_positions = keys.groupby(keys).indices
+    if routes is not None:
+        route_positions = {
+            route: route_positions[route]
+            for route in set(routes)
+            if route in route_positions
+        }
+    # Most routes of a statewide layer are single unnamed segments: measure those together
+    single = np.array(
+        [p[0] for p in route_positions.values() if len(p) == 1], dtype=np.intp
+    )
+    single_lines = geos.line_merge(lines[single])
+    route_start[single] = geos.line_locate_point(single_lines, starts[single])
+    route_end[single] = geos.line_locate_point(single_lines, ends[single])
+    for positions in route_positions.values():
+        if len(positions) == 1:
+            continue
+        route_line = geos.line_merge(geos.union_all(lines[positions]))
+        route_start[positions] = geos.line_locate_point(route_line, starts[positions])
+        route_end[positions] = geos.line_locate_point(route_line, ends[positions])
+
+    return pd.DataFrame(
+        {"ROUTE": keys, "ROUTE_START": route_start, "ROUTE_END": route_end},
+        index=road_segments.index,
+    )
+
+
+def assign_crashes_to_segments(
+    crashes: gpd.GeoDataFrame,
+    road_segments: gpd.GeoDataFrame,
+    tolerance: float = 20,
+    route_columns=ROUTE_COLUMNS,
+) -> gpd.GeoDataFrame:
+    """Match each crash to its nearest road segment within ``tolerance`` meters.
+
+    Args:
+        crashes (geopandas.GeoDataFrame): crash points, e.g. from ``get_crash_data()``.
+        road_segments (geopandas.GeoDataFrame): MassDOT road segments, any subset of the
+            statewide layer.
+        tolerance (float): maximum distance, in meters, between a crash and its segment.
+        route_columns (list): columns identifying the route of a segment.
+
+    Returns:
+        geopandas.GeoDataFrame: ``crashes`` with the columns SEGMENT_ID (see
+        ``segment_ids``), SEGMENT_DISTANCE,
+        SEGMENT_POSITION (meters along the segment), ROUTE and ROUTE_POSITION (meters along
+        the route).  These are missing for crashes with no segment within ``tolerance``.
+    """
+    if road_segments.crs != crashes.crs:
+        road_segments = road_segments.to_crs(crashes.crs)
+
+    (crash_idx, segment_idx), distances = road_segments.sindex.nearest(
+        crashes.geometry,
+        return_all=False,
+        max_distance=tolerance,
+        return_distance=True,
+    )
+    logger.info(
+        f"Matched {len(crash_idx)} of {len(crashes)} crashes to a road segment within {tolerance} m"
+    )
+
+    matched_segments = road_segments.geometry.iloc[segment_idx]
+    segment_position = matched_segments.project(
+        crashes.geometry.iloc[crash_idx], align=False
+    ).values
+    segment_length = matched_segments.length.values
+
+    # Only the routes of matched segments need measuring
+    matched_routes = route_keys(
+        road_segments.iloc[np.unique(segment_idx)], route_columns
+    ).unique()
+    measures = segment_route_measures(
+        road_segments, route_columns, routes=matched_routes
+    ).iloc[segment_idx]
+    # Segments may be digitized against the direction of their route, so interpolate
+    # between the route measures of the segment's endpoints.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(segment_length > 0, segment_position / segment_length, 0)
+    route_position = measures["ROUTE_START"].values + fraction * (
+        measures["ROUTE_END"].values - measures["ROUTE_START"].values
+    )
+
+    # Filled by position: reindexing would pass the 64-bit SEGMENT_IDs through float64
+    segment_id = np.zeros(len(crashes), dtype=np.int64)
+    segment_id[crash_idx] = segment_ids(road_segments, route_columns)[segment_idx]
+    unmatched = np.ones(len(crashes), dtype=bool)
+    unmatched[crash_idx] = False
+    matches = pd.DataFrame(
+        {
+            "SEGMENT_DISTANCE": distances,
+            "SEGMENT_POSITION": segment_position,
+            "ROUTE": measures["ROUTE"].values,
+            "ROUTE_POSITION": route_position,
+        },
+        index=crash_idx,
+    ).reindex(np.arange(len(crashes)))
+
+    assigned = crashes.copy()
+    assigned["SEGMENT_ID"] = pd.arrays.IntegerArray(segment_id, unmatched)
+    for column in matches.columns:
+        assigned[column] = matches[column].values
+    return assigned
+
+
+def summarize_corridors(
+    assigned_crashes: pd.DataFrame, bin_length: float = None
+) -> pd.DataFrame:
+    """Count crashes by severity for every route, optionally in bins along the route.
+
+    Args:
+        assigned_crashes (pandas.DataFrame): output of ``assign_crashes_to_segments``.
+        bin_length (float): length in meters of the route bins.  Defaults to ``None``, one
+            row per route.
+
+    Returns:
+        pandas.DataFrame: crash counts with one column per severity.
+    """
+    matched = assigned_crashes[assigned_crashes["ROUTE"].notna()]
+    keys = [matched["ROUTE"]]
+    if bin_length is not None:
+        route_bin = (matched["ROUTE_POSITION"] // bin_length * bin_length).rename(
+            "ROUTE_BIN_START"
+        )
+        keys.append(route_bin)
+    return matched.groupby(keys + [matched["severity"]]).size().unstack(fill_value=0)
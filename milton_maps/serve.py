@@ -0,0 +1,315 @@
+"""Usage: milton_maps serve [--host HOST] [--port PORT] [--cache-size N]
+
+Options:
+  --host HOST       interface to listen on [default: 127.0.0.1]
+  --port PORT       port to listen on [default: 8000]
+  --cache-size N    number of responses kept in the LRU response cache [default: 256]
+
+Serves the processed layers over HTTP from a single local process.  Residential parcels, open
+space, town boundaries and Milton crashes are loaded once, reprojected to WGS84 and indexed.
+Queries are answered as GeoJSON:
+
+  GET /layers                 name, feature count, fields and bounds of each layer
+  GET /layers/NAME?QUERY      features of layer NAME matching QUERY
+
+QUERY parameters:
+  bbox=W,S,E,N        features intersecting a bounding box in longitude and latitude
+  fields=A,B          properties to include [default: all]
+  limit=N             maximum number of features returned [default: 5000]
+  precision=D         decimal places of coordinates [default: 6, about 10 cm]
+  FIELD=VALUE         features whose FIELD equals VALUE.  Repeat to match any of several
+                      values, e.g. severity=Fatal%20Injury&severity=Major%20Injury
+"""
+import contextlib
+import json
+import logging
+import sys
+import threading
+import urllib.parse
+import urllib.request
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import click
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+
+from milton_maps import pipeline
+from milton_maps.artifacts import read_artifact
+from milton_maps.process_crash_data import get_crash_data
+from milton_maps.spatial import from_geos, round_coordinates, to_geos
+
+logger = logging.getLogger("serve")
+
+# Layers are read relative to the project root, wherever the service is started from
+ROOT_DIR = Path(__file__).parent.parent
+
+SERVICE_CRS = "EPSG:4326"
+
+DEFAULT_LIMIT = 5000
+DEFAULT_PRECISION = 6
+DEFAULT_CACHE_SIZE = 256
+
+# Query parameters that aren't attribute filters
+RESERVED_PARAMETERS = {"bbox", "fields", "limit", "precision"}
+
+# Layer name => loader of the layer served under that name
+DEFAULT_LAYERS = {
+    "parcels": lambda: read_artifact(ROOT_DIR / pipeline.RESIDENTIAL_TAX_PARCELS_PATH),
+    "openspace": lambda: read_artifact(ROOT_DIR / pipeline.OPENSPACE_PATH),
+    "towns": lambda: read_artifact(ROOT_DIR / pipeline.TOWN_BOUNDARIES_PATH),
+    "crashes": get_crash_data,
+}
+
+
+class QueryError(ValueError):
+    """A query the service can't answer, reported to the client as a 400 response"""
+
+
+def _servable(layer: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """``layer`` in the service CRS, with values that serialize to JSON"""
+    if layer.crs is not None and layer.crs != SERVICE_CRS:
+        layer = layer.to_crs(SERVICE_CRS)
+    converted = {}
+    for column in layer.columns.drop(layer.geometry.name):
+        values = layer[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.map(lambda t: None if pd.isna(t) else t.isoformat())
+        converted[column] = values.astype(object).where(values.notna(), None)
+    return layer.assign(**converted)
+
+
+class LayerService:
+    """Bounding-box and attribute queries over layers held in memory.
+
+    Args:
+        layers (dict): layer name => GeoDataFrame.  Layers are reprojected to WGS84 and
+            spatially indexed once.
+        cache_size (int): number of query responses kept in an LRU cache.
+    """
+
+    def __init__(self, layers: dict, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.layers = {name: _servable(layer) for name, layer in layers.items()}
+        for name, layer in self.layers.items():
+            # Build the index now rather than on the first query
+            layer.sindex
+            logger.info(f"Serving {len(layer)} features of {name}")
+        self._query = lru_cache(maxsize=cache_size)(self._uncached_query)
+
+    @classmethod
+    def from_loaders(cls, loaders: dict = None, **kwargs) -> "LayerService":
+        """Service of the layers returned by ``loaders``, layer name => function of no
+        arguments.  Layers that fail to load are left out."""
+        layers = {}
+        for name, loader in (loaders or DEFAULT_LAYERS).items():
+            try:
+                layers[name] = loader()
+            except Exception as e:
+                logger.warning(f"Not serving {name}, which failed to load: {e}")
+        return cls(layers, **kwargs)
+
+    def catalog(self) -> bytes:
+        """JSON description of the layers"""
+        return _dumps(
+            {
+                name: {
+                    "features": len(layer),
+                    "fields": list(layer.columns.drop(layer.geometry.name)),
+                    "bounds": list(layer.total_bounds)
+                    if layer.geometry.notna().any()
+                    else None,
+                }
+                for name, layer in self.layers.items()
+            }
+        )
+
+    def query(self, name: str, parameters: dict) -> bytes:
+        """GeoJSON of the features of layer ``name`` matching ``parameters``.
+
+        Args:
+            name (str): layer name.
+            parameters (dict): query parameter => list of values, as parsed by
+                ``urllib.parse.parse_qs``.  See the module documentation.
+
+        Raises:
+            KeyError: if there's no layer ``name``.
+            QueryError: if the parameters are invalid.
+        """
+        if name not in self.layers:
+            raise KeyError(name)
+        # Normalize the parameters so that equivalent queries share a cache entry
+        key = tuple(
+            sorted(
+                (field, tuple(sorted(values))) for field, values in parameters.items()
+            )
+        )
+        return self._query(name, key)
+
+    def cache_info(self):
+        return self._query.cache_info()
+
+    def _uncached_query(self, name: str, key: tuple) -> bytes:
+        layer = self.layers[name]
+        parameters = dict(key)
+        limit = _int_parameter(parameters, "limit", DEFAULT_LIMIT)
+        precision = _int_parameter(parameters, "precision", DEFAULT_PRECISION)
+
+        if "bbox" in parameters:
+            try:
+                west, south, east, north = map(float, parameters["bbox"][0].split(","))
+            except ValueError:
+                raise QueryError("bbox must be four numbers: west,south,east,north")
+            positions = np.sort(
+                layer.sindex.query(
+                    box(west, south, east, north), predicate="intersects"
+                )
+            )
+        else:
+            positions = np.arange(len(layer))
+
+        for field, values in parameters.items():
+            if field in RESERVED_PARAMETERS:
+                continue
+            if field not in layer:
+                raise QueryError(f"Unknown field {field} of layer {name}")
+            column = layer[field].values[positions]
+            matches = pd.Series(column).astype(str).isin(values).values
+            positions = positions[matches]
+
+        fields = list(layer.columns.drop(layer.geometry.name))
+        if "fields" in parameters:
+            fields = parameters["fields"][0].split(",")
+            unknown = set(fields) - set(layer.columns)
+            if unknown:
+                raise QueryError(f"Unknown fields {sorted(unknown)} of layer {name}")
+
+        matched = len(positions)
+        features = layer.iloc[positions[:limit]]
+        rounded = round_coordinates(to_geos(features.geometry), precision)
+        features = gpd.GeoDataFrame(
+            features[[f for f in fields if f != layer.geometry.name]],
+            geometry=from_geos(rounded, index=features.index, crs=SERVICE_CRS),
+        )
+        collection = features.__geo_interface__
+        collection["numberMatched"] = matched
+        collection["numberReturned"] = len(features)
+        return _dumps(collection)
+
+
+def _int_parameter(parameters: dict, name: str, default: int) -> int:
+    if name not in parameters:
+        return default
+    try:
+        return int(parameters[name][0])
+    except ValueError:
+        raise QueryError(f"{name} must be an integer")
+
+
+def _dumps(data) -> bytes:
+    return json.dumps(data, separators=(",", ":"), default=str).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service: LayerService = None
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            if parts == ["layers"]:
+                body = self.service.catalog()
+            elif len(parts) == 2 and parts[0] == "layers":
+                body = self.service.query(parts[1], urllib.parse.parse_qs(url.query))
+            else:
+                return self._send_error(HTTPStatus.NOT_FOUND, f"No route {url.path}")
+        except KeyError as e:
+            return self._send_error(HTTPStatus.NOT_FOUND, f"No layer {e}")
+        except QueryError as e:
+            return self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception:
+            logger.exception(f"Failed to answer GET {self.path}")
+            return self._send_error(
+                HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error"
+            )
+        self._send(HTTPStatus.OK, body, "application/geo+json")
+
+    def _send_error(self, status, message):
+        self._send(status, _dumps({"error": message}), "application/json")
+
+    def _send(self, status, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def make_server(service: LayerService, host="127.0.0.1", port=8000):
+    """HTTP server answering queries with ``service``.  Port 0 picks a free port."""
+    handler = type("Handler", (_Handler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class ServiceClient:
+    """Minimal client of a running service, e.g. for tests"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+    def get(self, path: str, **parameters):
+        """Decoded JSON response to ``GET path?parameters``.  List values are sent as
+        repeated parameters.
+
+        Raises:
+            urllib.error.HTTPError: for error responses.
+        """
+        query = urllib.parse.urlencode(parameters, doseq=True)
+        url = f"{self.base_url}{path}" + (f"?{query}" if query else "")
+        with urllib.request.urlopen(url) as response:
+            return json.load(response)
+
+
+@contextlib.contextmanager
+def running_service(service: LayerService, host="127.0.0.1"):
+    """Run ``service`` on a free port in a background thread, yielding a ``ServiceClient``"""
+    server = make_server(service, host, 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield ServiceClient(f"http://{host}:{server.server_address[1]}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Interface to listen on")
+@click.option("--port", type=int, default=8000, help="Port to listen on")
+@click.option(
+    "--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="Cached responses"
+)
+def main(host, port, cache_size):
+    """Console script for serving the processed layers"""
+    service = LayerService.from_loaders(cache_size=cache_size)
+    server = make_server(service, host, port)
+    logger.info(f"Serving {', '.join(service.layers)} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    argv = sys.argv
+    sys.exit(main(argv))  # pragma: no cover
@@ -0,0 +1,90 @@
+"""Spatial-index helpers shared by the processing and analysis modules."""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from geopandas import _compat
+
+# Vectorized GEOS functions live in shapely from 2.0, and in pygeos alongside shapely 1.8.
+if shapely.__version__ >= "2":
+    geos = shapely
+else:
+    import pygeos as geos
+
+# Whether geopandas stores its geometries as ``geos`` objects, so they can be shared without a
+# round trip through WKB
+NATIVE_GEOS = getattr(_compat, "USE_PYGEOS", False) == (geos is not shapely)
+
+
+def to_geos(geometries: gpd.GeoSeries) -> np.ndarray:
+    """Convert a GeoSeries to an array of ``geos`` geometries for vectorized operations"""
+    if NATIVE_GEOS:
+        return geometries.values.data.copy()
+    return geos.from_wkb(geometries.to_wkb().values)
+
+
+def from_geos(geometries: np.ndarray, index=None, crs=None) -> gpd.GeoSeries:
+    """Inverse of ``to_geos``"""
+    if NATIVE_GEOS:
+        return gpd.GeoSeries(
+            gpd.array.GeometryArray(np.asarray(geometries, dtype=object), crs=crs),
+            index=index,
+        )
+    return gpd.GeoSeries.from_wkb(geos.to_wkb(geometries), index=index, crs=crs)
+
+
+def assign_towns(
+    points: gpd.GeoDataFrame, town_boundaries: gpd.GeoDataFrame
+) -> pd.Series:
+    """Tag each point with the TOWN_ID of the town polygon that contains it.
+
+    An STR-tree is built over the points and queried once with every town polygon.  The
+    query geometries are prepared by the index before the predicate is evaluated, so a
+    single pass assigns statewide points to all 351 towns without one clip per town.
+
+    Args:
+        points (geopandas.GeoDataFrame): point geometries to assign.
+        town_boundaries (geopandas.GeoDataFrame): town polygons indexed by TOWN_ID, as
+            returned by ``process_crash_data.get_town_boundaries()``.
+
+    Returns:
+        pandas.Series: nullable integer TOWN_ID aligned with ``points``.  Points outside of
+        every town are ``<NA>``.  Points on a boundary shared by two towns are assigned to
+        the town listed first in ``town_boundaries``.
+    """
+    if town_boundaries.crs != points.crs:
+        town_boundaries = town_boundaries.to_crs(points.crs)
+
+    town_idx, point_idx = points.sindex.query_bulk(
+        town_boundaries.geometry, predicate="intersects"
+    )
+    # query_bulk results are ordered by town, so the first hit for a point is its first town
+    point_idx, first_hit = np.unique(point_idx, return_index=True)
+
+    town_ids = pd.Series(pd.NA, index=points.index, dtype="Int64", name="TOWN_ID")
+    town_ids.iloc[point_idx] = town_boundaries.index.values[town_idx[first_hit]]
+    return town_ids
+
+
+def query_within_distance(
+    tree_geometries: np.ndarray, geometries: np.ndarray, distance: float
+) -> tuple:
+    """Pairs of ``geometries`` and ``tree_geometries`` no further than ``distance`` apart.
+
+    Both arguments are arrays of ``geos`` geometries (see ``to_geos``).  An STR-tree is built
+    over ``tree_geometries`` and queried with every geometry at once.
+
+    Returns:
+        tuple: ``(geometry_idx, tree_idx)`` arrays of positions of each pair.
+    """
+    tree = geos.STRtree(tree_geometries)
+    if shapely.__version__ >= "2":
+        return tree.query(geometries, predicate="dwithin", distance=distance)
+    return tree.query_bulk(geometries, predicate="dwithin", distance=distance)
+
+
+def round_coordinates(geometries: np.ndarray, decimals: int) -> np.ndarray:
+    """Copy of an array of ``geos`` geometries with coordinates rounded to ``decimals``"""
+    if shapely.__version__ >= "2":
+        return geos.transform(geometries, lambda coords: np.round(coords, decimals))
+    return geos.apply(geometries, lambda coords: np.round(coords, decimals))
@@ -0,0 +1,218 @@
+"""Declarative validation of processed frames, cached by the content hash of what was checked.
+
+A stage declares its expectations as a ``ValidationSuite`` of ``Check``s, vectorized tests of
+a frame and of the inputs it was built from, and calls ``suite.validate`` on its result instead
+of asserting inline.  For example, ``process_town_boundaries`` checks that the statewide
+boundaries have one row for each of the 351 towns, and that each town's area reconciles with
+the areas of its raw survey polygons.
+
+Validation runs in one of two modes:
+
+* ``full`` evaluates every check on every row.  Use it for releases.
+* ``sampled`` evaluates row-wise checks on a fixed random sample of at most ``SAMPLE_ROWS``
+  rows, and the remaining, frame-wide checks in full.  It catches schema and join mistakes
+  at a fraction of the cost, for development runs.
+
+The mode defaults to ``full``, or to the ``MILTON_MAPS_VALIDATION`` environment variable.
+Every passing validation is recorded under ``cache.CACHE_DIR``, keyed by the suite's checks,
+the mode and the content hash of the frame and inputs, so re-running a stage on unchanged data
+doesn't repeat its checks.  A passing full validation also satisfies later sampled ones.
+Failures aren't recorded: they raise ``ValidationError`` every time.  Suites whose checks cost
+less than hashing the frame are built with ``cache=False`` and always run their checks.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from milton_maps import cache
+from milton_maps.spatial import geos, to_geos
+
+logger = logging.getLogger("validation")
+
+MODES = ("full", "sampled")
+
+# Number of rows tested by row-wise checks in sampled mode
+SAMPLE_ROWS = 1000
+
+# Failing index values quoted in a ValidationError, per check
+MAX_REPORTED_ROWS = 5
+
+
+class ValidationError(AssertionError):
+    """A frame failed one or more of the checks of a ``ValidationSuite``"""
+
+
+@dataclass(frozen=True)
+class Check:
+    """One expectation of a ``ValidationSuite``.
+
+    Args:
+        name (str): description of the expectation, quoted when it fails.
+        test (callable): ``test(frame, **inputs)`` returning a bool, or for a row-wise check a
+            boolean array with one value per row of ``frame``.
+        rows (bool): whether ``test`` is row-wise.  Row-wise checks are evaluated on a sample
+            of the rows in sampled mode, and their failures report the failing rows.
+    """
+
+    name: str
+    test: Callable
+    rows: bool = False
+
+
+def default_mode() -> str:
+    return os.environ.get("MILTON_MAPS_VALIDATION", "full")
+
+
+def _update_digest(digest, value):
+    if isinstance(value, gpd.GeoDataFrame):
+        _update_digest(digest, pd.DataFrame(value.drop(columns=value.geometry.name)))
+        _update_digest(digest, value.geometry)
+    elif isinstance(value, gpd.GeoSeries):
+        geometries = to_geos(value)
+        # Coordinates and their count per geometry; hashing WKB would be several times slower
+        digest.update(geos.get_coordinates(geometries).tobytes())
+        digest.update(geos.get_num_coordinates(geometries).tobytes())
+        digest.update(geos.get_type_id(geometries).tobytes())
+        digest.update(pd.util.hash_pandas_object(value.index).values.tobytes())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        names = value.columns if isinstance(value, pd.DataFrame) else [value.name]
+        digest.update(repr(list(names)).encode())
+        digest.update(pd.util.hash_pandas_object(value).values.tobytes())
+    else:
+        digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+
+
+def content_digest(frame, **inputs) -> str:
+    """Content hash of a frame and of the inputs it is validated against"""
+    digest = hashlib.blake2b(digest_size=16)
+    _update_digest(digest, frame)
+    for name in sorted(inputs):
+        digest.update(name.encode())
+        _update_digest(digest, inputs[name])
+    return digest.hexdigest()
+
+
+class ValidationSuite:
+    """The checks a stage's output must pass.
+
+    Args:
+        name (str): name of the suite, used in logs and errors.
+        checks (list): ``Check``s of the suite.
+        sample_rows (int): number of rows tested by row-wise checks in sampled mode.
+        cache_dir: where passing validations are recorded [default: ``CACHE_DIR/validation``].
+        cache (bool): whether to record passing validations and reuse them.  Turn it off when
+            the checks are cheaper than the ``content_digest`` of the frame and inputs.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        checks: list,
+        sample_rows: int = SAMPLE_ROWS,
+        cache_dir=None,
+        cache: bool = True,
+    ):
+        self.name = name
+        self.checks = list(checks)
+        self.sample_rows = sample_rows
+        self.cache_dir = cache_dir
+        self.cache = cache
+
+    def fingerprint(self) -> str:
+        """Hash of the suite's checks, including the code of their tests and the values they
+        read, so that editing a check or a constant it uses invalidates the validations it
+        recorded"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{cache.CACHE_VERSION}:{self.name}:{self.sample_rows}".encode())
+        for check in self.checks:
+            digest.update(f"{check.name}:{check.rows}".encode())
+            digest.update(cache.code_digest(check.test).encode())
+        return digest.hexdigest()
+
+    def _record_path(self, digest: str, mode: str):
+        cache_dir = self.cache_dir or cache.CACHE_DIR / "validation"
+        return cache_dir / f"{self.name}-{self.fingerprint()}-{mode}-{digest}.json"
+
+    def validate(self, frame: pd.DataFrame, mode: str = None, digest=None, **inputs):
+        """Check ``frame``, built from ``inputs``, unless it already passed.
+
+        Args:
+            frame (pandas.DataFrame): the frame to check.
+            mode (str): ``full`` or ``sampled`` [default: ``default_mode()``].
+            digest (str): content hash identifying ``frame`` and ``inputs``, e.g. the
+                ``cache.file_digest`` of the file they were built from.  Defaults to
+                ``content_digest(frame, **inputs)``.  Unused if the suite doesn't cache.
+            **inputs: passed to the tests of the checks.
+
+        Returns:
+            dict: how the validation went: ``mode``, ``rows`` checked by row-wise checks and
+                ``cached``, whether a recorded validation was reused.
+
+        Raises:
+            ValidationError: if any check fails, listing every failed check.
+        """
+        mode = mode or default_mode()
+        if mode not in MODES:
+            raise ValueError(f"Validation mode must be one of {MODES}, got {mode}")
+        if self.cache and digest is None:
+            digest = content_digest(frame, **inputs)
+
+        # A full validation also vouches for a sampled one
+        recorded_modes = ("full",) if mode == "full" else ("full", "sampled")
+        for recorded_mode in recorded_modes if self.cache else ():
+            path = self._record_path(digest, recorded_mode)
+            if path.exists():
+                logger.debug(f"{self.name} already passed {recorded_mode} validation")
+                return {**json.loads(path.read_text()), "cached": True}
+
+        started = time.perf_counter()
+        sample = frame
+        if mode == "sampled" and len(frame) > self.sample_rows:
+            sample = frame.sample(self.sample_rows, random_state=0)
+        failures = [
+            self._evaluate(check, sample if check.rows else frame, inputs)
+            for check in self.checks
+        ]
+        failures = [failure for failure in failures if failure is not None]
+        if failures:
+            raise ValidationError(
+                f"{self.name} failed {len(failures)} of {len(self.checks)} checks "
+                f"({mode} validation):\n" + "\n".join(f"  {f}" for f in failures)
+            )
+
+        result = {"mode": mode, "rows": len(sample), "cached": False}
+        logger.info(
+            f"{self.name} passed {mode} validation of {len(sample)} rows "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        if self.cache:
+            path = self._record_path(digest, mode)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(result))
+        return result
+
+    @staticmethod
+    def _evaluate(check: Check, frame: pd.DataFrame, inputs: dict):
+        """Description of how ``check`` fails on ``frame``, or ``None`` if it passes"""
+        try:
+            passed = check.test(frame, **inputs)
+        except Exception as e:
+            return f"{check.name}: raised {type(e).__name__}: {e}"
+        if not check.rows:
+            return None if passed else check.name
+        passed = np.asarray(passed, dtype=bool)
+        if passed.all():
+            return None
+        failing = frame.index[~passed]
+        examples = ", ".join(map(str, failing[:MAX_REPORTED_ROWS]))
+        return (
+            f"{check.name}: {len(failing)} of {len(frame)} rows fail, e.g. {examples}"
+        )
@@ -0,0 +1,89 @@
+"""Shared fixtures of the test and benchmark suites.
+
+Validation records are written to a temporary directory rather than ``data/interim/cache``.
+
+Benchmarks run offline on synthetic inputs from ``tests/synthetic.py``.  Set
+``MILTON_MAPS_BENCH_SCALE=statewide`` to benchmark statewide-size inputs instead of the default
+Milton-size inputs, and ``MILTON_MAPS_BENCH_OUTPUT`` to a path to save the results as JSON.
+"""
+import json
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from milton_maps import cache
+from tests.synthetic import SCALES
+
+BENCHMARK_RESULTS = []
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    path = tmp_path_factory.getbasetemp() / "cache"
+    monkeypatch.setattr(cache, "CACHE_DIR", path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def scale_name():
+    return os.environ.get("MILTON_MAPS_BENCH_SCALE", "milton")
+
+
+@pytest.fixture(scope="session")
+def scale(scale_name):
+    return SCALES[scale_name]
+
+
+@pytest.fixture
+def benchmark(request, scale_name):
+    """Run ``func(*args, **kwargs)`` and record its wall time, CPU time and peak memory.
+
+    The function is run twice: once for timing and once under ``tracemalloc`` for peak
+    memory, since tracing slows Python-heavy code far more than vectorized code.  Peak memory
+    covers allocations made through Python and numpy, not inside GEOS or GDAL.
+    """
+
+    def run(func, *args, **kwargs):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = func(*args, **kwargs)
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        BENCHMARK_RESULTS.append(
+            {
+                "benchmark": request.node.name,
+                "scale": scale_name,
+                "wall_seconds": round(wall, 4),
+                "cpu_seconds": round(cpu, 4),
+                "peak_traced_mb": round(peak / 2**20, 2),
+            }
+        )
+        return result
+
+    return run
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not BENCHMARK_RESULTS:
+        return
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(
+        f"{'benchmark':<60} {'scale':<10} {'wall s':>8} {'cpu s':>8} {'peak MB':>8}"
+    )
+    for result in BENCHMARK_RESULTS:
+        terminalreporter.write_line(
+            f"{result['benchmark']:<60} {result['scale']:<10} {result['wall_seconds']:>8.3f} "
+            f"{result['cpu_seconds']:>8.3f} {result['peak_traced_mb']:>8.1f}"
+        )
+    output_path = os.environ.get("MILTON_MAPS_BENCH_OUTPUT")
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(BENCHMARK_RESULTS, f, indent=2)
@@ -0,0 +1,317 @@
+"""Deterministic synthetic inputs for every pipeline stage.
+
+The real raw data sits behind DVC remotes, so benchmarks and tests build look-alike inputs
+with the same schemas instead.  All generators are seeded and scale with a ``Scale``, from
+Milton-sized inputs up to statewide.
+
+Geography: the 351 towns are 5 km squares on a 27 x 13 grid in EPSG:26986, each split into
+one to three polygons.  Tax parcels, open space, roads and crashes are laid out on top of
+that grid.
+"""
+from dataclasses import dataclass
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import LineString, box
+
+CRS = "EPSG:26986"
+N_TOWNS = 351
+TOWN_GRID_COLUMNS = 27
+TOWN_SIZE = 5000.0
+ORIGIN = (200_000.0, 850_000.0)
+
+MILTON_TOWN_ID = 189
+QUINCY_TOWN_ID = 243
+
+USE_CODES = ["1010", "1020", "1040", "1090", "0130", "3250", "3400", "9300", "1300"]
+STREET_NAMES = ["MAIN ST", "RANDOLPH AVE", "CHICKATAWBUT RD", "ADAMS ST", "CENTRE ST"]
+INJURY_SEVERITIES = [
+    "No injury",
+    "Non-fatal injury - Possible",
+    "Non-fatal injury - Incapacitating",
+    "Fatal injury (K)",
+    "Not reported",
+    None,
+]
+
+
+@dataclass(frozen=True)
+class Scale:
+    """Size of the synthetic inputs"""
+
+    parcel_towns: int
+    parcels_per_town: int
+    openspace_polygons: int
+    crashes: int
+    road_grid: int
+
+
+SCALES = {
+    "milton": Scale(
+        parcel_towns=2,
+        parcels_per_town=10_000,
+        openspace_polygons=2_000,
+        crashes=10_000,
+        road_grid=40,
+    ),
+    "statewide": Scale(
+        parcel_towns=N_TOWNS,
+        parcels_per_town=6_000,
+        openspace_polygons=100_000,
+        crashes=2_000_000,
+        road_grid=400,
+    ),
+}
+
+
+def town_origin(town_id: int):
+    row, column = divmod(town_id - 1, TOWN_GRID_COLUMNS)
+    return ORIGIN[0] + column * TOWN_SIZE, ORIGIN[1] + row * TOWN_SIZE
+
+
+def state_bounds():
+    n_rows = -(-N_TOWNS // TOWN_GRID_COLUMNS)
+    return (
+        ORIGIN[0],
+        ORIGIN[1],
+        ORIGIN[0] + TOWN_GRID_COLUMNS * TOWN_SIZE,
+        ORIGIN[1] + n_rows * TOWN_SIZE,
+    )
+
+
+def parcel_town_ids(scale: Scale) -> list:
+    """TOWN_IDs that get tax parcels, starting with Milton and Quincy"""
+    others = [
+        t for t in range(1, N_TOWNS + 1) if t not in (MILTON_TOWN_ID, QUINCY_TOWN_ID)
+    ]
+    return [MILTON_TOWN_ID, QUINCY_TOWN_ID, *others][: scale.parcel_towns]
+
+
+def town_polygons(seed: int = 0) -> gpd.GeoDataFrame:
+    """Raw town survey polygons, with several rows for towns made of several parts"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for town_id in range(1, N_TOWNS + 1):
+        x0, y0 = town_origin(town_id)
+        n_parts = 1 + town_id % 3
+        width = TOWN_SIZE / n_parts
+        attributes = {
+            "TOWN": "MILTON" if town_id == MILTON_TOWN_ID else f"TOWN {town_id}",
+            "TOWN_ID": town_id,
+            "FIPS_STCO": 25001 + 2 * (town_id % 14),
+            "COUNTY": f"COUNTY {town_id % 14}",
+            "TYPE": "T" if town_id % 5 else "C",
+            "FOURCOLOR": town_id % 4 + 1,
+            **{
+                f"POP{year}": int(rng.integers(1_000, 100_000))
+                for year in range(1960, 2030, 10)
+            },
+            "POPCH80_90": int(rng.integers(-500, 500)),
+            "POPCH90_00": int(rng.integers(-500, 500)),
+            "POPCH00_10": int(rng.integers(-500, 500)),
+        }
+        for part in range(n_parts):
+            geometry = box(
+                x0 + part * width, y0, x0 + (part + 1) * width - 1, y0 + TOWN_SIZE
+            )
+            rows.append(
+                {
+                    **attributes,
+                    "SHAPE_AREA": geometry.area,
+                    "SHAPE_LEN": geometry.length,
+                    "geometry": geometry,
+                }
+            )
+    return gpd.GeoDataFrame(rows, crs=CRS)
+
+
+def tax_parcels(town_id: int, n_parcels: int, seed: int = 0) -> gpd.GeoDataFrame:
+    """Square tax parcels on a grid covering one town"""
+    rng = np.random.default_rng(seed + town_id)
+    side = int(np.ceil(np.sqrt(n_parcels)))
+    size = TOWN_SIZE / side
+    x0, y0 = town_origin(town_id)
+    i = np.arange(n_parcels)
+    xmin = x0 + (i % side) * size
+    ymin = y0 + (i // side) * size
+    shrink = rng.uniform(0.7, 0.95, n_parcels) * size
+    return gpd.GeoDataFrame(
+        {
+            "MAP_PAR_ID": [f"{town_id}-{k}" for k in i],
+            "LOC_ID": [f"F_{town_id:03d}_{k:07d}" for k in i],
+            "POLY_TYPE": "FEE",
+            "MAP_NO": [f"{k // 100:03d}" for k in i],
+            "SOURCE": "ASSESS",
+            "LAST_EDIT": 20220101,
+            "TOWN_ID": town_id,
+        },
+        geometry=[box(a, b, a + s, b + s) for a, b, s in zip(xmin, ymin, shrink)],
+        crs=CRS,
+    )
+
+
+def assessor_records(parcels: gpd.GeoDataFrame, seed: int = 0) -> gpd.GeoDataFrame:
+    """Assessor DB records for tax parcels, with some LOC_IDs missing"""
+    town_id = int(parcels["TOWN_ID"].iloc[0])
+    rng = np.random.default_rng(seed + town_id)
+    n = len(parcels)
+    loc_id = parcels["LOC_ID"].where(rng.random(n) > 0.01)
+    return gpd.GeoDataFrame(
+        {
+            "PROP_ID": [f"P{k}" for k in range(n)],
+            "LOC_ID": loc_id.values,
+            "TOWN_ID": town_id,
+            "SITE_ADDR": [
+                f"{k % 300 + 1}  {STREET_NAMES[k % len(STREET_NAMES)]}"
+                for k in range(n)
+            ],
+            "USE_CODE": rng.choice(USE_CODES, n),
+            "YEAR_BUILT": rng.integers(1700, 2023, n),
+            "RES_AREA": rng.integers(500, 6_000, n),
+            "ZONING": rng.choice(["RA", "RB", "RC", "B"], n),
+            "UNITS": rng.integers(0, 4, n),
+            "STYLE": rng.choice(["Colonial", "Cape Cod", "Ranch", "Victorian"], n),
+            "LOT_SIZE": rng.uniform(0.05, 3, n).round(3),
+            "TOTAL_VAL": rng.integers(100_000, 3_000_000, n),
+            "LAND_VAL": rng.integers(50_000, 1_000_000, n),
+        },
+        geometry=parcels.geometry.centroid.values,
+        crs=CRS,
+    )
+
+
+def next_fiscal_year(
+    records: gpd.GeoDataFrame, churn: float = 0.02, seed: int = 0
+) -> gpd.GeoDataFrame:
+    """The following fiscal year's assessor records: a ``churn`` fraction of parcels are
+    revalued, and as many again are removed and added"""
+    rng = np.random.default_rng(seed)
+    n = len(records)
+    n_churn = max(1, int(n * churn))
+    records = records.copy()
+    revalued = rng.choice(n, n_churn, replace=False)
+    records.iloc[revalued, records.columns.get_loc("TOTAL_VAL")] += 10_000
+    removed = rng.choice(np.setdiff1d(np.arange(n), revalued), n_churn, replace=False)
+    added = records.iloc[removed].copy()
+    added["PROP_ID"] = [f"N{k}" for k in range(n_churn)]
+    added["LOC_ID"] = None
+    return pd.concat([records.drop(records.index[removed]), added], ignore_index=True)
+
+
+def openspace_polygons(n_polygons: int, seed: int = 0) -> gpd.GeoDataFrame:
+    """Open space parcels scattered over the state, with coded attributes"""
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = state_bounds()
+    x = rng.uniform(xmin, xmax, n_polygons)
+    y = rng.uniform(ymin, ymax, n_polygons)
+    size = rng.uniform(20, 400, n_polygons)
+    owners = np.array(["TOWN", "DCR", "LAND TRUST", None], dtype=object)
+    return gpd.GeoDataFrame(
+        {
+            "SITE_NAME": [f"SITE {k}" for k in range(n_polygons)],
+            "FEE_OWNER": rng.choice(owners, n_polygons),
+            "MANAGER": rng.choice(owners, n_polygons),
+            "PUB_ACCESS": rng.choice(list("YNLX"), n_polygons),
+            "PRIM_PURP": rng.choice(list("RCBHAWSFUOX"), n_polygons),
+            "LEV_PROT": rng.choice(list("PTLN"), n_polygons),
+            "GIS_ACRES": (size**2 / 4046.86).round(3),
+        },
+        geometry=[box(a, b, a + s, b + s) for a, b, s in zip(x, y, size)],
+        crs=CRS,
+    )
+
+
+def road_segments(town_id: int, grid: int, seed: int = 0) -> gpd.GeoDataFrame:
+    """A street grid over one town, split into one segment per block, with the columns of
+    the EOTROADS_ARC layer of the MassDOT roads archive"""
+    rng = np.random.default_rng(seed + town_id)
+    x0, y0 = town_origin(town_id)
+    step = TOWN_SIZE / grid
+    rows = []
+    for k in range(grid):
+        street = (
+            STREET_NAMES[k % len(STREET_NAMES)] if k < len(STREET_NAMES) else f"ST {k}"
+        )
+        avenue = f"AVE {k}"
+        for j in range(grid - 1):
+            rows.append(
+                {
+                    "CITY": town_id,
+                    "STREETNAME": street,
+                    "RT_NUMBER": "28" if street == "RANDOLPH AVE" else None,
+                    "geometry": LineString(
+                        [
+                            (x0 + j * step, y0 + k * step),
+                            (x0 + (j + 1) * step, y0 + k * step),
+                        ]
+                    ),
+                }
+            )
+            rows.append(
+                {
+                    "CITY": town_id,
+                    "STREETNAME": avenue,
+                    "RT_NUMBER": None,
+                    "geometry": LineString(
+                        [
+                            (x0 + k * step, y0 + j * step),
+                            (x0 + k * step, y0 + (j + 1) * step),
+                        ]
+                    ),
+                }
+            )
+    roads = gpd.GeoDataFrame(rows, crs=CRS)
+    roads["SPEEDLIMIT"] = rng.choice([25, 30, 40], len(roads))
+    return roads
+
+
+def crash_records(n_crashes: int, town_ids: list, seed: int = 0) -> pd.DataFrame:
+    """Crash records in the layout of a MassDOT crash details export"""
+    rng = np.random.default_rng(seed)
+    town = rng.choice(town_ids, n_crashes)
+    origins = np.array([town_origin(t) for t in town])
+    timestamps = pd.to_datetime(rng.integers(1.2e9, 1.7e9, n_crashes), unit="s")
+    x = origins[:, 0] + rng.uniform(0, TOWN_SIZE, n_crashes)
+    y = origins[:, 1] + rng.uniform(0, TOWN_SIZE, n_crashes)
+    x[rng.random(n_crashes) < 0.02] = np.nan
+    return pd.DataFrame(
+        {
+            "Crash_Number": np.arange(n_crashes),
+            "City_Town_Name": [f"TOWN {t}" for t in town],
+            "Crash_Date": timestamps.strftime("%d-%b-%Y"),
+            "Crash_Time": timestamps.strftime("%I:%M %p").str.lstrip("0"),
+            "Crash_Severity": rng.choice(
+                [
+                    "Property damage only (none injured)",
+                    "Non-fatal injury",
+                    "Fatal injury",
+                ],
+                n_crashes,
+            ),
+            "Maximum_Injury_Severity_Reported": rng.choice(
+                np.array(INJURY_SEVERITIES, dtype=object), n_crashes
+            ),
+            "Number_of_Vehicles": rng.integers(1, 4, n_crashes),
+            "Manner_of_Collision": rng.choice(
+                ["Angle", "Rear-end", "Head-on"], n_crashes
+            ),
+            "At_Roadway_Intersection": rng.choice(
+                [
+                    "Four-way intersection",
+                    "T-intersection",
+                    "Not at roadway intersection",
+                ],
+                n_crashes,
+            ),
+            "X_Cooordinate": x,
+            "Y_Cooordinate": y,
+        }
+    )
+
+
+def write_crash_csv(crashes: pd.DataFrame, path):
+    """Write crash records with the two preamble lines of a MassDOT export"""
+    with open(path, "w", newline="") as f:
+        f.write("Crash Details Report\r\n\r\n")
+        crashes.to_csv(f, index=False, lineterminator="\r\n")
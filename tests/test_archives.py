@@ -0,0 +1,87 @@
+"""Tests for reading raw layers straight from their zip archives."""
+import re
+import zipfile
+
+import pytest
+
+from milton_maps.archives import (
+    archive_member,
+    archive_of,
+    find_members,
+    member_size,
+    split_archive_path,
+)
+from milton_maps.artifacts import read_artifact
+from milton_maps.process_crash_data import _read_route_segments
+from milton_maps.process_road_intersections import (
+    STREET_COLUMN,
+    process_road_intersections,
+    read_roads,
+)
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+@pytest.fixture(scope="module")
+def roads_archive(tmp_path_factory):
+    """A MassDOT roads archive holding the segments layer, EOTROADS_ARC, and a route layer
+    whose street column is truncated to STREET_NAM"""
+    directory = tmp_path_factory.mktemp("roads")
+    roads = synthetic.road_segments(synthetic.MILTON_TOWN_ID, 8)
+    roads.to_file(directory / "EOTROADS_ARC.shp")
+    roads.rename(columns={STREET_COLUMN: "STREET_NAM"}).to_file(
+        directory / "EOTMAJROADS_RTE_MAJOR.shp"
+    )
+    path = directory / "MassDOT_Roads_SHP.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        for file in sorted(directory.glob("EOT*")):
+            zf.write(file, file.name)
+    return path
+
+
+def test_archive_paths(roads_archive):
+    member = archive_member(roads_archive, "EOTROADS_ARC.shp")
+    assert member == f"zip://{roads_archive}!EOTROADS_ARC.shp"
+    assert split_archive_path(member) == (str(roads_archive), "EOTROADS_ARC.shp")
+    assert split_archive_path(f"/vsizip/{roads_archive}/EOTROADS_ARC.shp") == (
+        str(roads_archive),
+        "EOTROADS_ARC.shp",
+    )
+    assert split_archive_path(roads_archive) == (None, None)
+    assert archive_of(member) == str(roads_archive)
+    assert archive_of(roads_archive) == str(roads_archive)
+
+    with zipfile.ZipFile(roads_archive) as zf:
+        sidecars = [i for i in zf.infolist() if i.filename.startswith("EOTROADS_ARC.")]
+    assert len(sidecars) > 1
+    assert member_size(member) == sum(i.compress_size for i in sidecars)
+    assert find_members(roads_archive, re.compile(r"^EOTROADS.*\.shp$")) == [member]
+
+
+def test_read_roads_members(roads_archive):
+    segments = read_artifact(archive_member(roads_archive, "EOTROADS_ARC.shp"))
+    assert STREET_COLUMN in segments.columns
+
+    # Both layers are read with the segments layer's column names
+    for layer in ["EOTROADS_ARC.shp", "EOTMAJROADS_RTE_MAJOR.shp"]:
+        path = archive_member(roads_archive, layer)
+        roads = read_roads(path)
+        assert STREET_COLUMN in roads.columns
+        assert "STREET_NAM" not in roads.columns
+        randolph_ave = _read_route_segments(
+            path, rt_number="28", street_name="randolph"
+        )
+        assert len(randolph_ave) == 7
+        assert (randolph_ave[STREET_COLUMN] == "RANDOLPH AVE").all()
+
+
+def test_process_road_intersections_from_archive(tmp_path, roads_archive):
+    output_path = tmp_path / "road_intersections.parquet"
+    process_road_intersections(
+        archive_member(roads_archive, "EOTROADS_ARC.shp"), output_path
+    )
+    intersections = read_artifact(output_path)
+    # Every node of the 8 x 8 street grid but its 4 corners, where two segments just meet
+    assert len(intersections) == 8 * 8 - 4
+    assert intersections.STREETS.str.contains("RANDOLPH AVE").sum() == 8
@@ -0,0 +1,397 @@
+"""Timing and peak-memory benchmarks of each pipeline stage on synthetic inputs."""
+import json
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from milton_maps.artifacts import read_artifact, write_artifact
+from milton_maps.cache import ArrayCache
+from milton_maps.compact import compact_frame
+from milton_maps.crash_cube import build_crash_cube
+from milton_maps.crash_hotspots import HotspotGrid, hotspot_grid, kernel_density
+from milton_maps.crash_store import CrashStore
+from milton_maps.milton_maps import plot_map
+from milton_maps.process_assessor_db import (
+    ASSESSOR_CATEGORICAL_COLUMNS,
+    clean_assessor_db,
+    process_assessor_db,
+    source_hashes,
+    update_assessor_db,
+)
+from milton_maps.process_assessor_dbs import process_assessor_dbs
+from milton_maps.process_crash_data import (
+    randolph_ave_upstream_vs_intersection,
+    read_crash_data,
+)
+from milton_maps.process_openspace import clean_openspace, process_openspace
+from milton_maps.process_openspace_access import openspace_access
+from milton_maps.process_road_intersections import (
+    classify_crash_locations,
+    find_intersections,
+    process_road_intersections,
+)
+from milton_maps.process_tax_parcels import process_tax_parcels
+from milton_maps.process_town_boundaries import (
+    TOWN_BOUNDARIES_VALIDATION,
+    build_town_boundaries,
+    process_town_boundaries,
+)
+from milton_maps.rendering import render_maps
+from milton_maps.road_corridors import assign_crashes_to_segments
+from milton_maps.validation import ValidationSuite
+from tests import synthetic
+
+pytestmark = [
+    pytest.mark.benchmark,
+    pytest.mark.filterwarnings("ignore::UserWarning"),
+]
+
+
+@pytest.fixture(scope="session")
+def workdir(tmp_path_factory):
+    """Working directory laid out like the repository, since stages use relative paths"""
+    workdir = tmp_path_factory.mktemp("pipeline")
+    (workdir / "data/raw").mkdir(parents=True)
+    (workdir / "data/processed").mkdir(parents=True)
+    return workdir
+
+
+@pytest.fixture(scope="session")
+def raw_towns(workdir):
+    path = workdir / "data/raw/TOWNSSURVEY_POLY.shp"
+    synthetic.town_polygons().to_file(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def town_boundaries(workdir, raw_towns):
+    towns = synthetic.town_polygons()
+    boundaries = towns.dissolve("TOWN_ID")[["TOWN", "geometry"]]
+    with open(workdir / "data/processed/town_ids.json", "w") as f:
+        json.dump(boundaries["TOWN"].to_dict(), f)
+    return boundaries
+
+
+@pytest.fixture(scope="session")
+def raw_town_data(workdir, scale, town_boundaries):
+    """Tax parcel shapefiles and assessor GDBs for each town with parcels"""
+    gdb_dir = workdir / "data/raw/parcels_gdb"
+    tax_parcel_paths, gdb_paths = [], []
+    for town_id in synthetic.parcel_town_ids(scale):
+        parcels = synthetic.tax_parcels(town_id, scale.parcels_per_town)
+        tax_parcel_path = workdir / f"data/raw/M{town_id:03d}TaxPar.shp"
+        parcels.to_file(tax_parcel_path)
+        # Written as GeoPackage; GDAL reads it by content regardless of the extension
+        gdb_path = gdb_dir / f"M{town_id:03d}_parcels_CY22_FY22_sde.gdb"
+        gdb_path.parent.mkdir(parents=True, exist_ok=True)
+        synthetic.assessor_records(parcels).to_file(
+            gdb_path, layer=f"M{town_id:03d}Assess", driver="GPKG"
+        )
+        tax_parcel_paths.append(tax_parcel_path)
+        gdb_paths.append(gdb_path)
+    return tax_parcel_paths, gdb_paths
+
+
+@pytest.fixture(scope="session")
+def crash_csv(workdir, scale, town_boundaries):
+    path = workdir / "data/raw/CrashDetails.csv"
+    town_ids = [synthetic.MILTON_TOWN_ID, synthetic.QUINCY_TOWN_ID]
+    synthetic.write_crash_csv(synthetic.crash_records(scale.crashes, town_ids), path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def roads(scale):
+    return synthetic.road_segments(synthetic.MILTON_TOWN_ID, scale.road_grid)
+
+
+def test_process_town_boundaries(benchmark, workdir, raw_towns, monkeypatch):
+    monkeypatch.chdir(workdir)
+    output_path = workdir / "data/processed/town_boundaries.parquet"
+    benchmark(process_town_boundaries, str(raw_towns), str(output_path))
+    assert read_artifact(output_path).shape == (351, 19)
+
+
+@pytest.mark.parametrize("mode", ["full", "sampled", "cached"])
+def test_validate_town_boundaries(benchmark, tmp_path, mode):
+    towns = synthetic.town_polygons()
+    town_boundaries = build_town_boundaries(towns)
+    suite = ValidationSuite(
+        "town_boundaries",
+        TOWN_BOUNDARIES_VALIDATION.checks,
+        sample_rows=50,
+        cache_dir=tmp_path,
+    )
+    if mode == "cached":
+        suite.validate(town_boundaries, mode="full", towns=towns)
+    result = benchmark(
+        suite.validate,
+        town_boundaries,
+        mode=mode.replace("cached", "full"),
+        towns=towns,
+    )
+    assert result["cached"] == (mode == "cached")
+
+
+def test_process_assessor_db(benchmark, workdir, raw_town_data, monkeypatch):
+    monkeypatch.chdir(workdir)
+    _, gdb_paths = raw_town_data
+    output_path = workdir / "data/processed/assessor_db.parquet"
+    layer = gdb_paths[0].name[:4] + "Assess"
+    benchmark(process_assessor_db, str(gdb_paths[0]), layer, str(output_path))
+    assert read_artifact(output_path, columns=["TOWN"])["TOWN"].notna().all()
+
+
+def test_update_assessor_db(benchmark, scale, town_boundaries):
+    town_ids_map = {str(k): v for k, v in town_boundaries["TOWN"].items()}
+    records = synthetic.assessor_records(
+        synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, scale.parcels_per_town)
+    )
+    previous = clean_assessor_db(records.copy(), town_ids_map)
+    next_year = synthetic.next_fiscal_year(records)
+    updated, changes = benchmark(
+        lambda: update_assessor_db(
+            next_year.copy(),
+            previous,
+            source_hashes(records, town_ids_map),
+            town_ids_map,
+        )
+    )
+    assert len(updated) == len(next_year)
+    assert set(changes["CHANGE"]) == {"added", "removed", "changed"}
+
+
+def test_compact_assessor_db(benchmark, scale, town_boundaries):
+    town_ids_map = {str(k): v for k, v in town_boundaries["TOWN"].items()}
+    records = synthetic.assessor_records(
+        synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, scale.parcels_per_town)
+    )
+    assessor_db = clean_assessor_db(records, town_ids_map)
+    compacted = benchmark(compact_frame, assessor_db, ASSESSOR_CATEGORICAL_COLUMNS)
+    assert compacted.shape == assessor_db.shape
+
+
+def test_process_assessor_dbs(benchmark, workdir, raw_town_data, monkeypatch):
+    monkeypatch.chdir(workdir)
+    output_dir = workdir / "data/processed/assessor_dbs"
+    written = benchmark(
+        process_assessor_dbs,
+        workdir / "data/raw/parcels_gdb",
+        output_dir,
+        max_workers=2,
+    )
+    assert len(written) == len(raw_town_data[1])
+
+
+@pytest.mark.parametrize(
+    "output_name", ["residential_tax_parcels.parquet", "residential_tax_parcels"]
+)
+def test_process_tax_parcels(
+    benchmark, workdir, raw_town_data, monkeypatch, output_name
+):
+    monkeypatch.chdir(workdir)
+    tax_parcel_paths, gdb_paths = raw_town_data
+    assessor_db_paths = []
+    for gdb_path in gdb_paths:
+        assessor_db_path = workdir / f"data/processed/{gdb_path.stem}.parquet"
+        process_assessor_db(
+            str(gdb_path), gdb_path.name[:4] + "Assess", str(assessor_db_path)
+        )
+        assessor_db_paths.append(str(assessor_db_path))
+    output_path = workdir / "data/processed" / output_name
+    benchmark(
+        process_tax_parcels,
+        [str(p) for p in tax_parcel_paths],
+        assessor_db_paths,
+        str(output_path),
+    )
+    assert read_artifact(output_path, columns=["IS_RESIDENTIAL"]).IS_RESIDENTIAL.all()
+
+
+@pytest.mark.parametrize("quantize", [None, 0.01], ids=["full", "quantized"])
+def test_read_quantized_parcels(benchmark, tmp_path, scale, quantize):
+    parcels = synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, scale.parcels_per_town)
+    path = tmp_path / "parcels.parquet"
+    write_artifact(parcels, path, quantize=quantize)
+    read = benchmark(read_artifact, path)
+    assert len(read) == len(parcels)
+
+
+def test_process_openspace(benchmark, workdir, scale):
+    input_path = workdir / "data/raw/OPENSPACE_POLY.shp"
+    synthetic.openspace_polygons(scale.openspace_polygons).to_file(input_path)
+    output_path = workdir / "data/processed/openspace.parquet"
+    benchmark(process_openspace, str(input_path), str(output_path))
+    assert len(read_artifact(output_path)) == scale.openspace_polygons
+
+
+def test_openspace_access(benchmark, scale):
+    parcels = synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, scale.parcels_per_town)
+    openspace = clean_openspace(synthetic.openspace_polygons(scale.openspace_polygons))
+    annotated = benchmark(openspace_access, parcels, openspace)
+    assert annotated.NEAREST_PUBLIC_OPENSPACE_DIST.notna().all()
+    assert (annotated.PROTECTED_ACRES_400M <= annotated.PROTECTED_ACRES_1600M).all()
+
+
+def test_process_road_intersections(benchmark, workdir, scale, roads):
+    input_path = workdir / "data/raw/roads.parquet"
+    roads.to_parquet(input_path)
+    output_path = workdir / "data/processed/road_intersections.parquet"
+    benchmark(process_road_intersections, str(input_path), str(output_path))
+    # Every node of the street grid but its 4 corners
+    assert len(read_artifact(output_path)) == scale.road_grid**2 - 4
+
+
+@pytest.mark.parametrize("chunksize", [None, 100_000])
+def test_read_crash_data(benchmark, crash_csv, town_boundaries, chunksize):
+    crashes = benchmark(
+        read_crash_data,
+        crash_csv,
+        town_boundaries=town_boundaries,
+        town_ids=[synthetic.MILTON_TOWN_ID],
+        chunksize=chunksize,
+    )
+    assert (crashes["TOWN_ID"] == synthetic.MILTON_TOWN_ID).all()
+
+
+@pytest.fixture(scope="session")
+def milton_crashes(crash_csv, town_boundaries):
+    return read_crash_data(
+        crash_csv, town_boundaries=town_boundaries, town_ids=[synthetic.MILTON_TOWN_ID]
+    )
+
+
+@pytest.mark.parametrize("geometry", [False, True], ids=["table", "geodataframe"])
+def test_open_crash_store(benchmark, tmp_path, milton_crashes, geometry):
+    path = tmp_path / "crashes.arrow"
+    CrashStore.from_crashes(milton_crashes).write(path)
+
+    def open_store():
+        store = CrashStore.open(path)
+        return store.to_geodataframe() if geometry else store
+
+    assert len(benchmark(open_store)) == len(milton_crashes)
+
+
+def test_assign_crashes_to_segments(benchmark, milton_crashes, roads):
+    assigned = benchmark(
+        assign_crashes_to_segments, milton_crashes, roads, tolerance=20
+    )
+    assert assigned["SEGMENT_DISTANCE"].dropna().le(20).all()
+
+
+def test_classify_crash_locations(benchmark, milton_crashes, roads):
+    intersections = find_intersections(roads)
+    classified = benchmark(classify_crash_locations, milton_crashes, intersections)
+    near = milton_crashes.distance(intersections.unary_union) <= 20
+    assert (classified["LOCATION"] == "intersection").sum() == near.sum()
+
+
+def test_randolph_ave_upstream_vs_intersection(benchmark, milton_crashes, roads):
+    intersections = find_intersections(roads)
+    randolph_ave = roads[roads["STREETNAME"] == "RANDOLPH AVE"]
+    intersection, _, combined = benchmark(
+        randolph_ave_upstream_vs_intersection,
+        milton_crashes,
+        randolph_ave,
+        intersections,
+    )
+    # Chickatawbut Road runs parallel to Randolph Avenue on the synthetic grid, so every
+    # crash within 20 m of Randolph Avenue is upstream
+    on_randolph_ave = milton_crashes.distance(randolph_ave.unary_union) <= 20
+    assert intersection.empty
+    assert (combined["where"] == "upstream").sum() == on_randolph_ave.sum()
+
+
+@pytest.fixture(scope="session")
+def milton_crash_cube(milton_crashes, roads):
+    crashes = assign_crashes_to_segments(milton_crashes, roads)
+    return build_crash_cube(
+        classify_crash_locations(crashes, find_intersections(roads))
+    )
+
+
+def test_build_crash_cube(benchmark, milton_crashes, roads):
+    crashes = classify_crash_locations(
+        assign_crashes_to_segments(milton_crashes, roads), find_intersections(roads)
+    )
+    cube = benchmark(build_crash_cube, crashes)
+    expected = crashes[crashes.LOCATION == "intersection"].groupby("year").size()
+    pd.testing.assert_series_equal(
+        cube.table("year", location="intersection"),
+        expected.rename("crashes"),
+        check_index_type=False,
+    )
+
+
+def test_crash_cube_query(benchmark, milton_crash_cube):
+    count = benchmark(
+        milton_crash_cube.count, severity="Major Injury", location="intersection"
+    )
+    assert 0 < count < milton_crash_cube.count()
+
+
+@pytest.mark.parametrize("shape", ["square", "hex"])
+def test_hotspot_grid(benchmark, milton_crashes, shape):
+    grid = benchmark(hotspot_grid, milton_crashes, shape, cell_size=250)
+    assert grid.count.sum() == len(milton_crashes)
+
+
+def test_kernel_density(benchmark, milton_crashes):
+    surface = benchmark(kernel_density, milton_crashes, bandwidth=200, cell_size=50)
+    assert surface.density.max() > 0
+
+
+def test_hotspot_grid_cache(benchmark, tmp_path, crash_csv, milton_crashes):
+    cache = ArrayCache(tmp_path)
+
+    def loader(path, shape):
+        return hotspot_grid(milton_crashes, shape).to_arrays()
+
+    computed = HotspotGrid.from_arrays(cache.load(crash_csv, loader, shape="hex"))
+    cache.clear(disk=False)
+    cached = benchmark(
+        lambda: HotspotGrid.from_arrays(cache.load(crash_csv, loader, shape="hex"))
+    )
+    assert (cached.weight == computed.weight).all()
+
+
+@pytest.mark.parametrize("raster", [False, True], ids=["vector", "raster"])
+def test_plot_map(benchmark, scale, raster):
+    import matplotlib.pyplot as plt
+
+    parcels = synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, scale.parcels_per_town)
+
+    def draw():
+        ax = plot_map(parcels, "POLY_TYPE", raster=raster)
+        ax.figure.canvas.draw()
+        plt.close(ax.figure)
+
+    benchmark(draw)
+
+
+def test_render_maps(benchmark, tmp_path, scale):
+    parcels = pd.concat(
+        synthetic.tax_parcels(town_id, scale.parcels_per_town // 4)
+        for town_id in synthetic.parcel_town_ids(scale)[:4]
+    )
+    paths = benchmark(
+        render_maps, parcels, "POLY_TYPE", tmp_path, raster=True, figsize=(8, 8)
+    )
+    assert all(path.exists() for path in paths.values())
+
+
+@pytest.mark.parametrize(
+    "args", [["--help"], ["process_openspace", "--help"]], ids=["help", "subcommand"]
+)
+def test_cli_cold_start(benchmark, tmp_path, args):
+    """Start-up time of a fresh ``milton_maps`` process, as paid by every DVC stage"""
+    completed = benchmark(
+        subprocess.run,
+        [sys.executable, "-m", "milton_maps.cli", *args],
+        cwd=tmp_path,
+        capture_output=True,
+    )
+    assert completed.returncode == 0
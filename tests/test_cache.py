@@ -0,0 +1,40 @@
+"""Tests for the two-tier layer cache."""
+import pytest
+
+from milton_maps.cache import ArrayCache, LayerCache
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+def _read_parcels(path, n_parcels):
+    return synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, n_parcels)
+
+
+def test_entries_are_written_atomically(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("parcels")
+    cache = LayerCache(tmp_path / "cache")
+
+    parcels = cache.load(source, _read_parcels, n_parcels=100)
+    assert sorted(p.suffix for p in (tmp_path / "cache").glob("*")) == ["", ".parquet"]
+    assert not list((tmp_path / "cache/partial").iterdir())
+
+    cache.clear(disk=False)
+    assert cache.load(source, _read_parcels, n_parcels=100).equals(parcels)
+
+
+def test_failed_writes_leave_no_entry(tmp_path, monkeypatch):
+    source = tmp_path / "source.txt"
+    source.write_text("arrays")
+    cache = ArrayCache(tmp_path / "cache")
+
+    def fail(arrays, path):
+        path.write_bytes(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(cache, "_write", fail)
+    with pytest.raises(OSError):
+        cache.load(source, lambda path: {"a": [1]})
+    assert cache.disk_usage() == 0
+    assert not list((tmp_path / "cache/partial").iterdir())
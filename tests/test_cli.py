@@ -0,0 +1,27 @@
+"""Tests for the `milton_maps` command line entry point."""
+import subprocess
+import sys
+
+
+def test_cli_import_is_light():
+    """The entry point doesn't import the geospatial or plotting stack until a command runs"""
+    code = (
+        "import sys, milton_maps.cli; "
+        "print(sorted({'geopandas', 'matplotlib', 'pandas'} & set(sys.modules)))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert completed.stdout.strip() == "[]"
+
+
+def test_unknown_command(tmp_path):
+    completed = subprocess.run(
+        [sys.executable, "-m", "milton_maps.cli", "no_such_command"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    )
+    assert completed.returncode != 0
+    assert "No such command" in completed.stderr
+    assert not (tmp_path / "pipeline.log").exists()
@@ -0,0 +1,53 @@
+"""Tests for the memory-mapped crash store."""
+import pandas as pd
+import pytest
+
+from milton_maps.crash_store import CrashStore
+from milton_maps.process_crash_data import read_crash_data
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+@pytest.fixture(scope="module")
+def crashes(tmp_path_factory):
+    path = tmp_path_factory.mktemp("crashes") / "CrashDetails.csv"
+    synthetic.write_crash_csv(
+        synthetic.crash_records(2_000, [synthetic.MILTON_TOWN_ID]), path
+    )
+    town_boundaries = synthetic.town_polygons().dissolve("TOWN_ID")[
+        ["TOWN", "geometry"]
+    ]
+    return read_crash_data(path, town_boundaries=town_boundaries)
+
+
+def test_round_trip(tmp_path, crashes):
+    path = tmp_path / "crashes.arrow"
+    CrashStore.from_crashes(crashes).write(path)
+    store = CrashStore.open(path)
+
+    x, _ = store.coordinates()
+    assert not x.flags.owndata
+    restored = store.to_geodataframe()
+    assert list(restored.columns) == list(crashes.columns)
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(restored.drop(columns="geometry")),
+        pd.DataFrame(crashes.drop(columns="geometry")),
+    )
+    assert restored.geometry.geom_equals(crashes.geometry).all()
+    assert restored.crs == crashes.crs
+    assert list(store.to_geodataframe(["TOWN_ID", "severity"]).columns) == [
+        "TOWN_ID",
+        "severity",
+        "geometry",
+    ]
+
+
+def test_filter(crashes):
+    store = CrashStore.from_crashes(crashes)
+    severe = store.filter(severity=["Fatal Injury", "Major Injury"], year=2021)
+    expected = crashes.severity.isin(["Fatal Injury", "Major Injury"]) & (
+        crashes.year == 2021
+    )
+    assert len(severe) == expected.sum()
+    assert list(severe.to_pandas(["severity"]).columns) == ["severity"]
@@ -0,0 +1,81 @@
+"""Tests for the stage metrics written by ``stage_timer``."""
+import json
+import logging
+
+import pandas as pd
+import pytest
+
+from milton_maps.artifacts import read_artifact, write_artifact
+from milton_maps.logging_config import (
+    configure_logging,
+    metrics_logger,
+    record_read,
+    record_write,
+    stage_timer,
+)
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+@pytest.fixture
+def log_files(tmp_path):
+    """Log to files under ``tmp_path``, restoring the logging configuration afterwards"""
+    root_logger = logging.getLogger()
+    saved = [
+        (log, list(log.handlers), log.level, log.propagate)
+        for log in (root_logger, metrics_logger)
+    ]
+    log_file, metrics_file = tmp_path / "pipeline.log", tmp_path / "metrics.jsonl"
+    configure_logging(log_file, metrics_file)
+    yield log_file, metrics_file
+    for log, handlers, level, propagate in saved:
+        for handler in log.handlers:
+            handler.close()
+        log.handlers[:] = handlers
+        log.setLevel(level)
+        log.propagate = propagate
+
+
+def read_metrics(metrics_file):
+    return [json.loads(line) for line in metrics_file.read_text().splitlines()]
+
+
+def test_stage_timer_writes_metrics(tmp_path, log_files):
+    log_file, metrics_file = log_files
+    input_path, output_path = tmp_path / "input.parquet", tmp_path / "output.parquet"
+    pd.DataFrame({"value": range(100)}).to_parquet(input_path)
+    # Outside of any stage, nothing is recorded
+    record_read(input_path)
+
+    @stage_timer("double")
+    def double(input_path, output_path):
+        df = read_artifact(input_path)
+        write_artifact(pd.concat([df, df]), output_path)
+
+    double(input_path, output_path)
+
+    (record,) = read_metrics(metrics_file)
+    assert record["stage"] == "double"
+    assert record["rows_in"] == 100
+    assert record["rows_out"] == 200
+    assert record["bytes_read"] == input_path.stat().st_size
+    assert record["bytes_written"] == output_path.stat().st_size
+    assert record["wall_seconds"] >= 0
+    assert record["cpu_seconds"] >= 0
+    assert record["peak_rss_bytes"] > 0
+    assert pd.Timestamp(record["timestamp"]).tz is not None
+    assert "double finished in" in log_file.read_text()
+
+
+def test_nested_stages(log_files):
+    _, metrics_file = log_files
+    df = pd.DataFrame({"value": range(10)})
+    with stage_timer("outer") as outer:
+        record_read(df=df)
+        with stage_timer("inner"):
+            record_write(df=df)
+    assert (outer.rows_in, outer.rows_out) == (10, 10)
+
+    inner, outer = read_metrics(metrics_file)
+    assert (inner["stage"], inner["rows_in"], inner["rows_out"]) == ("inner", 0, 10)
+    assert (outer["stage"], outer["rows_in"], outer["rows_out"]) == ("outer", 10, 10)
@@ -1,7 +1,68 @@
 #!/usr/bin/env python
 
 """Tests for `milton_maps` package."""
+import geopandas as gpd
+import pandas as pd
+import pytest
+
+import milton_maps as mm
+from milton_maps import milton_maps as api
+from milton_maps.compact import compact_frame
+from milton_maps.milton_maps import (
+    categorical_colormap,
+    export_styled_geojson,
+    feature_style,
+    popup_html,
+)
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
 
 
 def test_stub():
     assert True
+
+
+def test_package_api_is_looked_up_once():
+    assert mm.USE_CODES is api.USE_CODES
+    # Stored in the package's namespace, so later lookups skip its __getattr__
+    assert vars(mm)["USE_CODES"] is api.USE_CODES
+    with pytest.raises(AttributeError):
+        mm.no_such_attribute
+
+
+def test_export_styled_geojson_compacted_layer(tmp_path):
+    parcels = synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, 100)
+    parcels["USE"] = pd.Series(["RES", "COM", None, "R&D <lab>"] * 25, dtype=object)
+    compacted = compact_frame(parcels, ["USE"])
+    assert isinstance(compacted["USE"].dtype, pd.CategoricalDtype)
+
+    path = tmp_path / "parcels.geojson"
+    colors = export_styled_geojson(
+        compacted, path, "USE", popup_columns=["USE", "LOC_ID"], navalue="NA"
+    )
+    assert list(colors) == ["RES", "COM", "NA", "R&D <lab>"]
+    assert colors == categorical_colormap(compacted["USE"], "tab20", navalue="NA")
+    assert len(set(colors.values())) == 4
+
+    exported = gpd.read_file(path)
+    assert len(exported) == 100
+    assert exported.crs == "EPSG:4326"
+    expected = parcels["USE"].fillna("NA").map(colors)
+    assert (exported["fillColor"] == expected).all()
+    assert (exported["color"] == expected).all()
+    assert exported["popup"][3] == (
+        "<b>USE</b>: R&amp;D &lt;lab&gt;<br><b>LOC_ID</b>: " + parcels["LOC_ID"][3]
+    )
+    assert feature_style({"properties": exported.iloc[0].to_dict()}) == {
+        "fillColor": colors["RES"],
+        "color": colors["RES"],
+    }
+
+
+def test_popup_html_labels():
+    df = pd.DataFrame({"A": [1, 2], "B": ["x", None]})
+    assert popup_html(df, ["A", "B"], ["First", "Second"]).tolist() == [
+        "<b>First</b>: 1<br><b>Second</b>: x",
+        "<b>First</b>: 2<br><b>Second</b>: None",
+    ]
@@ -0,0 +1,198 @@
+"""Tests for running the processing stages in one process with ``milton_maps run``."""
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from milton_maps import artifacts, pipeline, process_assessor_db, validation
+from milton_maps.artifacts import read_artifact
+from milton_maps.pipeline import TOWNS, ArtifactStore, pipeline_stages, run_pipeline
+from milton_maps.process_assessor_db import source_hashes_path
+from milton_maps.process_openspace import process_openspace
+from milton_maps.process_openspace_access import process_openspace_access
+from milton_maps.process_road_intersections import process_road_intersections
+from milton_maps.process_tax_parcels import process_tax_parcels
+from milton_maps.process_town_boundaries import (
+    SIMPLIFY_TOLERANCES,
+    TOWN_IDS_PATH,
+    process_town_boundaries,
+    simplified_path,
+)
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+# Every stage but the crash cube, which reads its layers from the project's data directory
+TARGETS = ["process_openspace_access", "process_road_intersections"]
+
+
+def write_archive(path, layers: dict):
+    """Zip archive holding ``layers``, member name => GeoDataFrame or layer name => GeoDataFrame
+    of a ``.gdb`` member, written as a GeoPackage that GDAL reads by content"""
+    staging = path.parent / f"{path.stem}_staging"
+    files = []
+    for member, layer in layers.items():
+        member_path = staging / member
+        member_path.parent.mkdir(parents=True, exist_ok=True)
+        if member.endswith(".gdb"):
+            for name, frame in layer.items():
+                frame.to_file(member_path, layer=name, driver="GPKG")
+            files.append(member_path)
+        else:
+            layer.to_file(member_path)
+            files.extend(member_path.parent.glob(f"{member_path.stem}.*"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w") as zf:
+        for file in files:
+            zf.write(file, file.relative_to(staging).as_posix())
+
+
+def write_raw_data(workdir):
+    """Synthetic raw archives at the paths the pipeline reads"""
+
+    def raw(path):
+        return workdir / pipeline.archive_of(path)
+
+    def member(path):
+        return path.split("!")[1]
+
+    write_archive(
+        raw(pipeline.RAW_TOWNS_PATH),
+        {member(pipeline.RAW_TOWNS_PATH): synthetic.town_polygons()},
+    )
+    write_archive(
+        raw(pipeline.RAW_OPENSPACE_PATH),
+        {member(pipeline.RAW_OPENSPACE_PATH): synthetic.openspace_polygons(200)},
+    )
+    write_archive(
+        raw(pipeline.RAW_ROADS_PATH),
+        {
+            member(pipeline.RAW_ROADS_PATH): synthetic.road_segments(
+                synthetic.MILTON_TOWN_ID, 10
+            )
+        },
+    )
+    for town in TOWNS:
+        parcels = synthetic.tax_parcels(town.town_id, 300)
+        write_archive(
+            raw(town.tax_parcels_path), {member(town.tax_parcels_path): parcels}
+        )
+        write_archive(
+            raw(town.assessor_gdb_path),
+            {
+                member(town.assessor_gdb_path): {
+                    town.assessor_layer: synthetic.assessor_records(parcels)
+                }
+            },
+        )
+
+
+def run_stages_from_disk():
+    """Run each stage on its own, reading its inputs back from disk as DVC would"""
+    process_town_boundaries(pipeline.RAW_TOWNS_PATH, pipeline.TOWN_BOUNDARIES_PATH)
+    process_openspace(pipeline.RAW_OPENSPACE_PATH, pipeline.OPENSPACE_PATH)
+    process_road_intersections(
+        pipeline.RAW_ROADS_PATH, pipeline.ROAD_INTERSECTIONS_PATH
+    )
+    for town in TOWNS:
+        process_assessor_db.process_assessor_db(
+            town.assessor_gdb_path, town.assessor_layer, town.assessor_db_path
+        )
+    process_tax_parcels(
+        [town.tax_parcels_path for town in TOWNS],
+        [town.assessor_db_path for town in TOWNS],
+        pipeline.RESIDENTIAL_TAX_PARCELS_PATH,
+    )
+    process_openspace_access(
+        pipeline.RESIDENTIAL_TAX_PARCELS_PATH,
+        pipeline.OPENSPACE_PATH,
+        pipeline.OPENSPACE_ACCESS_PATH,
+    )
+
+
+@pytest.fixture(scope="module")
+def workdirs(tmp_path_factory):
+    """Outputs of ``run_pipeline``, and of the stages run one by one, on the same inputs"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        workdirs = {}
+        for name in ("pipeline", "stages"):
+            workdir = tmp_path_factory.mktemp(name)
+            write_raw_data(workdir)
+            (workdir / "data/processed").mkdir(parents=True)
+            monkeypatch.chdir(workdir)
+            if name == "pipeline":
+                ran = run_pipeline(TARGETS, max_workers=4)
+                assert set(ran) == {
+                    stage.name
+                    for stage in pipeline_stages()
+                    if stage.name != "process_crash_cube"
+                }
+                assert run_pipeline(TARGETS) == []
+            else:
+                run_stages_from_disk()
+            workdirs[name] = workdir
+    return workdirs
+
+
+OUTPUTS = (
+    [
+        pipeline.TOWN_BOUNDARIES_PATH,
+        pipeline.OPENSPACE_PATH,
+        pipeline.ROAD_INTERSECTIONS_PATH,
+        pipeline.RESIDENTIAL_TAX_PARCELS_PATH,
+        pipeline.OPENSPACE_ACCESS_PATH,
+    ]
+    + [
+        simplified_path(pipeline.TOWN_BOUNDARIES_PATH, tolerance)
+        for tolerance in SIMPLIFY_TOLERANCES
+    ]
+    + [town.assessor_db_path for town in TOWNS]
+    + [source_hashes_path(town.assessor_db_path) for town in TOWNS]
+)
+
+
+@pytest.mark.parametrize("output", OUTPUTS)
+def test_pipeline_matches_stages(workdirs, output):
+    pd.testing.assert_frame_equal(
+        read_artifact(workdirs["pipeline"] / output),
+        read_artifact(workdirs["stages"] / output),
+    )
+
+
+def test_town_ids_match(workdirs):
+    assert (workdirs["pipeline"] / TOWN_IDS_PATH).read_text() == (
+        workdirs["stages"] / TOWN_IDS_PATH
+    ).read_text()
+
+
+def test_artifact_store_hands_out_frames_as_read_back(tmp_path):
+    store = ArtifactStore()
+    towns = synthetic.town_polygons().head(3).assign(A_LONG_COLUMN_NAME=1)
+    store.save(tmp_path / "towns.shp", towns)
+    store.save(tmp_path / "towns.pkl", towns)
+    # Shapefiles truncate column names; pickles round-trip exactly
+    assert "A_LONG_COL" in store.load(tmp_path / "towns.shp")
+    assert store.load(tmp_path / "towns.pkl") is towns
+
+
+def test_artifact_store_keeps_only_consumed_frames(tmp_path):
+    store = ArtifactStore(consumed={tmp_path / "towns.pkl"})
+    towns = synthetic.town_polygons().head(3)
+    store.save(tmp_path / "towns.pkl", towns)
+    store.save(tmp_path / "unused.pkl", towns)
+    assert store.load(tmp_path / "towns.pkl") is towns
+    # Frames no later stage loads are written but not kept
+    assert store.load(tmp_path / "unused.pkl") is not towns
+
+
+def test_stage_deps_include_shared_code():
+    for stage in pipeline_stages():
+        assert artifacts.__file__ in stage.deps
+        assert pipeline.__file__ in stage.deps
+    assert set(pipeline.code_deps(process_assessor_db)) >= {
+        process_assessor_db.__file__,
+        validation.__file__,
+        # Through ``milton_maps.transform_use_codes``
+        str(Path(pipeline.__file__).with_name("milton_maps.py")),
+    }
@@ -0,0 +1,161 @@
+"""Tests for cleaning, updating and compacting assessor DBs."""
+import json
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from milton_maps.artifacts import read_artifact
+from milton_maps.compact import compact_frame, memory_report
+from milton_maps.process_assessor_db import (
+    ASSESSOR_CATEGORICAL_COLUMNS,
+    SOURCE_HASH_COLUMN,
+    clean_assessor_db,
+    process_assessor_db,
+    source_hashes,
+    source_hashes_path,
+    update_assessor_db,
+)
+from milton_maps.process_assessor_dbs import process_assessor_dbs
+from milton_maps.process_town_boundaries import TOWN_IDS_PATH
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+N_PARCELS = 1_000
+
+
+@pytest.fixture(scope="module")
+def town_ids_map():
+    towns = synthetic.town_polygons().drop_duplicates("TOWN_ID")
+    return {str(k): v for k, v in zip(towns.TOWN_ID, towns.TOWN)}
+
+
+@pytest.fixture(scope="module")
+def records():
+    return synthetic.assessor_records(
+        synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, N_PARCELS)
+    )
+
+
+def test_update_assessor_db(records, town_ids_map):
+    previous = clean_assessor_db(records.copy(), town_ids_map)
+    next_year = synthetic.next_fiscal_year(records, churn=0.02)
+    updated, changes = update_assessor_db(
+        next_year.copy(), previous, source_hashes(records, town_ids_map), town_ids_map
+    )
+
+    pd.testing.assert_frame_equal(
+        updated, clean_assessor_db(next_year.copy(), town_ids_map)
+    )
+    # 2% of the parcels are revalued, and as many again removed and added
+    assert changes["CHANGE"].value_counts().to_dict() == {
+        "added": 20,
+        "removed": 20,
+        "changed": 20,
+    }
+    changed = changes[changes["CHANGE"] == "changed"]
+    assert (changed["CHANGED_COLUMNS"] == "TOTAL_VAL").all()
+    assert set(changes.loc[changes["CHANGE"] == "added", "PROP_ID"]) == {
+        f"N{k}" for k in range(20)
+    }
+
+
+def test_update_assessor_db_without_changes(records, town_ids_map):
+    previous = clean_assessor_db(records.copy(), town_ids_map)
+    updated, changes = update_assessor_db(
+        records.copy(), previous, source_hashes(records, town_ids_map), town_ids_map
+    )
+    pd.testing.assert_frame_equal(updated, previous)
+    assert changes.empty
+
+
+def test_update_assessor_db_after_cleaning_inputs_change(records, town_ids_map):
+    previous = clean_assessor_db(records.copy(), town_ids_map)
+    renamed = {**town_ids_map, str(synthetic.MILTON_TOWN_ID): "MILTON VILLAGE"}
+    updated, changes = update_assessor_db(
+        records.copy(), previous, source_hashes(records, town_ids_map), renamed
+    )
+    # Unchanged records are reprocessed too, rather than keeping last year's TOWN
+    pd.testing.assert_frame_equal(updated, clean_assessor_db(records.copy(), renamed))
+    assert (changes["CHANGE"] == "changed").all()
+    assert (changes["CHANGED_COLUMNS"] == "TOWN").all()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, town_ids_map):
+    """Working directory with the town IDs written by process_town_boundaries"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data/processed").mkdir(parents=True)
+    (tmp_path / TOWN_IDS_PATH).write_text(json.dumps(town_ids_map))
+    return tmp_path
+
+
+def test_process_assessor_db_source_hashes(workdir, records):
+    layer = f"M{synthetic.MILTON_TOWN_ID:03d}Assess"
+    # Written as GeoPackage; GDAL reads it by content regardless of the extension
+    gdb_paths = [workdir / f"FY{year}.gdb" for year in (22, 23)]
+    records.to_file(gdb_paths[0], layer=layer, driver="GPKG")
+    synthetic.next_fiscal_year(records).to_file(
+        gdb_paths[1], layer=layer, driver="GPKG"
+    )
+
+    process_assessor_db(str(gdb_paths[0]), layer, "FY22.pkl")
+    # The hashes are kept next to the output, which has the columns of a full reprocessing
+    assert Path("_source_hashes/FY22.parquet").exists()
+    assessor_db = read_artifact("FY22.pkl")
+    assert SOURCE_HASH_COLUMN not in assessor_db.columns
+    hashes = read_artifact(source_hashes_path("FY22.pkl"))[SOURCE_HASH_COLUMN]
+    pd.testing.assert_index_equal(hashes.index, assessor_db.index)
+
+    process_assessor_db(
+        str(gdb_paths[1]),
+        layer,
+        "FY23.pkl",
+        previous_path="FY22.pkl",
+        changes_path="changes.parquet",
+    )
+    assert len(read_artifact("changes.parquet")) == 60
+    assert list(read_artifact("FY23.pkl").columns) == list(assessor_db.columns)
+
+
+def test_process_assessor_dbs_read_as_one_dataset(workdir):
+    input_dir = workdir / "data/raw/parcels_gdb"
+    input_dir.mkdir(parents=True)
+    parcels = 0
+    for town_id in (synthetic.MILTON_TOWN_ID, synthetic.QUINCY_TOWN_ID):
+        records = synthetic.assessor_records(synthetic.tax_parcels(town_id, 200))
+        records.to_file(
+            input_dir / f"M{town_id:03d}_parcels_CY22_FY22_sde.gdb",
+            layer=f"M{town_id:03d}Assess",
+            driver="GPKG",
+        )
+        parcels += len(records)
+
+    output_dir = workdir / "data/processed/assessor_dbs"
+    process_assessor_dbs(input_dir, output_dir, max_workers=2)
+    # Updating in place adds change logs next to the source hashes
+    written = process_assessor_dbs(input_dir, output_dir, incremental=True)
+    assert (output_dir / "_changes").is_dir()
+    assert (output_dir / "_source_hashes").is_dir()
+
+    # The source hashes and change logs aren't read as parcels
+    assessor_dbs = read_artifact(output_dir)
+    assert len(assessor_dbs) == parcels
+    assert assessor_dbs["TOWN"].notna().all()
+    pd.testing.assert_index_equal(
+        assessor_dbs.index,
+        pd.concat([read_artifact(path) for path in written]).index,
+    )
+
+
+def test_compact_assessor_db(records, town_ids_map):
+    assessor_db = clean_assessor_db(records.copy(), town_ids_map)
+    compacted = compact_frame(assessor_db, ASSESSOR_CATEGORICAL_COLUMNS)
+    pd.testing.assert_frame_equal(
+        compacted.astype(assessor_db.dtypes.to_dict()), assessor_db
+    )
+    assert (
+        memory_report(compacted).loc["TOTAL", "bytes"]
+        < memory_report(assessor_db).loc["TOTAL", "bytes"] / 2
+    )
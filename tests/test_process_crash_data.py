@@ -0,0 +1,119 @@
+"""Tests for reading crash records and splitting Randolph Avenue crashes."""
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import LineString, Point
+
+from milton_maps import process_crash_data
+from milton_maps.process_crash_data import (
+    INJURY_MAP,
+    crash_cleaning_digest,
+    randolph_ave_upstream_vs_intersection,
+    read_crash_data,
+)
+from milton_maps.process_road_intersections import find_intersections
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+TOWN_IDS = [synthetic.MILTON_TOWN_ID, synthetic.QUINCY_TOWN_ID]
+
+
+@pytest.fixture(scope="module")
+def crash_records():
+    return synthetic.crash_records(5_000, TOWN_IDS)
+
+
+@pytest.fixture(scope="module")
+def crash_csv(tmp_path_factory, crash_records):
+    path = tmp_path_factory.mktemp("crashes") / "CrashDetails.csv"
+    synthetic.write_crash_csv(crash_records, path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def town_boundaries():
+    return synthetic.town_polygons().dissolve("TOWN_ID")[["TOWN", "geometry"]]
+
+
+def test_read_crash_data(crash_records, crash_csv, town_boundaries):
+    crashes = read_crash_data(
+        crash_csv, town_boundaries=town_boundaries, town_ids=[synthetic.MILTON_TOWN_ID]
+    )
+    # Milton is split into parts separated by 1 m gaps, where crashes belong to no town
+    x0, _ = synthetic.town_origin(synthetic.MILTON_TOWN_ID)
+    part_width = synthetic.TOWN_SIZE / (1 + synthetic.MILTON_TOWN_ID % 3)
+    in_part = (crash_records.X_Cooordinate - x0) % part_width <= part_width - 1
+    expected = crash_records[
+        (crash_records.City_Town_Name == f"TOWN {synthetic.MILTON_TOWN_ID}") & in_part
+    ]
+    assert crashes.Crash_Number.tolist() == expected.Crash_Number.tolist()
+    assert (crashes.TOWN_ID == synthetic.MILTON_TOWN_ID).all()
+    assert crashes.severity.astype(object).tolist() == (
+        expected.Maximum_Injury_Severity_Reported.fillna("Unknown")
+        .map(INJURY_MAP)
+        .tolist()
+    )
+    assert crashes.crs == "EPSG:26986"
+
+
+def test_read_crash_data_chunked_matches_eager(crash_csv, town_boundaries):
+    eager = read_crash_data(crash_csv, town_boundaries=town_boundaries)
+    chunked = read_crash_data(
+        crash_csv, town_boundaries=town_boundaries, chunksize=1_000
+    )
+    pd.testing.assert_frame_equal(eager, chunked)
+
+
+def test_read_crash_data_checks_arguments_first(tmp_path):
+    # Raised before the CSV, which doesn't even exist, is read
+    with pytest.raises(ValueError, match="requires town_boundaries"):
+        read_crash_data(tmp_path / "missing.csv", town_ids=[synthetic.MILTON_TOWN_ID])
+
+
+def test_crash_cleaning_digest(monkeypatch):
+    digest = crash_cleaning_digest()
+    assert crash_cleaning_digest() == digest
+    monkeypatch.setattr(
+        process_crash_data, "INJURY_MAP", {**INJURY_MAP, "Not reported": "No Injury"}
+    )
+    assert crash_cleaning_digest() != digest
+    monkeypatch.setattr(process_crash_data, "INJURY_MAP", INJURY_MAP)
+    monkeypatch.setattr(process_crash_data, "CRASH_DATETIME_FORMAT", "%Y-%m-%d %H:%M")
+    assert crash_cleaning_digest() != digest
+
+
+def test_randolph_ave_upstream_vs_intersection():
+    crs = "EPSG:26986"
+    roads = gpd.GeoDataFrame(
+        {
+            "CITY": [189] * 4,
+            "STREETNAME": ["RANDOLPH AVE"] * 2 + ["CHICKATAWBUT RD"] * 2,
+            "RT_NUMBER": ["28", "28", None, None],
+        },
+        geometry=[
+            LineString([(0, 0), (500, 0)]),
+            LineString([(500, 0), (1000, 0)]),
+            LineString([(500, -500), (500, 0)]),
+            LineString([(500, 0), (500, 500)]),
+        ],
+        crs=crs,
+    )
+    crashes = gpd.GeoDataFrame(
+        {"severity": ["Minor Injury"] * 5},
+        geometry=[
+            Point(505, 5),  # at the intersection
+            Point(200, 10),  # on Randolph Avenue, upstream
+            Point(800, -15),  # on Randolph Avenue, downstream
+            Point(500, 300),  # on Chickatawbut Road only
+            Point(200, 100),  # on neither
+        ],
+        crs=crs,
+    )
+    intersection, upstream, combined = randolph_ave_upstream_vs_intersection(
+        crashes, roads.iloc[:2], find_intersections(roads)
+    )
+    assert intersection.index.tolist() == [0]
+    assert upstream.index.tolist() == [1, 2]
+    assert combined["where"].tolist() == ["intersection", "upstream", "upstream"]
+    assert upstream.ROUTE.tolist() == ["189 / 28 / randolph ave"] * 2
@@ -0,0 +1,77 @@
+"""Tests for joining residential assessor records to tax parcels."""
+import pandas as pd
+import pytest
+
+from milton_maps.artifacts import read_artifact, write_artifact
+from milton_maps.process_assessor_db import clean_assessor_db
+from milton_maps.process_tax_parcels import ASSESSOR_COLUMNS, process_tax_parcels
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+TOWN_IDS = [synthetic.MILTON_TOWN_ID, synthetic.QUINCY_TOWN_ID]
+
+
+@pytest.fixture(scope="module")
+def town_paths(tmp_path_factory):
+    """Tax parcel shapefiles and processed assessor DBs of two towns"""
+    directory = tmp_path_factory.mktemp("parcels")
+    towns = synthetic.town_polygons().drop_duplicates("TOWN_ID")
+    town_ids_map = {str(k): v for k, v in zip(towns.TOWN_ID, towns.TOWN)}
+    tax_parcel_paths, assessor_db_paths = [], []
+    for town_id in TOWN_IDS:
+        parcels = synthetic.tax_parcels(town_id, 200)
+        tax_parcel_paths.append(str(directory / f"M{town_id:03d}TaxPar.shp"))
+        parcels.to_file(tax_parcel_paths[-1])
+        assessor_db = clean_assessor_db(
+            synthetic.assessor_records(parcels), town_ids_map
+        )
+        assessor_db_paths.append(str(directory / f"M{town_id:03d}Assess.pkl"))
+        write_artifact(assessor_db, assessor_db_paths[-1])
+    return tax_parcel_paths, assessor_db_paths
+
+
+def test_process_tax_parcels_keeps_tax_parcel_columns(tmp_path, town_paths):
+    output_path = tmp_path / "residential_tax_parcels.pkl"
+    process_tax_parcels(*town_paths, str(output_path))
+    parcels = read_artifact(output_path)
+
+    tax_parcel_columns = list(read_artifact(town_paths[0][0]).columns.drop("LOC_ID"))
+    assert tax_parcel_columns == [
+        "MAP_PAR_ID",
+        "POLY_TYPE",
+        "MAP_NO",
+        "SOURCE",
+        "LAST_EDIT",
+        "TOWN_ID",
+        "geometry",
+    ]
+    assert list(parcels.columns) == tax_parcel_columns + ASSESSOR_COLUMNS
+    assert parcels.IS_RESIDENTIAL.all()
+    assert set(parcels.TOWN_ID.dropna()) == set(TOWN_IDS)
+
+
+def test_process_tax_parcels_directory_output(tmp_path, town_paths):
+    process_tax_parcels(*town_paths, str(tmp_path / "residential_tax_parcels.pkl"))
+    process_tax_parcels(*town_paths, str(tmp_path / "residential_tax_parcels"))
+    combined = read_artifact(tmp_path / "residential_tax_parcels.pkl")
+    appended = read_artifact(tmp_path / "residential_tax_parcels")
+    assert list(appended.columns) == list(combined.columns)
+    pd.testing.assert_index_equal(appended.index.sort_values(), combined.index)
+
+
+def test_process_tax_parcels_keeps_other_files(tmp_path, town_paths):
+    output_dir = tmp_path / "processed"
+    output_dir.mkdir()
+    other_path = output_dir / "road_intersections.parquet"
+    other_path.write_bytes(b"not parcels")
+    with pytest.raises(ValueError, match="road_intersections.parquet"):
+        process_tax_parcels(*town_paths, str(output_dir))
+    assert other_path.read_bytes() == b"not parcels"
+    assert list(output_dir.iterdir()) == [other_path]
+
+    # Re-running into the stage's own directory replaces its files
+    output_dir = tmp_path / "residential_tax_parcels"
+    process_tax_parcels(*town_paths, str(output_dir))
+    process_tax_parcels(*town_paths, str(output_dir))
+    assert len(list(output_dir.glob("*.parquet"))) == len(TOWN_IDS)
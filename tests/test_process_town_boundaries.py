@@ -0,0 +1,57 @@
+"""Tests for the simplified town boundaries."""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Polygon, box
+
+from milton_maps.process_town_boundaries import simplify_town_boundaries
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+@pytest.fixture
+def town_boundaries():
+    """Two towns sharing a wiggling border, a third meeting both, and a fourth enclosed in
+    the first"""
+    x = np.linspace(0, 1000, 201)
+    border = list(zip(x, 500 + 8 * np.sin(x / 7)))
+    island = box(200, 200, 260, 260)
+    towns = [
+        Polygon([(0, 0), (1000, 0), *border[::-1]]).difference(island),
+        Polygon([*border, (1000, 1000), (0, 1000)]),
+        box(1000, 0, 1500, 1000),
+        island,
+    ]
+    return gpd.GeoDataFrame(
+        {"TOWN": ["A", "B", "C", "D"]},
+        geometry=towns,
+        index=pd.Index([1, 2, 3, 4], name="TOWN_ID"),
+        crs="EPSG:26986",
+    )
+
+
+@pytest.mark.parametrize("tolerance", [5, 25, 100])
+def test_simplified_towns_share_borders(town_boundaries, tolerance):
+    simplified = simplify_town_boundaries(town_boundaries, tolerance)
+    assert simplified.is_valid.all()
+    assert list(simplified.TOWN) == list(town_boundaries.TOWN)
+    # No gaps or overlaps between the towns, which still cover the same area
+    union = simplified.unary_union
+    assert simplified.area.sum() == pytest.approx(union.area)
+    assert union.symmetric_difference(town_boundaries.unary_union).area < 1e-6
+    # The enclosed town keeps its shape, and is still a hole of the first
+    assert simplified.geometry[4].equals(town_boundaries.geometry[4])
+    assert simplified.geometry[1].intersection(simplified.geometry[4]).area == 0
+
+
+def test_shared_border_simplified_once(town_boundaries):
+    simplified = simplify_town_boundaries(town_boundaries, 25)
+    border = simplified.geometry[1].intersection(simplified.geometry[2])
+    assert border.length == pytest.approx(1000, rel=0.01)
+    # The border lost most of its 201 vertices, and is the same line on both sides
+    parts = getattr(border, "geoms", [border])
+    assert sum(len(part.coords) for part in parts) < 20
+    assert simplified.geometry[1].boundary.intersection(
+        simplified.geometry[2].boundary
+    ).length == pytest.approx(border.length)
@@ -0,0 +1,65 @@
+"""Tests for quantized geometry storage."""
+import geopandas as gpd
+import pytest
+from shapely.geometry import LineString, MultiPoint, MultiPolygon, Point, box
+
+from milton_maps.artifacts import read_artifact, write_artifact
+from milton_maps.quantized import QuantizedGeometries, read_quantized
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+def assert_within(expected, actual, precision):
+    assert len(expected) == len(actual)
+    for e, a in zip(expected, actual):
+        if e is None:
+            assert a is None
+        else:
+            assert a.geom_type == e.geom_type
+            assert e.hausdorff_distance(a) <= precision
+
+
+def test_round_trip_mixed_geometries():
+    donut = (
+        Point(230_000, 900_000)
+        .buffer(100)
+        .difference(Point(230_005, 900_005).buffer(40))
+    )
+    geometries = gpd.GeoSeries(
+        [
+            donut,
+            None,
+            MultiPolygon([box(0, 0, 10, 10), donut]),
+            Point(1.234, 5.678),
+            LineString([(0, 0), (1, 1), (3, 0.5)]),
+            MultiPoint([(1, 1), (2, 2)]),
+        ],
+        crs=synthetic.CRS,
+    )
+    quantized = QuantizedGeometries.from_geoseries(geometries, 0.01)
+    assert_within(geometries, quantized.decode(), 0.01)
+    assert_within(geometries.iloc[[4, 2]], quantized.decode([4, 2]), 0.01)
+    assert quantized[0].equals(quantized.decode().iloc[0])
+
+
+def test_quantized_artifact(tmp_path):
+    parcels = synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, 500)
+    path = tmp_path / "parcels.parquet"
+    write_artifact(parcels, path, quantize=0.01)
+
+    read = read_artifact(path)
+    assert list(read.columns) == list(parcels.columns)
+    assert (read.index == parcels.index).all()
+    assert read.crs == parcels.crs
+    assert_within(parcels.geometry, read.geometry, 0.01)
+    assert list(read_artifact(path, columns=["LOC_ID"]).columns) == ["LOC_ID"]
+
+    frame = read_quantized(path, filters=[("POLY_TYPE", "==", "FEE")])
+    selected = frame.attributes.LOC_ID == parcels.LOC_ID.iloc[0]
+    assert frame.to_geodataframe(selected.values).LOC_ID.tolist() == [
+        parcels.LOC_ID.iloc[0]
+    ]
+
+    with pytest.raises(ValueError):
+        write_artifact(parcels, tmp_path / "parcels.shp.zip", quantize=0.01)
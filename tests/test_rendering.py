@@ -0,0 +1,57 @@
+"""Tests for rasterizing layers."""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Point, box
+
+from milton_maps.rendering import rasterize
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+@pytest.fixture
+def points():
+    """Points on the pixels of a 2 x 2 grid of 5 m pixels, two of them on the first pixel"""
+    return gpd.GeoDataFrame(
+        {
+            "kind": pd.Categorical(
+                ["b", "a", "c", None, "b"], categories=["a", "b", "c", "unused"]
+            ),
+            "value": [1.0, 3.0, 4.0, 5.0, np.nan],
+        },
+        geometry=[
+            Point(1, 1),
+            Point(2, 2),
+            Point(7, 2),
+            Point(2, 7),
+            Point(10, 10),
+        ],
+        crs="EPSG:26986",
+    )
+
+
+def test_rasterize_categorical_points(points):
+    raster = rasterize(points, "kind", resolution=5)
+    assert raster.categories == ["a", "b", "c", "unused"]
+    assert raster.extent == (1.0, 11.0, 1.0, 11.0)
+    # Rows run from south to north; the later point on a pixel covers the earlier one, and
+    # missing values aren't drawn
+    np.testing.assert_array_equal(raster.values, [[0, 2], [np.nan, 1]])
+
+
+def test_rasterize_numeric_points(points):
+    raster = rasterize(points, "value", categorical=False, resolution=5)
+    assert raster.categories is None
+    # The mean of the values on each pixel
+    np.testing.assert_array_equal(raster.values, [[2, 4], [5, np.nan]])
+
+
+def test_rasterize_polygons():
+    polygons = gpd.GeoDataFrame(
+        {"kind": ["a", "b"]},
+        geometry=[box(0, 0, 20, 10), box(10, 0, 20, 20)],
+        crs="EPSG:26986",
+    )
+    raster = rasterize(polygons, "kind", resolution=10)
+    np.testing.assert_array_equal(raster.values, [[0, 1], [np.nan, 1]])
@@ -0,0 +1,88 @@
+"""Tests for matching crashes to road segments and routes."""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+
+from milton_maps.road_corridors import (
+    assign_crashes_to_segments,
+    route_keys,
+    segment_ids,
+    segment_route_measures,
+)
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+@pytest.fixture(scope="module")
+def roads():
+    return synthetic.road_segments(synthetic.MILTON_TOWN_ID, 4)
+
+
+def test_segment_ids_are_stable(roads):
+    ids = segment_ids(roads)
+    assert len(set(ids)) == len(roads)
+    # Reading a different subset of the layer, in a different order, keeps the IDs
+    subset = roads.iloc[::-2].reset_index(drop=True)
+    assert list(segment_ids(subset)) == list(ids[::-2])
+
+
+def test_assign_crashes_to_segments(roads):
+    randolph_ave = roads[roads.STREETNAME == "RANDOLPH AVE"]
+    x0, y = randolph_ave.geometry.iloc[0].coords[0]
+    step = randolph_ave.length.iloc[0]
+    crashes = gpd.GeoDataFrame(
+        {"severity": ["Minor Injury", "No Injury", "Unknown"]},
+        geometry=[Point(x0 + 10, y + 5), Point(x0 + step + 20, y - 5), Point(0, 0)],
+        crs=roads.crs,
+    )
+    assigned = assign_crashes_to_segments(crashes, randolph_ave, tolerance=20)
+
+    ids = segment_ids(randolph_ave)
+    assert assigned.SEGMENT_ID.dtype == "Int64"
+    # Compared as Python ints, so that IDs rounded through float64 would differ
+    assert [int(i) for i in assigned.SEGMENT_ID[:2]] == [int(ids[0]), int(ids[1])]
+    assert assigned.ROUTE.tolist()[:2] == ["189 / 28 / randolph ave"] * 2
+    np.testing.assert_allclose(assigned.SEGMENT_DISTANCE[:2], [5, 5])
+    np.testing.assert_allclose(assigned.ROUTE_POSITION[:2], [10, step + 20])
+    assert assigned.iloc[2][["SEGMENT_ID", "ROUTE", "ROUTE_POSITION"]].isna().all()
+
+
+def test_only_requested_routes_are_measured(roads):
+    measures = segment_route_measures(roads, routes=["189 / 28 / randolph ave"])
+    is_randolph = (roads.STREETNAME == "RANDOLPH AVE").values
+    assert measures.ROUTE_START[is_randolph].notna().all()
+    assert measures.ROUTE_START[~is_randolph].isna().all()
+
+
+def test_routes_are_split_by_town():
+    other_town = synthetic.QUINCY_TOWN_ID
+    roads = pd.concat(
+        [
+            synthetic.road_segments(synthetic.MILTON_TOWN_ID, 4),
+            synthetic.road_segments(other_town, 4),
+        ],
+        ignore_index=True,
+    )
+    roads.loc[roads.STREETNAME == "AVE 1", ["STREETNAME", "RT_NUMBER"]] = None
+    keys = route_keys(roads)
+
+    randolph_ave = keys[roads.STREETNAME == "RANDOLPH AVE"]
+    assert set(randolph_ave) == {
+        f"{synthetic.MILTON_TOWN_ID} / 28 / randolph ave",
+        f"{other_town} / 28 / randolph ave",
+    }
+    # Each unnamed segment is a route of its own, starting at the segment
+    unnamed = roads.STREETNAME.isna()
+    assert keys[unnamed].str.contains(" / unnamed ").all()
+    assert keys[unnamed].is_unique
+    measures = segment_route_measures(roads)
+    np.testing.assert_allclose(measures.ROUTE_START[unnamed], 0)
+    np.testing.assert_allclose(measures.ROUTE_END[unnamed], roads.length[unnamed])
+    # Randolph Avenue is measured along its blocks in each town separately
+    is_randolph = roads.STREETNAME == "RANDOLPH AVE"
+    assert measures.ROUTE_END[is_randolph].max() == pytest.approx(
+        roads.length[is_randolph].sum() / 2
+    )
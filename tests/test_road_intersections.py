@@ -0,0 +1,86 @@
+"""Tests for deriving road intersections and classifying crash locations."""
+import geopandas as gpd
+import pytest
+from shapely.geometry import LineString, Point
+
+from milton_maps.process_road_intersections import (
+    classify_crash_locations,
+    find_intersections,
+    intersection_ids,
+)
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+CRS = "EPSG:26986"
+
+
+def roads(segments):
+    return gpd.GeoDataFrame(
+        {"STREETNAME": [name for name, _ in segments]},
+        geometry=[LineString(coords) for _, coords in segments],
+        crs=CRS,
+    )
+
+
+NETWORK = [
+    # Two unnamed streets crossing
+    (None, [(0, 0), (100, 100)]),
+    (None, [(0, 100), (100, 0)]),
+    # A street split into consecutive segments, which branches at (300, 0)
+    ("MAIN ST", [(200, 0), (300, 0)]),
+    ("MAIN ST", [(300, 0), (400, 0)]),
+    ("MAIN ST", [(300, 0), (350, 50)]),
+    ("MAIN ST", [(400, 0), (500, 0)]),
+    # A street ending in the middle of an unsplit one
+    ("ADAMS ST", [(600, 0), (800, 0)]),
+    ("CENTRE ST", [(700, 0), (700, 100)]),
+    # A street turning into another at a corner
+    ("CENTRE ST", [(700, 100), (700, 200)]),
+    ("ELM ST", [(700, 200), (800, 200)]),
+]
+
+
+def test_intersections_from_topology():
+    intersections = find_intersections(roads(NETWORK))
+    assert intersections[["X", "Y", "N_SEGMENTS", "STREETS"]].values.tolist() == [
+        [50.0, 50.0, 2, ""],
+        [300.0, 0.0, 3, "MAIN ST"],
+        [700.0, 0.0, 2, "ADAMS ST & CENTRE ST"],
+    ]
+    assert intersections.index.is_monotonic_increasing
+
+
+def test_street_grid_intersections():
+    intersections = find_intersections(
+        synthetic.road_segments(synthetic.MILTON_TOWN_ID, 10)
+    )
+    # The 8 x 8 inner nodes of the 10 x 10 grid join 4 segments, the 4 x 8 nodes on its edges
+    # join 3, and its corners, where a street turns into an avenue, aren't junctions
+    assert intersections.N_SEGMENTS.value_counts().to_dict() == {4: 64, 3: 32}
+    # Randolph Avenue is an inner street, crossed by all 10 avenues
+    assert intersections.STREETS.str.contains("RANDOLPH AVE").sum() == 10
+
+
+def test_intersection_ids_are_stable():
+    intersections = find_intersections(roads(NETWORK))
+    # Roads elsewhere, read first, don't change the IDs of the existing nodes
+    elsewhere = [("A ST", [(-500, -10), (-500, 10)]), ("B ST", [(-510, 0), (-490, 0)])]
+    extended = find_intersections(roads(elsewhere + NETWORK))
+    assert intersections.index.isin(extended.index).all()
+    assert len(extended) == len(intersections) + 1
+    assert list(intersections.index) == list(
+        intersection_ids(intersections[["X", "Y"]].values / 0.5)
+    )
+
+
+def test_classify_crash_locations():
+    intersections = find_intersections(roads(NETWORK))
+    crashes = gpd.GeoDataFrame(
+        geometry=[Point(55, 50), Point(300, 30), Point(450, 5)], crs=CRS
+    )
+    classified = classify_crash_locations(crashes, intersections, radius=20)
+    assert classified.LOCATION.tolist() == ["intersection", "mid-block", "mid-block"]
+    assert classified.INTERSECTION_ID.iloc[0] == intersections.index[0]
+    assert classified.INTERSECTION_DISTANCE.iloc[0] == pytest.approx(5)
+    assert classified.INTERSECTION_ID.iloc[1:].isna().all()
@@ -0,0 +1,78 @@
+"""Tests for the `milton_maps serve` query service."""
+import json
+import urllib.error
+
+import pytest
+
+from milton_maps import serve
+from milton_maps.process_crash_data import _clean_crash_records
+from milton_maps.serve import LayerService, running_service
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+@pytest.fixture(scope="module")
+def client():
+    crashes = _clean_crash_records(
+        synthetic.crash_records(2_000, [synthetic.MILTON_TOWN_ID])
+    )
+    parcels = synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, 1_000)
+    service = LayerService({"crashes": crashes, "parcels": parcels.set_index("LOC_ID")})
+    with running_service(service) as client:
+        yield client
+
+
+def test_catalog(client):
+    catalog = client.get("/layers")
+    assert catalog["parcels"]["features"] == 1_000
+    assert "severity" in catalog["crashes"]["fields"]
+
+
+def test_bbox_and_attribute_query(client):
+    west, south, _, _ = client.get("/layers")["parcels"]["bounds"]
+    bbox = f"{west},{south},{west + 0.01},{south + 0.01}"
+    parcels = client.get("/layers/parcels", bbox=bbox, fields="TOWN_ID")
+    assert 0 < parcels["numberReturned"] < 1_000
+    assert set(parcels["features"][0]["properties"]) == {"TOWN_ID"}
+
+    severe = client.get("/layers/crashes", severity=["Fatal Injury", "Major Injury"])
+    assert {f["properties"]["severity"] for f in severe["features"]} == {
+        "Fatal Injury",
+        "Major Injury",
+    }
+
+
+def test_bad_queries(client):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.get("/layers/no_such_layer")
+    assert error.value.code == 404
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.get("/layers/crashes", bbox="1,2")
+    assert error.value.code == 400
+
+
+def test_unexpected_errors(monkeypatch):
+    service = LayerService(
+        {"parcels": synthetic.tax_parcels(synthetic.MILTON_TOWN_ID, 10)}
+    )
+
+    def fail(name, key):
+        raise RuntimeError("corrupt layer")
+
+    monkeypatch.setattr(service, "_query", fail)
+    with running_service(service) as client:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            client.get("/layers/parcels")
+        assert error.value.code == 500
+        assert json.load(error.value) == {"error": "Internal server error"}
+        # The server keeps answering
+        assert client.get("/layers")["parcels"]["features"] == 10
+
+
+def test_default_layers_read_from_project_root(tmp_path, monkeypatch):
+    paths = []
+    monkeypatch.setattr(serve, "read_artifact", paths.append)
+    monkeypatch.chdir(tmp_path)
+    serve.DEFAULT_LAYERS["towns"]()
+    assert paths == [serve.ROOT_DIR / "data/processed/town_boundaries.shp.zip"]
@@ -0,0 +1,109 @@
+"""Tests for the cached validation suites."""
+import pandas as pd
+import pytest
+
+from milton_maps import cache, process_town_boundaries
+from milton_maps.process_town_boundaries import (
+    TOWN_BOUNDARIES_VALIDATION,
+    build_town_boundaries,
+)
+from milton_maps.validation import Check, ValidationError, ValidationSuite
+from tests import synthetic
+
+pytestmark = pytest.mark.filterwarnings("ignore::UserWarning")
+
+
+def counting_suite(tmp_path, calls, **kwargs):
+    # Only the name of a callable enters the suite's fingerprint, not the calls it recorded
+    record = calls.append
+
+    def is_positive(frame):
+        record(len(frame))
+        return frame["value"] > 0
+
+    return ValidationSuite(
+        "values",
+        [
+            Check("has values", lambda frame: "value" in frame),
+            Check("values are positive", is_positive, rows=True),
+        ],
+        sample_rows=10,
+        cache_dir=tmp_path,
+        **kwargs,
+    )
+
+
+def test_results_cached_by_content(tmp_path):
+    calls = []
+    suite = counting_suite(tmp_path, calls)
+    frame = pd.DataFrame({"value": range(1, 101)})
+
+    assert suite.validate(frame, mode="sampled")["rows"] == 10
+    assert suite.validate(frame, mode="sampled")["cached"]
+    assert not suite.validate(frame, mode="full")["cached"]
+    # A full validation also covers sampled ones
+    assert suite.validate(frame.copy(), mode="sampled")["mode"] == "full"
+    assert calls == [10, 100]
+
+    suite.validate(frame.assign(value=frame.value + 1), mode="full")
+    assert calls == [10, 100, 100]
+
+
+def test_uncached_suites_always_check(tmp_path):
+    calls = []
+    suite = counting_suite(tmp_path, calls, cache=False)
+    frame = pd.DataFrame({"value": range(1, 101)})
+
+    assert not suite.validate(frame, mode="full")["cached"]
+    assert not suite.validate(frame, mode="full")["cached"]
+    assert calls == [100, 100]
+    assert not list(tmp_path.iterdir())
+
+
+def test_failures_report_rows(tmp_path):
+    suite = counting_suite(tmp_path, [])
+    frame = pd.DataFrame({"value": [1, -1, 2, -2]}, index=list("abcd"))
+    with pytest.raises(ValidationError, match="2 of 4 rows fail, e.g. b, d"):
+        suite.validate(frame, mode="full")
+    with pytest.raises(ValidationError, match="has values"):
+        suite.validate(frame.rename(columns={"value": "other"}), mode="full")
+    assert not list(tmp_path.iterdir())
+
+
+def test_town_boundaries_validation(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    towns = synthetic.town_polygons()
+    assert build_town_boundaries(towns).shape == (351, 19)
+
+    missing_town = towns[towns.TOWN_ID != synthetic.MILTON_TOWN_ID]
+    with pytest.raises(ValidationError, match="one row per town"):
+        build_town_boundaries(missing_town, validation="sampled")
+
+
+def test_fingerprint_covers_values_read(tmp_path, monkeypatch):
+    threshold = 0
+
+    def suite():
+        return ValidationSuite(
+            "values",
+            [Check("values exceed the threshold", lambda frame: frame > threshold)],
+        )
+
+    fingerprint = suite().fingerprint()
+    assert suite().fingerprint() == fingerprint
+    threshold = 1
+    assert suite().fingerprint() != fingerprint
+
+    fingerprint = TOWN_BOUNDARIES_VALIDATION.fingerprint()
+    monkeypatch.setattr(process_town_boundaries, "MA_TOWN_COUNT", 352)
+    assert TOWN_BOUNDARIES_VALIDATION.fingerprint() != fingerprint
+
+
+def test_town_is_constant_within_towns(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    towns = synthetic.town_polygons()
+    # Town 2 is made of three polygons; name one of them differently
+    renamed = towns.copy()
+    renamed.loc[renamed.index[renamed.TOWN_ID == 2][0], "TOWN"] = "TOWN 2 NORTH"
+    with pytest.raises(ValidationError, match="TOWN is constant within each town"):
+        build_town_boundaries(renamed)